@@ -1,19 +1,27 @@
 from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
 from re import match
 from tkinter import simpledialog, messagebox
 from DbHandler import DbHandler
+from KeyDeriver import KeyDeriver
+from JobRunner import JobRunner
+from Metrics import Metrics
 
 class Authenticator:
     """Handles user authentication operations."""
 
-    def __init__(self):
-        """Initialize the Authenticator."""
+    def __init__(self, job_runner=None):
+        """Initialize the Authenticator.
+
+        Args:
+            job_runner (JobRunner): Runs the password hashing. Hashing runs synchronously if not given.
+        """
+        self.job_runner = job_runner or JobRunner()
         self.logged_in = False
         self.current_user = None
         self.db_handler = DbHandler()
         self.password_hasher = PasswordHasher(time_cost=1, memory_cost=47104, parallelism=1) # https://cheatsheetseries.owasp.org/cheatsheets/Password_Storage_Cheat_Sheet.html#argon2id
 
+    @Metrics.timed('auth.hash_password')
     def hash_password(self, password):
         """Hashes the given password using Argon2id.
 
@@ -26,6 +34,7 @@ class Authenticator:
         hashed_password = self.password_hasher.hash(password)
         return hashed_password
 
+    @Metrics.timed('auth.verify_password')
     def verify_password(self, hashed_password, password):
         """Verifies if the given password matches the hashed password.
 
@@ -53,11 +62,14 @@ class Authenticator:
             """
         return self.password_hasher.check_needs_rehash(hashed_password)
 
-    def sign_up(self):
-        """Registers a new user."""
+    def sign_up(self, on_done=None):
+        """Registers a new user. The password is hashed in a worker.
+
+        Args:
+            on_done (callable): Called without arguments once the user is signed up.
+        """
         email = ''
         email_validate_pattern = r"^\S+@\S+\.\S+$" # https://uibakery.io/regex-library/email-regex-python
-        self.db_handler.connect_db()
         while not match(email_validate_pattern, email):
             email = simpledialog.askstring('Email', 'Enter email:')
             if not email:
@@ -87,17 +99,25 @@ class Authenticator:
         if not name:
             messagebox.showerror('Error', 'Operation canceled.')
             return
-        hashed_password = self.hash_password(password)
-        self.db_handler.add_user(name, email, hashed_password)
-        self.logged_in = True
-        user_id = self.db_handler.get_user(email)[0]
-        self.current_user = CurrentUser(user_id, name)
-        messagebox.showinfo('Success', f'Signed up successfully as {self.current_user.name}')
 
-    def sign_in(self):
-        """Signs in a user."""
+        def finish_sign_up(hashed_password):
+            self.db_handler.add_user(name, email, hashed_password)
+            self.logged_in = True
+            user_id = self.db_handler.get_user(email)[0]
+            self.current_user = CurrentUser(user_id, name)
+            messagebox.showinfo('Success', f'Signed up successfully as {self.current_user.name}')
+            if on_done:
+                on_done()
+
+        self.job_runner.submit(self.hash_password, password, on_done=finish_sign_up)
+
+    def sign_in(self, on_done=None):
+        """Signs in a user. Passwords are verified in a worker.
+
+        Args:
+            on_done (callable): Called without arguments once the user is signed in.
+        """
         user = None
-        self.db_handler.connect_db()
         while not user:
             email = simpledialog.askstring('Email', 'Enter email:')
             if not email:
@@ -106,34 +126,59 @@ class Authenticator:
             user = self.db_handler.get_user(email)
             if not user:
                 messagebox.showerror('Error', 'User not found.')
+        self.ask_sign_in_password(user, 3, on_done, self.job_runner.widgets)
+
+    def ask_sign_in_password(self, user, attempts, on_done, widgets=()):
+        """Asks for the password of a user and verifies it in a worker.
+
+        Args:
+            user (tuple): The user row.
+            attempts (int): The number of attempts left.
+            on_done (callable): Called without arguments once the user is signed in.
+            widgets (tuple): The widgets disabled while the password is verified, kept disabled
+                for the retries, which are submitted after the first with block has exited.
+        """
+        if attempts == 0:
+            messagebox.showerror('Error', 'Maximum login attempts exceeded.')
+            return
+        password = simpledialog.askstring('Password', 'Enter password:', show='*')
+        if not password:
+            messagebox.showerror('Error', 'Operation canceled.')
+            return
+        with self.job_runner.using(*widgets):
+            self.job_runner.submit(self.verify_password, user[3], password,
+                                   on_done=lambda verified: self.finish_sign_in(user, password, attempts,
+                                                                                 verified, on_done, widgets))
+
+    def finish_sign_in(self, user, password, attempts, verified, on_done, widgets=()):
+        """Signs the user in if the password was verified, or asks for it again.
+
+        Args:
+            user (tuple): The user row.
+            password (str): The password that was verified.
+            attempts (int): The number of attempts left, including this one.
+            verified (bool): Whether the password matched.
+            on_done (callable): Called without arguments once the user is signed in.
+            widgets (tuple): The widgets disabled while the password is verified.
+        """
         user_id, name, stored_email, stored_password = user
-        attempts = 3
-        while attempts > 0:
-            password = simpledialog.askstring('Password', 'Enter password:', show='*')
-            if not password:
-                messagebox.showerror('Error', 'Operation canceled.')
-                return
-            try:
-                if self.verify_password(stored_password, password):
-                    if self.check_needs_rehash(stored_password):
-                        new_hash = self.hash_password(password)
-                        self.db_handler.update_user_password(user_id, new_hash)
-                    self.logged_in = True
-                    self.current_user = CurrentUser(user_id, name)
-                    messagebox.showinfo('Success',
-                                        f'Signed in successfully as {self.current_user.name}')
-                    return
-                else:
-                    attempts -= 1
-                    messagebox.showwarning('Warning', 'Incorrect password.')
-            except VerifyMismatchError as e:
-                attempts -= 1
-                messagebox.showwarning('Warning', 'Incorrect password.')
-        messagebox.showerror('Error', 'Maximum login attempts exceeded.')
+        if not verified:
+            messagebox.showwarning('Warning', 'Incorrect password.')
+            self.ask_sign_in_password(user, attempts - 1, on_done, widgets)
+            return
+        if self.check_needs_rehash(stored_password):
+            self.job_runner.submit(self.hash_password, password,
+                                   on_done=lambda new_hash: self.db_handler.update_user_password(user_id, new_hash))
+        self.logged_in = True
+        self.current_user = CurrentUser(user_id, name)
+        messagebox.showinfo('Success',
+                            f'Signed in successfully as {self.current_user.name}')
+        if on_done:
+            on_done()
 
     def sign_out(self):
-        """Signs out the current user."""
-        self.db_handler.disconnect_db()
+        """Signs out the current user and wipes the cached encryption keys."""
+        KeyDeriver.clear_cache()
         self.logged_in = False
         name = self.current_user.name
         self.current_user = None
@@ -0,0 +1,570 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from math import log2
+from os import SEEK_END
+from os.path import getsize
+from zlib import compressobj, decompressobj
+from lzma import LZMACompressor, LZMADecompressor
+from secrets import token_bytes
+from struct import Struct
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from Metrics import Metrics
+from MappedBuffer import MappedBuffer
+
+class CryptoContainer:
+    """Encrypts and decrypts files with AES-256-GCM in a streamed, chunked container.
+
+    The container starts with a header holding the KDF parameters, the salt, a random nonce
+    prefix and the chunk size. The plaintext follows as fixed-size chunks, each encrypted and
+    authenticated on its own with the header as associated data. The nonce of a chunk is the
+    nonce prefix, the chunk counter and a flag marking the final chunk, so chunks cannot be
+    reordered, dropped or truncated without detection. The final chunk is always shorter than
+    the chunk size (possibly empty), so only one chunk is held in memory at a time. Files on
+    disk and in memory are read through a MappedBuffer, so chunks are encrypted and decrypted
+    straight from the mapping without being copied first.
+
+    Version 2 containers record a compression method in the header. The plaintext is then
+    compressed with zlib or LZMA as a stream before it is split into chunks, and decrypt
+    decompresses it chunk by chunk. Version 1 containers are uncompressed.
+
+    Since every chunk is authenticated on its own, large uncompressed files on disk can be
+    encrypted and decrypted with their chunks spread over worker processes. The output is the
+    same as the sequential one.
+
+    Files in the legacy single-shot format (nonce, ciphertext and tag, salt) can still be
+    decrypted.
+    """
+
+    MAGIC = b'CCEN'
+    VERSION = 2
+    HEADER = Struct('>4sBIIB16s7sI') # Magic, version, time cost, memory cost, parallelism, salt, nonce prefix, chunk size
+    COMPRESSION_HEADER = Struct('>B') # Index of the compression method in COMPRESSIONS, from version 2
+    NONCE = Struct('>7sIB') # Nonce prefix, chunk counter, final chunk flag
+    TAG_SIZE = 16
+    DEFAULT_CHUNK_SIZE = 1 << 20
+    LEGACY_NONCE_SIZE = 12
+    LEGACY_SALT_SIZE = 16
+    COMPRESSION_NONE = 'none'
+    COMPRESSION_ZLIB = 'zlib'
+    COMPRESSION_LZMA = 'lzma'
+    COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_LZMA)
+    ENTROPY_SAMPLE_SIZE = 64 * 1024
+    MAX_COMPRESSIBLE_ENTROPY = 7.5 # Bits per byte, JPEG and deflated PNG data is close to 8
+    PARALLEL_MIN_CHUNKS = 16
+    PARALLEL_RANGES_PER_WORKER = 4 # Smaller ranges balance the load and report progress more often
+    MAX_KDF_COST_FACTOR = 4 # Containers may use up to this multiple of the configured time and memory costs
+    MAX_PARALLELISM = 16
+    MAX_CHUNK_SIZE = 64 << 20
+
+    def __init__(self, derive_key, kdf_params, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Initialize the CryptoContainer.
+
+        Args:
+            derive_key (callable): Called as derive_key(password, salt, time_cost, memory_cost,
+                parallelism) and returns a 32-byte key.
+            kdf_params (tuple): The time cost, memory cost and parallelism for new containers.
+            chunk_size (int): The plaintext size of a chunk in new containers.
+
+        """
+        self.derive_key = derive_key
+        self.kdf_params = kdf_params
+        self.chunk_size = chunk_size
+
+    def open_stream(self, target, mode):
+        """Opens a path, or wraps an already open file object so that it is left open.
+
+        Args:
+            target (str or file-like): The path or file object.
+            mode (str): The mode used for paths.
+
+        Returns:
+            A context manager yielding the file object.
+
+        """
+        if isinstance(target, str):
+            return open(target, mode)
+        return nullcontext(target)
+
+    def get_size(self, stream):
+        """Returns the size of a seekable file object without moving its position.
+
+        Args:
+            stream (file-like): The file object.
+
+        Returns:
+            int: The size in bytes.
+
+        """
+        position = stream.tell()
+        size = stream.seek(0, SEEK_END)
+        stream.seek(position)
+        return size
+
+    def iter_chunks(self, stream, mapped, view, chunk_size):
+        """Yields the pieces of a file up to and including the first one shorter than chunk_size.
+
+        Pieces of a mapped file are discarded from memory once the caller is done with them.
+
+        Args:
+            stream (file-like): The file object, read when there is no view.
+            mapped (MappedBuffer): The mapping of the file.
+            view (memoryview): The view of the mapping, or None if the file is not mapped.
+            chunk_size (int): The size of a piece.
+
+        Yields:
+            memoryview or bytes: The pieces, the last one shorter than chunk_size and possibly empty.
+
+        """
+        position = 0
+        while True:
+            if view is not None:
+                chunk = view[position:position + chunk_size]
+                position += len(chunk)
+            else:
+                chunk = stream.read(chunk_size)
+            yield chunk
+            mapped.discard(position)
+            if len(chunk) < chunk_size:
+                return
+
+    def get_nonce(self, nonce_prefix, counter, final):
+        """Builds the nonce of a chunk.
+
+        Args:
+            nonce_prefix (bytes): The random nonce prefix of the container.
+            counter (int): The index of the chunk.
+            final (bool): Whether the chunk is the last one.
+
+        Returns:
+            bytes: The 12-byte nonce.
+
+        """
+        return self.NONCE.pack(nonce_prefix, counter, final)
+
+    def get_entropy(self, stream):
+        """Estimates the entropy of a seekable file from a sample in its middle.
+
+        Args:
+            stream (file-like): The file object, its position is left unchanged.
+
+        Returns:
+            float: The Shannon entropy of the sample in bits per byte.
+
+        """
+        position = stream.tell()
+        size = stream.seek(0, SEEK_END)
+        stream.seek(max(position, position + (size - position - self.ENTROPY_SAMPLE_SIZE) // 2))
+        sample = stream.read(self.ENTROPY_SAMPLE_SIZE)
+        stream.seek(position)
+        if not sample:
+            return 0.0
+        return -sum(n / len(sample) * log2(n / len(sample)) for n in Counter(sample).values())
+
+    def get_compressor(self, compression, level=None):
+        """Creates a streaming compressor.
+
+        Args:
+            compression (str): The compression method, one of COMPRESSIONS.
+            level (int): The zlib level or LZMA preset, the library default if None.
+
+        Returns:
+            The compressor, or None for COMPRESSION_NONE.
+
+        Raises:
+            ValueError: If the compression method is unknown.
+
+        """
+        if compression == self.COMPRESSION_ZLIB:
+            return compressobj(-1 if level is None else level)
+        if compression == self.COMPRESSION_LZMA:
+            return LZMACompressor(preset=level)
+        if compression != self.COMPRESSION_NONE:
+            raise ValueError(f'Unknown compression method: {compression}')
+        return None
+
+    def get_decompressor(self, compression):
+        """Creates a streaming decompressor.
+
+        Args:
+            compression (str): The compression method, one of COMPRESSIONS.
+
+        Returns:
+            The decompressor, or None for COMPRESSION_NONE.
+
+        """
+        if compression == self.COMPRESSION_ZLIB:
+            return decompressobj()
+        if compression == self.COMPRESSION_LZMA:
+            return LZMADecompressor()
+        return None
+
+    @Metrics.timed('crypto.encrypt', size=lambda size: size)
+    def encrypt(self, source, destination, password, progress=None, compression=COMPRESSION_NONE,
+                level=None, workers=1, executor=None):
+        """Encrypts a file into a chunked container, optionally compressing it first.
+
+        Compression is skipped when a sample of the file shows that it is already compressed,
+        and the container then records COMPRESSION_NONE.
+
+        Args:
+            source (str or file-like): The plaintext file.
+            destination (str or file-like): The file the container is written to.
+            password (bytes): The password the key is derived from.
+            progress (callable): Called as progress(done, total) in bytes after every chunk.
+            compression (str): The compression method, one of COMPRESSIONS.
+            level (int): The zlib level (0-9) or LZMA preset (0-9), the library default if None.
+            workers (int): The number of worker processes for uncompressed files on disk.
+            executor (concurrent.futures.ProcessPoolExecutor): A long-lived pool with that many
+                workers to run the chunks in, instead of a pool started for this file.
+
+        Returns:
+            int: The number of plaintext bytes encrypted.
+
+        Raises:
+            ValueError: If the compression method is unknown.
+
+        """
+        time_cost, memory_cost, parallelism = self.kdf_params
+        salt = token_bytes(16)
+        nonce_prefix = token_bytes(7)
+        with self.open_stream(source, 'rb') as plaintext_file:
+            if compression != self.COMPRESSION_NONE and \
+                    self.get_entropy(plaintext_file) > self.MAX_COMPRESSIBLE_ENTROPY:
+                compression = self.COMPRESSION_NONE
+            compressor = self.get_compressor(compression, level)
+            header = self.HEADER.pack(self.MAGIC, self.VERSION, time_cost, memory_cost, parallelism,
+                                      salt, nonce_prefix, self.chunk_size) + \
+                self.COMPRESSION_HEADER.pack(self.COMPRESSIONS.index(compression))
+            key = self.derive_key(password, salt, time_cost, memory_cost, parallelism)
+            if compressor is None and self.can_parallelize(source, destination, workers, self.chunk_size):
+                return self.encrypt_parallel(source, destination, key, header, nonce_prefix, workers, progress,
+                                             executor)
+            aesgcm = AESGCM(key)
+            total = self.get_size(plaintext_file) if progress else 0
+            mapped = MappedBuffer(plaintext_file)
+            with self.open_stream(destination, 'wb') as container_file, mapped as plaintext:
+                container_file.write(header)
+                counter = done = 0
+                pending = bytearray() # Compressed data not encrypted yet
+                for chunk in self.iter_chunks(plaintext_file, mapped, plaintext, self.chunk_size):
+                    done += len(chunk)
+                    end = len(chunk) < self.chunk_size
+                    if compressor:
+                        pending += compressor.compress(chunk)
+                        if end:
+                            pending += compressor.flush()
+                        while len(pending) >= self.chunk_size:
+                            nonce = self.get_nonce(nonce_prefix, counter, False)
+                            container_file.write(aesgcm.encrypt(nonce, bytes(pending[:self.chunk_size]), header))
+                            del pending[:self.chunk_size]
+                            counter += 1
+                        if end:
+                            chunk = bytes(pending) # The rest of the flushed stream
+                    if compressor is None or end:
+                        nonce = self.get_nonce(nonce_prefix, counter, end)
+                        container_file.write(aesgcm.encrypt(nonce, chunk, header))
+                        counter += 1
+                    if progress:
+                        progress(done, total)
+                return done
+
+    @Metrics.timed('crypto.decrypt', size=lambda size: size)
+    def decrypt(self, source, destination, password, progress=None, workers=1, executor=None):
+        """Decrypts a chunked or legacy container, decompressing compressed containers.
+
+        Args:
+            source (str or file-like): The container file.
+            destination (str or file-like): The file the plaintext is written to.
+            password (bytes): The password the key is derived from.
+            progress (callable): Called as progress(done, total) in bytes after every chunk.
+            workers (int): The number of worker processes for uncompressed containers on disk.
+            executor (concurrent.futures.ProcessPoolExecutor): A long-lived pool with that many
+                workers to run the chunks in, instead of a pool started for this file.
+
+        Returns:
+            int: The number of plaintext bytes decrypted.
+
+        Raises:
+            cryptography.exceptions.InvalidTag: If the password is wrong or the container was
+                modified or truncated.
+
+        """
+        with self.open_stream(source, 'rb') as container_file:
+            header = container_file.read(self.HEADER.size)
+            if len(header) < self.HEADER.size or header[:4] != self.MAGIC or header[4] > self.VERSION:
+                container_file.seek(0)
+                with self.open_stream(destination, 'wb') as plaintext_file, \
+                        MappedBuffer(container_file) as container:
+                    container_data = container if container is not None else container_file.read()
+                    return plaintext_file.write(self.decrypt_legacy(container_data, password))
+            magic, version, time_cost, memory_cost, parallelism, salt, nonce_prefix, chunk_size = \
+                self.HEADER.unpack(header)
+            compression = self.COMPRESSION_NONE
+            if version >= 2:
+                compression_header = container_file.read(self.COMPRESSION_HEADER.size)
+                header += compression_header
+                try:
+                    compression = self.COMPRESSIONS[compression_header[0]]
+                except IndexError:
+                    raise InvalidTag() from None # Truncated or modified header
+            if not self.check_header(time_cost, memory_cost, parallelism, chunk_size):
+                raise InvalidTag() # Modified header, rejected before the KDF or a read can exhaust memory
+            key = self.derive_key(password, salt, time_cost, memory_cost, parallelism)
+            if compression == self.COMPRESSION_NONE and \
+                    self.can_parallelize(source, destination, workers, chunk_size + self.TAG_SIZE):
+                return self.decrypt_parallel(source, destination, key, header, nonce_prefix, chunk_size,
+                                             workers, progress, executor)
+            decompressor = self.get_decompressor(compression)
+            aesgcm = AESGCM(key)
+            total = self.get_size(container_file) if progress else 0
+            counter = written = 0
+            mapped = MappedBuffer(container_file)
+            with self.open_stream(destination, 'wb') as plaintext_file, mapped as container:
+                for chunk in self.iter_chunks(container_file, mapped, container, chunk_size + self.TAG_SIZE):
+                    if not chunk:
+                        raise InvalidTag() # Truncated before the final chunk
+                    final = len(chunk) < chunk_size + self.TAG_SIZE
+                    nonce = self.get_nonce(nonce_prefix, counter, final)
+                    plaintext = aesgcm.decrypt(nonce, chunk, header)
+                    if decompressor:
+                        plaintext = decompressor.decompress(plaintext)
+                    written += plaintext_file.write(plaintext)
+                    if progress:
+                        progress(len(header) + counter * (chunk_size + self.TAG_SIZE) + len(chunk), total)
+                    if final:
+                        if decompressor and not decompressor.eof:
+                            raise InvalidTag() # Compressed stream cut short
+                        return written
+                    counter += 1
+
+    def check_header(self, time_cost, memory_cost, parallelism, chunk_size):
+        """Checks that the unauthenticated parameters of a container header are within bounds.
+
+        Args:
+            time_cost (int): The Argon2 time cost from the header.
+            memory_cost (int): The Argon2 memory cost in KiB from the header.
+            parallelism (int): The Argon2 parallelism from the header.
+            chunk_size (int): The plaintext size of a chunk from the header.
+
+        Returns:
+            bool: True if the container can be decrypted with bounded time and memory.
+
+        """
+        max_time_cost, max_memory_cost = (self.MAX_KDF_COST_FACTOR * cost for cost in self.kdf_params[:2])
+        return 1 <= time_cost <= max_time_cost and 1 <= parallelism <= self.MAX_PARALLELISM and \
+            8 * parallelism <= memory_cost <= max_memory_cost and 0 < chunk_size <= self.MAX_CHUNK_SIZE
+
+    def can_parallelize(self, source, destination, workers, chunk_size):
+        """Returns whether a file is processed in parallel.
+
+        Chunks can only be processed in parallel between files on disk, and only pay off for
+        files of at least PARALLEL_MIN_CHUNKS chunks.
+
+        Args:
+            source (str or file-like): The input file.
+            destination (str or file-like): The output file.
+            workers (int): The number of worker processes requested.
+            chunk_size (int): The size of a chunk in the input file.
+
+        Returns:
+            bool: Whether to use encrypt_parallel or decrypt_parallel.
+
+        """
+        return workers > 1 and isinstance(source, str) and isinstance(destination, str) and \
+            getsize(source) >= self.PARALLEL_MIN_CHUNKS * chunk_size
+
+    def run_parallel(self, worker, args, chunk_count, workers, progress, total, executor=None):
+        """Runs a chunk worker over contiguous ranges of chunks in a process pool.
+
+        A pool is started for the call unless a long-lived one is given, which is left running.
+
+        Args:
+            worker (callable): encrypt_chunks or decrypt_chunks.
+            args (tuple): The arguments of the worker before the chunk range.
+            chunk_count (int): The number of chunks in the container.
+            workers (int): The number of worker processes.
+            progress (callable): Called as progress(done, total) in bytes after every range.
+            total (int): The total passed to progress.
+            executor (concurrent.futures.ProcessPoolExecutor): The long-lived pool, if any.
+
+        Returns:
+            int: The number of plaintext bytes processed.
+
+        """
+        step = -(-chunk_count // (workers * self.PARALLEL_RANGES_PER_WORKER))
+        owned = executor is None
+        if owned:
+            executor = ProcessPoolExecutor(workers)
+        futures = []
+        try:
+            futures = [executor.submit(worker, *args, first, min(first + step, chunk_count), chunk_count)
+                       for first in range(0, chunk_count, step)]
+            done = 0
+            for future in as_completed(futures):
+                done += future.result()
+                if progress:
+                    progress(done, total)
+            return done
+        finally:
+            if owned:
+                executor.shutdown(cancel_futures=True)
+            else:
+                for future in futures:
+                    future.cancel() # Ranges not started yet, after a failure
+
+    def encrypt_parallel(self, source, destination, key, header, nonce_prefix, workers, progress, executor=None):
+        """Encrypts a file on disk with its chunks spread over worker processes.
+
+        The output is byte for byte the one of the sequential encrypt for the same key, salt
+        and nonce prefix. The container file is preallocated and every worker writes its
+        chunks at their final offsets.
+
+        Args:
+            source (str): The plaintext file.
+            destination (str): The file the container is written to.
+            key (bytes): The AES key.
+            header (bytes): The container header.
+            nonce_prefix (bytes): The random nonce prefix of the container.
+            workers (int): The number of worker processes.
+            progress (callable): Called as progress(done, total) in bytes.
+            executor (concurrent.futures.ProcessPoolExecutor): A long-lived pool, if any.
+
+        Returns:
+            int: The number of plaintext bytes encrypted.
+
+        """
+        size = getsize(source)
+        chunk_count = size // self.chunk_size + 1 # The final chunk is shorter, possibly empty
+        with open(destination, 'wb') as container_file:
+            container_file.write(header)
+            container_file.truncate(len(header) + size + chunk_count * self.TAG_SIZE)
+        return self.run_parallel(self.encrypt_chunks,
+                                 (source, destination, key, header, nonce_prefix, self.chunk_size),
+                                 chunk_count, workers, progress, size, executor)
+
+    def decrypt_parallel(self, source, destination, key, header, nonce_prefix, chunk_size, workers, progress,
+                         executor=None):
+        """Decrypts an uncompressed container on disk with its chunks spread over worker processes.
+
+        Args:
+            source (str): The container file.
+            destination (str): The file the plaintext is written to.
+            key (bytes): The AES key.
+            header (bytes): The container header.
+            nonce_prefix (bytes): The nonce prefix of the container.
+            chunk_size (int): The plaintext size of a chunk.
+            workers (int): The number of worker processes.
+            progress (callable): Called as progress(done, total) in bytes.
+            executor (concurrent.futures.ProcessPoolExecutor): A long-lived pool, if any.
+
+        Returns:
+            int: The number of plaintext bytes decrypted.
+
+        Raises:
+            cryptography.exceptions.InvalidTag: If the password is wrong or the container was
+                modified or truncated.
+
+        """
+        body_size = getsize(source) - len(header)
+        chunk_count = body_size // (chunk_size + self.TAG_SIZE) + 1
+        if body_size % (chunk_size + self.TAG_SIZE) < self.TAG_SIZE:
+            raise InvalidTag() # Truncated before the final chunk
+        size = body_size - chunk_count * self.TAG_SIZE
+        with open(destination, 'wb') as plaintext_file:
+            plaintext_file.truncate(size)
+        return self.run_parallel(self.decrypt_chunks,
+                                 (source, destination, key, header, nonce_prefix, chunk_size),
+                                 chunk_count, workers, progress, size, executor)
+
+    @staticmethod
+    def encrypt_chunks(source, destination, key, header, nonce_prefix, chunk_size, first, stop, chunk_count):
+        """Encrypts a range of chunks into a preallocated container. Runs in a worker process.
+
+        Args:
+            source (str): The plaintext file, read through a MappedBuffer.
+            destination (str): The container file.
+            key (bytes): The AES key.
+            header (bytes): The container header.
+            nonce_prefix (bytes): The nonce prefix of the container.
+            chunk_size (int): The plaintext size of a chunk.
+            first (int): The index of the first chunk of the range.
+            stop (int): The index after the last chunk of the range.
+            chunk_count (int): The number of chunks in the container.
+
+        Returns:
+            int: The number of plaintext bytes encrypted.
+
+        """
+        aesgcm = AESGCM(key)
+        done = 0
+        with open(source, 'rb') as plaintext_file, open(destination, 'r+b') as container_file:
+            mapped = MappedBuffer(plaintext_file)
+            with mapped as plaintext:
+                for counter in range(first, stop):
+                    nonce = CryptoContainer.NONCE.pack(nonce_prefix, counter, counter == chunk_count - 1)
+                    chunk = plaintext[counter * chunk_size:(counter + 1) * chunk_size]
+                    container_file.seek(len(header) + counter * (chunk_size + CryptoContainer.TAG_SIZE))
+                    container_file.write(aesgcm.encrypt(nonce, chunk, header))
+                    mapped.discard((counter + 1) * chunk_size)
+                    done += len(chunk)
+        return done
+
+    @staticmethod
+    def decrypt_chunks(source, destination, key, header, nonce_prefix, chunk_size, first, stop, chunk_count):
+        """Decrypts a range of chunks into a preallocated file. Runs in a worker process.
+
+        Args:
+            source (str): The container file, read through a MappedBuffer.
+            destination (str): The plaintext file.
+            key (bytes): The AES key.
+            header (bytes): The container header.
+            nonce_prefix (bytes): The nonce prefix of the container.
+            chunk_size (int): The plaintext size of a chunk.
+            first (int): The index of the first chunk of the range.
+            stop (int): The index after the last chunk of the range.
+            chunk_count (int): The number of chunks in the container.
+
+        Returns:
+            int: The number of plaintext bytes decrypted.
+
+        Raises:
+            cryptography.exceptions.InvalidTag: If a chunk fails authentication.
+
+        """
+        aesgcm = AESGCM(key)
+        done = 0
+        stride = chunk_size + CryptoContainer.TAG_SIZE
+        with open(source, 'rb') as container_file, open(destination, 'r+b') as plaintext_file:
+            mapped = MappedBuffer(container_file)
+            with mapped as container:
+                for counter in range(first, stop):
+                    nonce = CryptoContainer.NONCE.pack(nonce_prefix, counter, counter == chunk_count - 1)
+                    start = len(header) + counter * stride
+                    plaintext = aesgcm.decrypt(nonce, container[start:start + stride], header)
+                    plaintext_file.seek(counter * chunk_size)
+                    plaintext_file.write(plaintext)
+                    mapped.discard(start + stride)
+                    done += len(plaintext)
+        return done
+
+    def decrypt_legacy(self, container_data, password):
+        """Decrypts data in the legacy single-shot format.
+
+        Args:
+            container_data (bytes or memoryview): The nonce, ciphertext and tag, and salt.
+            password (bytes): The password the key is derived from, also used as associated data.
+
+        Returns:
+            bytes: The plaintext.
+
+        Raises:
+            cryptography.exceptions.InvalidTag: If the password is wrong or the data was modified.
+
+        """
+        nonce = bytes(container_data[:self.LEGACY_NONCE_SIZE])
+        salt = bytes(container_data[-self.LEGACY_SALT_SIZE:])
+        key = self.derive_key(password, salt, *self.kdf_params)
+        ciphertext = container_data[self.LEGACY_NONCE_SIZE:-self.LEGACY_SALT_SIZE]
+        return AESGCM(key).decrypt(nonce, ciphertext, password)
@@ -1,118 +1,950 @@
 import sqlite3
-from tkinter import messagebox
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from hashlib import blake2b
+from io import BytesIO, BufferedReader, RawIOBase
+from os import listdir, SEEK_SET
+from os.path import basename, isfile, join, splitext
+from threading import Lock, local
+from time import perf_counter, time
+from PIL import Image, UnidentifiedImageError
+from Metrics import Metrics
+from MappedBuffer import MappedBuffer
 
 class DbHandler:
-    """Handles database operations for CryptoCanvas application."""
+    """Handles database operations for CryptoCanvas application.
 
-    def __init__(self):
-        """Initialize the DbHandler by connecting to the database and creating necessary tables."""
+    The handler owns one long-lived connection for the Tk thread, and opens one more per worker
+    thread on first use. The database runs in WAL mode, so reads in workers do not block writes
+    from the GUI and the other way round.
+    """
+
+    DB_PATH = 'CryptoCanvas.db'
+    THUMBNAIL_SIZE = (512, 512)
+    MMAP_SIZE = 256 * 2 ** 20 # Bytes of the database file mapped into memory
+    CACHE_SIZE = -16384 # Page cache per connection, negative values are in KiB
+    BLOB_CHUNK_SIZE = 1 << 20 # Bytes written to or hashed from an image per step
+    BLOB_BUFFER_SIZE = 1 << 16 # Read buffer of image BLOB streams
+    METRICS_RETENTION = 30 * 24 * 3600 # Seconds operation timings are kept
+    IMPORT_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+    COLLISION_SKIP = 'skip'
+    COLLISION_RENAME = 'rename'
+    COLLISION_REPLACE = 'replace'
+    COLLISION_POLICIES = (COLLISION_SKIP, COLLISION_RENAME, COLLISION_REPLACE)
+
+    def __init__(self, db_path=DB_PATH, mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE, on_error=None):
+        """Initialize the DbHandler by connecting to the database and creating necessary tables.
+
+        Args:
+            db_path (str): The path of the database file.
+            mmap_size (int): The PRAGMA mmap_size of every connection.
+            cache_size (int): The PRAGMA cache_size of every connection.
+            on_error (callable): Called with the message of every database error the handler
+                reports itself. The message is shown in a dialog if None.
+        """
+        self.on_error = on_error
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.connection = None
+        self.local = local()
+        self.connections = []
+        self.connections_lock = Lock()
         try:
             self.connect_db()
+            if self.connection is None:
+                return
             self.create_user_table()
             self.create_image_table()
+            self.create_metrics_table()
         except sqlite3.Error as e:
             self.show_error(f"Database error: {e}")
 
     def connect_db(self):
-        """Connect to the SQLite database."""
+        """Connect to the SQLite database, unless already connected."""
+        if self.connection is not None:
+            return
         try:
-            self.connection = sqlite3.connect('CryptoCanvas.db')
+            self.connection = self.get_connection()
             self.cursor = self.connection.cursor()
         except sqlite3.Error as e:
             self.show_error(f"Database connection error: {e}")
 
+    def open_connection(self):
+        """Open a new connection to the database and configure it.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        connection = sqlite3.connect(self.db_path, check_same_thread=False) # Closed from the Tk thread
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL") # Durable up to the last checkpoint in WAL mode
+        connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        connection.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        return connection
+
+    def get_connection(self):
+        """Return the connection of the calling thread, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.open_connection()
+            self.local.connection = connection
+            with self.connections_lock:
+                self.connections.append(connection)
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in one transaction on the connection of the calling thread.
+
+        The transaction is committed when the with block exits and rolled back if it raises.
+        Nested blocks join the enclosing transaction.
+
+        Yields:
+            sqlite3.Cursor: A cursor on the connection.
+        """
+        connection = self.get_connection()
+        if connection.in_transaction:
+            yield connection.cursor()
+            return
+        connection.execute("BEGIN")
+        try:
+            yield connection.cursor()
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
     def create_user_table(self):
         """Create the user table in the database if it does not exist."""
         try:
-            self.cursor.execute("CREATE TABLE IF NOT EXISTS users "
-                                "(id INTEGER PRIMARY KEY, name TEXT, email TEXT UNIQUE, password TEXT)")
-            self.connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute("CREATE TABLE IF NOT EXISTS users "
+                               "(id INTEGER PRIMARY KEY, name TEXT, email TEXT UNIQUE, password TEXT)")
         except sqlite3.Error as e:
             self.show_error(f"Error creating user table: {e}")
 
+    def create_metrics_table(self):
+        """Create the table operation timings are flushed to, if it does not exist."""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("CREATE TABLE IF NOT EXISTS metrics "
+                               "(id INTEGER PRIMARY KEY, recorded_at REAL, operation TEXT, "
+                               "duration_ms REAL, bytes INTEGER, ok INTEGER)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS metrics_recorded_at ON metrics (recorded_at)")
+        except sqlite3.Error as e:
+            self.show_error(f"Error creating metrics table: {e}")
+
     def create_image_table(self):
-        """Create the image table in the database if it does not exist."""
+        """Create the image tables in the database if they do not exist.
+
+        Image bytes are content-addressed: each distinct content is stored once in the blobs
+        table, keyed by its BLAKE2b hash, and images are per-user names referring to a hash.
+        Blobs count their references, and thumbnails belong to blobs. Metadata and bytes live
+        in separate tables, so listing images never loads BLOB pages. Databases from earlier
+        versions are migrated.
+        """
         try:
-            self.cursor.execute("CREATE TABLE IF NOT EXISTS images "
-                                "(id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, data BLOB, "
-                                "UNIQUE(user_id, name))")
-            self.connection.commit()
+            self.cursor.execute("PRAGMA table_info(images)")
+            needs_migration = 'data' in [row[1] for row in self.cursor.fetchall()]
+            self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'image_data'")
+            has_image_data = self.cursor.fetchone() is not None
+            self.cursor.execute("PRAGMA table_info(thumbnails)")
+            has_image_thumbnails = 'image_id' in [row[1] for row in self.cursor.fetchall()]
+            with self.transaction() as cursor:
+                if needs_migration:
+                    cursor.execute("ALTER TABLE images RENAME TO images_v0")
+                if has_image_thumbnails:
+                    cursor.execute("ALTER TABLE thumbnails RENAME TO thumbnails_v1")
+                cursor.execute("CREATE TABLE IF NOT EXISTS images "
+                               "(id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, size INTEGER, "
+                               "mime_type TEXT, width INTEGER, height INTEGER, content_hash TEXT, "
+                               "created_at TEXT DEFAULT CURRENT_TIMESTAMP)")
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS images_user_id_name "
+                               "ON images (user_id, name)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS images_content_hash ON images (content_hash)")
+                cursor.execute("CREATE TABLE IF NOT EXISTS blobs "
+                               "(id INTEGER PRIMARY KEY, content_hash TEXT UNIQUE, ref_count INTEGER, "
+                               "data BLOB)")
+                cursor.execute("CREATE TABLE IF NOT EXISTS thumbnails "
+                               "(blob_id INTEGER PRIMARY KEY REFERENCES blobs(id) ON DELETE CASCADE, "
+                               "data BLOB)")
+                if needs_migration:
+                    self.migrate_image_table(cursor)
+                if has_image_data:
+                    self.migrate_image_data(cursor, has_image_thumbnails)
+                elif has_image_thumbnails:
+                    cursor.execute("DROP TABLE thumbnails_v1")
         except sqlite3.Error as e:
             self.show_error(f"Error creating image table: {e}")
 
-    def get_images_by_user_id(self, user_id, limit=10, offset=0):
-        """Retrieve image names associated with a user from the database."""
+    def migrate_image_table(self, cursor):
+        """Move images from the old single-table layout into the metadata and blob tables.
+
+        Args:
+            cursor (sqlite3.Cursor): A cursor in the transaction creating the new tables.
+        """
+        read_cursor = cursor.connection.cursor()
+        read_cursor.execute("SELECT id, user_id, name, data FROM images_v0")
+        for image_id, user_id, name, image_data in read_cursor:
+            metadata = self.describe_image(image_data)
+            cursor.execute(
+                "INSERT INTO images (id, user_id, name, size, mime_type, width, height, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (image_id, user_id, name, *metadata))
+            if not self.add_reference(cursor, metadata[4]):
+                cursor.execute("INSERT INTO blobs (content_hash, ref_count, data) VALUES (?, 1, ?)",
+                               (metadata[4], image_data))
+        cursor.execute("DROP TABLE images_v0")
+
+    def migrate_image_data(self, cursor, has_image_thumbnails):
+        """Move image bytes stored per image into the content-addressed blob table.
+
+        Args:
+            cursor (sqlite3.Cursor): A cursor in the transaction creating the new tables.
+            has_image_thumbnails (bool): Whether thumbnails per image were renamed to
+                thumbnails_v1 and should be moved to their blobs.
+        """
+        cursor.execute("INSERT OR IGNORE INTO blobs (content_hash, ref_count, data) "
+                       "SELECT images.content_hash, 0, image_data.data FROM images "
+                       "JOIN image_data ON image_data.image_id = images.id")
+        self.count_references(cursor)
+        if has_image_thumbnails:
+            cursor.execute("INSERT OR IGNORE INTO thumbnails (blob_id, data) "
+                           "SELECT blobs.id, thumbnails_v1.data FROM thumbnails_v1 "
+                           "JOIN images ON images.id = thumbnails_v1.image_id "
+                           "JOIN blobs ON blobs.content_hash = images.content_hash")
+            cursor.execute("DROP TABLE thumbnails_v1")
+        cursor.execute("DROP TABLE image_data")
+
+    def describe_image(self, image_data):
+        """Compute the metadata stored with an image.
+
+        Args:
+            image_data (bytes or file-like): The image file contents, or a seekable binary file
+                that is hashed through a MappedBuffer, or in chunks if it cannot be mapped.
+
+        Returns:
+            tuple: The size, MIME type, width, height and BLAKE2b content hash. The MIME type
+                and dimensions are None for data that is not a recognized image.
+        """
+        image_file = BytesIO(image_data) if isinstance(image_data, (bytes, bytearray)) else image_data
+        mime_type = width = height = None
+        image_file.seek(0)
+        try:
+            with Image.open(image_file) as image: # Reads the header only
+                mime_type = image.get_format_mimetype()
+                width, height = image.size
+        except (UnidentifiedImageError, OSError):
+            pass
+        image_file.seek(0)
+        content_hash = blake2b(digest_size=32)
+        if image_file is not image_data:
+            content_hash.update(image_data)
+            return len(image_data), mime_type, width, height, content_hash.hexdigest()
+        size = 0
+        with MappedBuffer(image_file) as view:
+            if view is not None:
+                content_hash.update(view)
+                size = len(view)
+            else:
+                for chunk in iter(lambda: image_file.read(self.BLOB_CHUNK_SIZE), b''):
+                    content_hash.update(chunk)
+                    size += len(chunk)
+        return size, mime_type, width, height, content_hash.hexdigest()
+
+    def make_thumbnail(self, image_data):
+        """Create a small preview of an image.
+
+        JPEG images are decoded at a reduced scale with draft(), so large photos are never fully
+        decoded. Previews are stored as JPEG, or as PNG when the image has transparency.
+
+        Args:
+            image_data (bytes or file-like): The image file contents, or a seekable binary file.
+
+        Returns:
+            bytes: The encoded preview, or None if the data is not a recognized image.
+        """
+        image_file = BytesIO(image_data) if isinstance(image_data, (bytes, bytearray)) else image_data
+        image_file.seek(0)
+        try:
+            with Image.open(image_file) as image:
+                if image.format == 'JPEG':
+                    image.draft('RGB', self.THUMBNAIL_SIZE)
+                image.thumbnail(self.THUMBNAIL_SIZE)
+                has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+                thumbnail_stream = BytesIO()
+                if has_alpha:
+                    image.convert('RGBA').save(thumbnail_stream, format='PNG')
+                else:
+                    image.convert('RGB').save(thumbnail_stream, format='JPEG', quality=85)
+                return thumbnail_stream.getvalue()
+        except (UnidentifiedImageError, OSError, ValueError):
+            return None
+
+    @Metrics.timed('db.get_thumbnail', size=lambda thumbnail: len(thumbnail) if thumbnail else None)
+    def get_thumbnail(self, user_id, name):
+        """Retrieve the preview thumbnail of an image by user ID and image name.
+
+        Returns:
+            bytes: The thumbnail, or None if the image has none (not a recognized image, or
+                not backfilled yet).
+        """
+        try:
+            self.cursor.execute("SELECT thumbnails.data FROM images "
+                                "JOIN blobs ON blobs.content_hash = images.content_hash "
+                                "JOIN thumbnails ON thumbnails.blob_id = blobs.id "
+                                "WHERE images.user_id = ? AND images.name = ?",
+                                (user_id, name))
+            row = self.cursor.fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            self.show_error(f"Error fetching thumbnail: {e}")
+
+    @Metrics.timed('db.backfill_thumbnails')
+    def backfill_thumbnails(self, batch_size=20):
+        """Create the missing thumbnails of stored images added by earlier versions.
+
+        Can run in a worker thread, and commits after every batch to keep write locks short.
+        Thumbnails are created before the transaction of a batch is opened.
+
+        Args:
+            batch_size (int): The number of blobs processed per transaction.
+
+        Returns:
+            int: The number of blobs processed.
+        """
+        connection = self.get_connection()
+        processed = 0
+        while True:
+            rows = connection.execute(
+                "SELECT blobs.id, blobs.data FROM blobs "
+                "LEFT JOIN thumbnails ON thumbnails.blob_id = blobs.id "
+                "WHERE thumbnails.blob_id IS NULL AND blobs.ref_count > 0 LIMIT ?", (batch_size,)).fetchall()
+            if not rows:
+                return processed
+            thumbnails = [(blob_id, self.make_thumbnail(image_data) if image_data else None)
+                          for blob_id, image_data in rows]
+            with self.transaction() as cursor:
+                cursor.executemany("INSERT OR IGNORE INTO thumbnails (blob_id, data) VALUES (?, ?)",
+                                   thumbnails)
+            processed += len(rows)
+
+    @Metrics.timed('db.get_thumbnails', size=lambda thumbnails: sum(map(len, thumbnails.values())))
+    def get_thumbnails(self, image_ids):
+        """Retrieve the thumbnails of several images.
+
+        Can be called from a worker thread.
+
+        Args:
+            image_ids (list): The IDs of the images.
+
+        Returns:
+            dict: The thumbnails by image ID, for the images that have one.
+        """
+        placeholders = ', '.join('?' * len(image_ids))
+        rows = self.get_connection().execute(f"SELECT images.id, thumbnails.data FROM images "
+                                             f"JOIN blobs ON blobs.content_hash = images.content_hash "
+                                             f"JOIN thumbnails ON thumbnails.blob_id = blobs.id "
+                                             f"WHERE images.id IN ({placeholders}) AND thumbnails.data IS NOT NULL",
+                                             list(image_ids)).fetchall()
+        return dict(rows)
+
+    @Metrics.timed('db.get_images_by_user_id')
+    def get_images_by_user_id(self, user_id, limit=10, after=None, before=None, inclusive=False):
+        """Retrieve a page of image IDs and names of a user, ordered by name.
+
+        Pages are found with keyset pagination on the (user_id, name) index, so the cost does
+        not grow with the position in the list. One extra row is fetched to know whether more
+        images follow the page.
+
+        Args:
+            user_id (int): The ID of the user.
+            limit (int): The maximum number of images to return.
+            after (str): Return the images following this name.
+            before (str): Return the images preceding this name.
+            inclusive (bool): Whether the page may include the after or before name itself.
+
+        Returns:
+            tuple: The (id, name) rows in ascending name order, and whether more images exist
+                past the page in the direction of the query.
+        """
         try:
-            self.cursor.execute("SELECT name FROM images WHERE user_id = ? LIMIT ? OFFSET ?",
-                                (user_id, limit, offset))
-            rows = self.cursor.fetchmany(limit)
-            return [row[0] for row in rows]
+            if before is not None:
+                self.cursor.execute(f"SELECT id, name FROM images WHERE user_id = ? AND name {'<=' if inclusive else '<'} ? "
+                                    "ORDER BY name DESC LIMIT ?",
+                                    (user_id, before, limit + 1))
+            elif after is not None:
+                self.cursor.execute(f"SELECT id, name FROM images WHERE user_id = ? AND name {'>=' if inclusive else '>'} ? "
+                                    "ORDER BY name LIMIT ?",
+                                    (user_id, after, limit + 1))
+            else:
+                self.cursor.execute("SELECT id, name FROM images WHERE user_id = ? ORDER BY name LIMIT ?",
+                                    (user_id, limit + 1))
+            rows = self.cursor.fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if before is not None:
+                rows.reverse()
+            return rows, has_more
         except sqlite3.Error as e:
             self.show_error(f"Error fetching images by user ID: {e}")
+            return [], False
 
+    @Metrics.timed('db.get_image_by_name')
     def get_image_by_name(self, user_id, name):
-        """Retrieve image data by user ID and image name from the database."""
+        """Retrieve image metadata by user ID and image name from the database.
+
+        Returns:
+            tuple: The id, name, size, MIME type, width, height, content hash and creation time.
+        """
         try:
-            self.cursor.execute("SELECT * FROM images WHERE user_id = ? AND name = ?",
+            self.cursor.execute("SELECT id, name, size, mime_type, width, height, content_hash, created_at "
+                                "FROM images WHERE user_id = ? AND name = ?",
                                 (user_id, name))
             return self.cursor.fetchone()
         except sqlite3.Error as e:
             self.show_error(f"Error fetching image by name: {e}")
 
+    @Metrics.timed('db.get_image_data', size=lambda image_data: len(image_data) if image_data else None)
+    def get_image_data(self, user_id, name):
+        """Retrieve the bytes of an image by user ID and image name from the database."""
+        try:
+            self.cursor.execute("SELECT blobs.data FROM images "
+                                "JOIN blobs ON blobs.content_hash = images.content_hash "
+                                "WHERE images.user_id = ? AND images.name = ?",
+                                (user_id, name))
+            row = self.cursor.fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            self.show_error(f"Error fetching image data: {e}")
+
+    @Metrics.timed('db.open_image_data')
+    def open_image_data(self, user_id, name):
+        """Open the bytes of an image as a read-only file object, by user ID and image name.
+
+        The BLOB is read incrementally on a connection of its own, so the image is never held
+        in memory whole and the file object can be read in a worker thread. Close it when done.
+
+        Returns:
+            io.BufferedReader: The image data, or None if the image was not found.
+        """
+        try:
+            self.cursor.execute("SELECT blobs.id FROM images "
+                                "JOIN blobs ON blobs.content_hash = images.content_hash "
+                                "WHERE images.user_id = ? AND images.name = ?",
+                                (user_id, name))
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            return self.open_blob(row[0])
+        except sqlite3.Error as e:
+            self.show_error(f"Error opening image data: {e}")
+
+    def open_blob(self, blob_id):
+        """Open stored image contents as a read-only file object, by blob ID.
+
+        The BLOB is read incrementally on a connection of its own, so this can be called from
+        any thread, or from another process with a DbHandler of its own. Close it when done.
+        Python versions before 3.11 have no incremental BLOB I/O and read the whole BLOB instead.
+
+        Args:
+            blob_id (int): The ID of the blob.
+
+        Returns:
+            io.BufferedReader or io.BytesIO: The image data.
+
+        Raises:
+            sqlite3.Error: If the blob could not be opened.
+        """
+        return self.open_blob_on(self.open_connection(), blob_id)
+
+    @staticmethod
+    def open_blob_on(connection, blob_id):
+        """Open stored image contents as a read-only file object on a given connection.
+
+        Lets worker processes read BLOBs over connections of their own without a DbHandler.
+        The returned file object owns the connection and closes it when it is closed.
+
+        Args:
+            connection (sqlite3.Connection): A connection used for this BLOB only.
+            blob_id (int): The ID of the blob.
+
+        Returns:
+            io.BufferedReader or io.BytesIO: The image data.
+
+        Raises:
+            sqlite3.Error: If the blob could not be opened.
+        """
+        if not hasattr(connection, 'blobopen'):
+            try:
+                row = connection.execute("SELECT data FROM blobs WHERE id = ?", (blob_id,)).fetchone()
+            finally:
+                connection.close()
+            if row is None:
+                raise sqlite3.OperationalError(f"No blob with ID {blob_id}")
+            return BytesIO(row[0])
+        try:
+            blob = connection.blobopen('blobs', 'data', blob_id, readonly=True)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return BufferedReader(BlobReader(connection, blob), DbHandler.BLOB_BUFFER_SIZE)
+
+    @Metrics.timed('db.get_image_blobs')
+    def get_image_blobs(self, user_id=None):
+        """Retrieve the blob ID of every image, for scanning the stored contents.
+
+        Can be called from a worker thread.
+
+        Args:
+            user_id (int): Only return the images of this user, if given.
+
+        Returns:
+            list: (blob ID, user ID, image name) rows, ordered by blob ID so that images sharing
+                contents are adjacent.
+        """
+        query = ("SELECT blobs.id, images.user_id, images.name FROM images "
+                 "JOIN blobs ON blobs.content_hash = images.content_hash")
+        if user_id is not None:
+            return self.get_connection().execute(query + " WHERE images.user_id = ? ORDER BY blobs.id",
+                                                 (user_id,)).fetchall()
+        return self.get_connection().execute(query + " ORDER BY blobs.id").fetchall()
+
+    def write_blob(self, connection, blob_id, image_file):
+        """Stream a file into a reserved BLOB, straight from a MappedBuffer or in chunks.
+
+        Python versions before 3.11 have no incremental BLOB I/O and update the BLOB in one go.
+
+        Args:
+            connection (sqlite3.Connection): The connection of the inserting transaction.
+            blob_id (int): The ID of the blob, whose data was inserted as zeroblob(size).
+            image_file (file-like): The seekable binary file to copy.
+        """
+        image_file.seek(0)
+        if not hasattr(connection, 'blobopen'):
+            with Metrics.measure('db.write_blob') as measurement, MappedBuffer(image_file) as view:
+                data = view if view is not None else image_file.read()
+                measurement['size'] = len(data)
+                connection.execute("UPDATE blobs SET data = ? WHERE id = ?", (data, blob_id))
+            return
+        with Metrics.measure('db.write_blob') as measurement, \
+                connection.blobopen('blobs', 'data', blob_id) as blob, MappedBuffer(image_file) as view:
+            measurement['size'] = len(blob)
+            if view is not None:
+                blob.write(view)
+                return
+            for chunk in iter(lambda: image_file.read(self.BLOB_CHUNK_SIZE), b''):
+                blob.write(chunk)
+
+    @Metrics.timed('db.get_stored_hashes')
+    def get_stored_hashes(self, content_hashes):
+        """Find which contents are already stored.
+
+        Can be called from a worker thread.
+
+        Args:
+            content_hashes (iterable): BLAKE2b content hashes.
+
+        Returns:
+            set: The hashes that have a blob.
+        """
+        content_hashes = list(content_hashes)
+        if not content_hashes:
+            return set()
+        placeholders = ', '.join('?' * len(content_hashes))
+        rows = self.get_connection().execute(f"SELECT content_hash FROM blobs WHERE content_hash IN ({placeholders})",
+                                             content_hashes).fetchall()
+        return {row[0] for row in rows}
+
+    def add_reference(self, cursor, content_hash):
+        """Add a reference to stored content, if it is stored.
+
+        Args:
+            cursor (sqlite3.Cursor): A cursor in the inserting transaction.
+            content_hash (str): The BLAKE2b content hash.
+
+        Returns:
+            bool: Whether the content was already stored, in which case nothing needs writing.
+        """
+        cursor.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE content_hash = ?", (content_hash,))
+        return cursor.rowcount == 1
+
+    def delete_references(self, cursor, user_id, names):
+        """Delete images and release their references to the stored content.
+
+        Blobs left without references are kept until compact() runs, so content that is added
+        again in the meantime is not written twice.
+
+        Args:
+            cursor (sqlite3.Cursor): A cursor in the deleting transaction.
+            user_id (int): The ID of the user.
+            names (list): The names of the images.
+        """
+        for name in names:
+            cursor.execute("SELECT content_hash FROM images WHERE user_id = ? AND name = ?", (user_id, name))
+            row = cursor.fetchone()
+            if row is None:
+                continue
+            cursor.execute("DELETE FROM images WHERE user_id = ? AND name = ?", (user_id, name))
+            cursor.execute("UPDATE blobs SET ref_count = ref_count - 1 WHERE content_hash = ?", row)
+
+    def count_references(self, cursor):
+        """Recount the references of every blob from the images table.
+
+        Args:
+            cursor (sqlite3.Cursor): A cursor in a transaction.
+        """
+        cursor.execute("UPDATE blobs SET ref_count = "
+                       "(SELECT COUNT(*) FROM images WHERE images.content_hash = blobs.content_hash)")
+
+    @Metrics.timed('db.compact', size=lambda removed: removed[1])
+    def compact(self):
+        """Delete the blobs no image refers to and return their space to the file system.
+
+        Reference counts are recounted first, so blobs orphaned in any other way are found
+        too. The database file is then rebuilt with VACUUM, which can take a while for large
+        databases.
+
+        Returns:
+            tuple: The number of deleted blobs and their total size in bytes.
+
+        Raises:
+            sqlite3.Error: If the database could not be compacted.
+        """
+        with self.transaction() as cursor:
+            self.count_references(cursor)
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(length(data)), 0) FROM blobs WHERE ref_count = 0")
+            removed = cursor.fetchone()
+            cursor.execute("DELETE FROM thumbnails WHERE blob_id IN (SELECT id FROM blobs WHERE ref_count = 0)")
+            cursor.execute("DELETE FROM blobs WHERE ref_count = 0")
+        connection = self.get_connection()
+        connection.execute("VACUUM")
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    @Metrics.timed('db.get_user')
     def get_user(self, email):
         """Retrieve user information by email from the database."""
         try:
-            self.cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+            self.cursor.execute("SELECT id, name, email, password FROM users WHERE email = ?", (email,))
             return self.cursor.fetchone()
         except sqlite3.Error as e:
             self.show_error(f"Error fetching user by email: {e}")
 
-    def add_image(self, user_id, name, image_data):
-        """Add an image to the database."""
+    @Metrics.timed('db.add_image')
+    def add_image(self, user_id, name, image):
+        """Add an image to the database.
+
+        Content that is already stored is only referenced. New content is reserved with
+        zeroblob() and streamed into its BLOB in chunks, so a file given by path is never read
+        into memory whole.
+
+        Args:
+            user_id (int): The ID of the user.
+            name (str): The name of the image.
+            image (str, bytes or file-like): The path to the image, its data or a seekable
+                binary file.
+        """
+        if isinstance(image, str):
+            image_context = open(image, 'rb')
+        elif isinstance(image, (bytes, bytearray)):
+            image_context = nullcontext(BytesIO(image))
+        else:
+            image_context = nullcontext(image)
+        with image_context as image_file:
+            metadata = self.describe_image(image_file)
+            try:
+                is_stored = bool(self.get_stored_hashes([metadata[4]]))
+                thumbnail = None if is_stored else self.make_thumbnail(image_file)
+                with self.transaction() as cursor:
+                    cursor.execute(
+                        "INSERT INTO images (user_id, name, size, mime_type, width, height, content_hash) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (user_id, name, *metadata))
+                    if not self.add_reference(cursor, metadata[4]):
+                        cursor.execute("INSERT INTO blobs (content_hash, ref_count, data) VALUES (?, 1, zeroblob(?))",
+                                       (metadata[4], metadata[0]))
+                        blob_id = cursor.lastrowid
+                        if not is_stored: # Otherwise the blob was compacted meanwhile and gets backfilled
+                            cursor.execute("INSERT INTO thumbnails (blob_id, data) VALUES (?, ?)",
+                                           (blob_id, thumbnail))
+                        self.write_blob(cursor.connection, blob_id, image_file)
+            except sqlite3.IntegrityError as e:
+                self.show_error(f'Operation failed. Image name ({name}) must be unique.')
+                raise e
+            except sqlite3.Error as e:
+                self.show_error(f"Error adding image: {e}")
+
+    @Metrics.timed('db.import_images', size=lambda report: report['bytes'])
+    def import_images(self, user_id, source, policy=COLLISION_SKIP, batch_size=100, max_workers=None,
+                      progress=None):
+        """Import every image of a directory, or a list of image files, in batches.
+
+        Files are read and validated in a thread pool while the previous batch is written, and
+        each batch is inserted in one transaction. Content that is already stored is only
+        referenced, without writing or thumbnailing it again. Can run in a worker thread;
+        errors are raised instead of shown.
+
+        Args:
+            user_id (int): The ID of the user the images are added to.
+            source (str or list): A directory, whose JPEG and PNG files are imported, or a list
+                of file paths.
+            policy (str): What to do with names that already exist, one of COLLISION_POLICIES:
+                skip the file, rename it with a numbered suffix, or replace the existing image.
+            batch_size (int): The number of files inserted per transaction.
+            max_workers (int): The number of threads reading files.
+            progress (callable): Called as progress(done, total) in files after every batch.
+
+        Returns:
+            dict: The number of imported, skipped and failed files, how many of the imported
+                files were already stored, the imported bytes and the elapsed seconds.
+
+        Raises:
+            ValueError: If the collision policy is unknown.
+            sqlite3.Error: If a batch could not be written. Earlier batches stay imported.
+        """
+        if policy not in self.COLLISION_POLICIES:
+            raise ValueError(f'Unknown collision policy: {policy}')
+        if isinstance(source, str):
+            source = [join(source, name) for name in sorted(listdir(source))
+                      if splitext(name)[1].lower() in self.IMPORT_EXTENSIONS and isfile(join(source, name))]
+        report = {'imported': 0, 'skipped': 0, 'failed': 0, 'deduplicated': 0, 'bytes': 0, 'seconds': 0.0}
+        start = perf_counter()
+        batches = [source[i:i + batch_size] for i in range(0, len(source), batch_size)]
+        with ThreadPoolExecutor(max_workers) as executor:
+            pending = executor.map(self.read_import, batches[0]) if batches else None
+            for index in range(len(batches)):
+                images = list(pending)
+                if index + 1 < len(batches):
+                    pending = executor.map(self.read_import, batches[index + 1]) # Read ahead while writing
+                report['failed'] += images.count(None)
+                images = [image for image in images if image is not None]
+                stored_hashes = self.get_stored_hashes({image[2][4] for image in images})
+                new_contents = {}
+                for name, image_data, metadata in images:
+                    if metadata[4] not in stored_hashes:
+                        new_contents.setdefault(metadata[4], image_data)
+                thumbnails = dict(zip(new_contents, executor.map(self.make_thumbnail, new_contents.values())))
+                imported, stored = self.insert_images(user_id, images, policy, thumbnails)
+                report['imported'] += len(imported)
+                report['deduplicated'] += len(imported) - stored
+                report['skipped'] += len(images) - len(imported)
+                report['bytes'] += sum(len(image[1]) for image in imported)
+                if progress:
+                    progress(min((index + 1) * batch_size, len(source)), len(source))
+        report['seconds'] = perf_counter() - start
+        return report
+
+    def read_import(self, path):
+        """Read and validate one file to import. Runs in the import thread pool.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            tuple: The name, data and metadata of the image, or None if the file could not be
+                read or is not a recognized image.
+        """
         try:
-            self.cursor.execute(
-                "INSERT INTO images (user_id, name, data) VALUES (?, ?, ?)",
-                (user_id, name, image_data))
-            self.connection.commit()
-        except sqlite3.IntegrityError as e:
-            self.show_error(f'Operation failed. Image name ({name}) must be unique.')
-            raise e
-        except sqlite3.Error as e:
-            self.show_error(f"Error adding image: {e}")
+            with open(path, 'rb') as f:
+                image_data = f.read()
+        except OSError:
+            return None
+        metadata = self.describe_image(image_data)
+        if metadata[1] is None:
+            return None
+        return basename(path), image_data, metadata
+
+    @Metrics.timed('db.insert_images')
+    def insert_images(self, user_id, images, policy, thumbnails):
+        """Insert a batch of read images in one transaction, resolving name collisions.
 
+        Args:
+            user_id (int): The ID of the user the images are added to.
+            images (list): The (name, data, metadata) tuples from read_import.
+            policy (str): The collision policy, one of COLLISION_POLICIES.
+            thumbnails (dict): The thumbnails of contents that were not stored, by hash.
+
+        Returns:
+            tuple: The tuples that were inserted, with their final names, and the number of
+                contents that had to be stored.
+        """
+        if not images:
+            return [], 0
+        with self.transaction() as cursor:
+            names = [image[0] for image in images]
+            placeholders = ', '.join('?' * len(names))
+            cursor.execute(f"SELECT name FROM images WHERE user_id = ? AND name IN ({placeholders})",
+                           (user_id, *names))
+            existing = {row[0] for row in cursor.fetchall()}
+            inserted, batch_names = [], set()
+            for name, image_data, metadata in images:
+                collides = name in existing or name in batch_names
+                if collides and policy == self.COLLISION_RENAME:
+                    name = self.get_free_name(cursor, user_id, name, batch_names)
+                elif collides and (policy == self.COLLISION_SKIP or name in batch_names):
+                    continue
+                batch_names.add(name)
+                inserted.append((name, image_data, metadata))
+            self.delete_references(cursor, user_id, [name for name, *rest in inserted if name in existing])
+            cursor.executemany(
+                "INSERT INTO images (user_id, name, size, mime_type, width, height, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(user_id, name, *metadata) for name, image_data, metadata in inserted])
+            stored = 0
+            for name, image_data, metadata in inserted:
+                content_hash = metadata[4]
+                if self.add_reference(cursor, content_hash):
+                    continue
+                cursor.execute("INSERT INTO blobs (content_hash, ref_count, data) VALUES (?, 1, ?)",
+                               (content_hash, image_data))
+                if content_hash in thumbnails: # Otherwise it gets backfilled
+                    cursor.execute("INSERT INTO thumbnails (blob_id, data) VALUES (?, ?)",
+                                   (cursor.lastrowid, thumbnails[content_hash]))
+                stored += 1
+        return inserted, stored
+
+    def get_free_name(self, cursor, user_id, name, taken):
+        """Find an unused name by adding a numbered suffix, as in photo (2).png.
+
+        Args:
+            cursor (sqlite3.Cursor): A cursor in the import transaction.
+            user_id (int): The ID of the user.
+            name (str): The name that is already used.
+            taken (set): Names used by the batch being inserted.
+
+        Returns:
+            str: The unused name.
+        """
+        stem, extension = splitext(name)
+        number = 2
+        while True:
+            candidate = f'{stem} ({number}){extension}'
+            cursor.execute("SELECT 1 FROM images WHERE user_id = ? AND name = ?", (user_id, candidate))
+            if candidate not in taken and cursor.fetchone() is None:
+                return candidate
+            number += 1
+
+    @Metrics.timed('db.delete_image')
     def delete_image(self, user_id, name):
         """Delete an image from the database."""
         try:
-            self.cursor.execute(
-                "DELETE FROM images WHERE user_id = ? AND name = ?",
-                (user_id, name))
-            self.connection.commit()
+            with self.transaction() as cursor:
+                self.delete_references(cursor, user_id, [name])
         except sqlite3.Error as e:
             self.show_error(f"Error deleting image: {e}")
 
+    @Metrics.timed('db.add_user')
     def add_user(self, name, email, password):
         """Add a user to the database."""
         try:
-            self.cursor.execute(
-                "INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
-                (name, email, password))
-            self.connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute(
+                    "INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
+                    (name, email, password))
         except sqlite3.Error as e:
             self.show_error(f"Error adding user: {e}")
 
+    @Metrics.timed('db.update_user_password')
     def update_user_password(self, user_id, new_password):
         """Update the password for a user in the database."""
         try:
-            self.cursor.execute("UPDATE users SET password = ? WHERE id = ?",
-                (new_password, user_id))
-            self.connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute("UPDATE users SET password = ? WHERE id = ?",
+                    (new_password, user_id))
         except sqlite3.Error as e:
             self.show_error(f"Error updating password: {e}")
 
+    def save_metrics(self, records):
+        """Save operation timings and drop the ones older than METRICS_RETENTION.
+
+        Args:
+            records (list): Records in the format of the Metrics ring buffer.
+        """
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany("INSERT INTO metrics (recorded_at, operation, duration_ms, bytes, ok) "
+                                   "VALUES (?, ?, ?, ?, ?)",
+                                   [record[1:] for record in records])
+                cursor.execute("DELETE FROM metrics WHERE recorded_at < ?", (time() - self.METRICS_RETENTION,))
+        except sqlite3.Error as e:
+            self.show_error(f"Error saving metrics: {e}")
+
+    def get_metrics(self, since=None, operation=''):
+        """Retrieve saved operation timings.
+
+        Args:
+            since (float): Only return timings recorded after this UNIX time.
+            operation (str): Only return operations whose name starts with this prefix.
+
+        Returns:
+            list: Records in the format of the Metrics ring buffer.
+        """
+        return self.get_connection().execute(
+            "SELECT id, recorded_at, operation, duration_ms, bytes, ok FROM metrics "
+            "WHERE recorded_at >= ? AND substr(operation, 1, ?) = ?",
+            (since or 0, len(operation), operation)).fetchall()
+
     def disconnect_db(self):
-        """Close the database connection."""
-        self.connection.close()
+        """Close the database connection and the connections of worker threads."""
+        with self.connections_lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            connection.close()
+        self.connection = None
+        self.local = local()
 
     def show_error(self, msg):
-        """Display an error message dialog."""
+        """Report an error to the error callback, or display an error message dialog."""
+        if self.on_error:
+            self.on_error(msg)
+            return
+        from tkinter import messagebox # Only the GUI shows dialogs, the CLI runs without a display
         messagebox.showerror('Error', msg)
+
+
+class BlobReader(RawIOBase):
+    """A read-only raw file object over an incremental BLOB handle.
+
+    Owns the connection the BLOB was opened on and closes it together with the handle.
+    """
+
+    def __init__(self, connection, blob):
+        """Initialize the BlobReader.
+
+        Args:
+            connection (sqlite3.Connection): The connection the BLOB was opened on.
+            blob (sqlite3.Blob): The BLOB handle.
+        """
+        super().__init__()
+        self.connection = connection
+        self.blob = blob
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.blob.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=SEEK_SET):
+        self.blob.seek(offset, whence)
+        return self.blob.tell()
+
+    def tell(self):
+        return self.blob.tell()
+
+    def close(self):
+        if not self.closed:
+            self.blob.close()
+            self.connection.close()
+        super().close()
@@ -1,43 +1,53 @@
 from tkinter import filedialog, simpledialog, messagebox
-from secrets import token_bytes
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.exceptions import InvalidTag
-from os import startfile
+from functools import partial
+from os import startfile, cpu_count
 from os import remove
-from os.path import splitext
-from stegano import lsb
-from stegano.lsb import generators
-from argon2 import PasswordHasher
-import base64
+from os.path import splitext, exists, getsize, join, normpath
+from io import BytesIO
 from PIL import UnidentifiedImageError
+from LsbEngine import LsbEngine
+from ImageOperations import ImageOperations
+from CryptoContainer import CryptoContainer
+from JobRunner import JobRunner, JobCancelled
 
 class ImageHandler:
     """Handles image encryption, decryption, hiding, and revealing operations."""
 
-    def __init__(self):
-        """Initialize the Authenticator."""
-        self.password_hasher = PasswordHasher(time_cost=1, memory_cost=47104, parallelism=1, hash_len=32, salt_len=16)
+    def __init__(self, job_runner=None):
+        """Initialize the ImageHandler.
 
-    def derive_key(self, password, salt):
+        Args:
+            job_runner (JobRunner): Runs the CPU-heavy work. Work runs synchronously if not given.
+
+        """
+        self.job_runner = job_runner or JobRunner()
+        self.operations = ImageOperations()
+        self.lsb_engine = self.operations.lsb_engine
+
+    def derive_key(self, password, salt, time_cost=None, memory_cost=None, parallelism=None):
         """Derives a cryptographic key from the given password and salt.
 
         Args:
-            password (str): The password to derive the key from.
+            password (bytes): The password to derive the key from.
             salt (bytes): The salt used in key derivation.
+            time_cost (int): The Argon2 time cost, defaults to the one of the key deriver.
+            memory_cost (int): The Argon2 memory cost in KiB, defaults to the one of the key deriver.
+            parallelism (int): The Argon2 parallelism, defaults to the one of the key deriver.
 
         Returns:
             bytes: The derived cryptographic key.
 
         """
-        output = self.password_hasher.hash(password, salt=salt) # Get output of hasher
-        encoded_hash = output.split('$')[-1] # Unpadded b64 encoded hash
-        return base64.b64decode(encoded_hash + "=") # Add padding and decode hash
+        return self.operations.derive_key(password, salt, time_cost, memory_cost, parallelism)
 
-    def encrypt_image(self, image_data):
-        """Encrypts image data using AES-256-GCM.
+    def encrypt_image(self, image, compression=CryptoContainer.COMPRESSION_NONE):
+        """Encrypts an image file using AES-256-GCM, streaming it in chunks in a worker.
 
         Args:
-            image_data (bytes): The image data to be encrypted.
+            image (str or file-like): The path to the image or a file object with its data.
+            compression (str): The compression method applied before encryption, one of
+                CryptoContainer.COMPRESSIONS.
 
         """
         password = simpledialog.askstring('Password', 'Enter password for resulting file:')
@@ -49,24 +59,26 @@ class ImageHandler:
         except UnicodeEncodeError as e:
             self.show_error('Invalid password.')
             return
-        nonce = token_bytes(12) # Initialization Vector (IV)
-        salt = token_bytes(16) # Generate random salt
-        key = self.derive_key(password, salt)
-        ciphertext = nonce + AESGCM(key).encrypt(nonce, image_data, password) + salt
         filepath = self.get_save_image_filepath()
         if not filepath:
             self.show_error('Operation canceled.')
             return
-        with open(filepath, 'wb') as encrypted_file:
-            encrypted_file.write(ciphertext)
-        self.show_success(f'Encryption successful. Encrypted image saved to {filepath}')
-        startfile(filepath)
 
-    def decrypt_image(self, image_data):
-        """Decrypts image data.
+        def on_done(result):
+            self.show_success(f'Encryption successful. Encrypted image saved to {filepath}')
+            startfile(filepath)
+
+        self.job_runner.submit(partial(self.operations.encrypt, compression=compression,
+                                       workers=self.job_runner.process_workers,
+                                       executor=self.job_runner.get_pool(processes=True)),
+                               image, filepath, password, on_done=on_done, report_progress=True,
+                               on_error=lambda e: self.on_job_error(e, [(OSError, 'Encryption failed.')], filepath))
+
+    def decrypt_image(self, image):
+        """Decrypts an encrypted image file, streaming it in chunks in a worker.
 
         Args:
-            image_data (bytes): The image data to be decrypted.
+            image (str or file-like): The path to the encrypted image or a file object with its data.
 
         """
         password = simpledialog.askstring('Password', 'Enter password:')
@@ -78,132 +90,396 @@ class ImageHandler:
         except UnicodeEncodeError as e:
             self.show_error('Invalid password.')
             return
-        try:
-            nonce = image_data[:12]
-            salt = image_data[-16:]
-            key = self.derive_key(password, salt)
-            ciphertext = image_data[12:-16]
-            decrypted_data = AESGCM(key).decrypt(nonce, ciphertext, password)
-        except InvalidTag as e:
-            self.show_error('Decryption failed.')
-            return
         filepath = self.get_save_image_filepath()
         if not filepath:
             self.show_error('Operation canceled.')
             return
-        with open(filepath, 'wb') as decrypted_file:
-            decrypted_file.write(decrypted_data)
-        self.show_success(f'Decryption successful. Decrypted image saved to {filepath}')
-        startfile(filepath)
 
-    def hide_image(self, carrier_image_path, secret_image_data):
-        """Hides an image within another image.
+        def on_done(result):
+            self.show_success(f'Decryption successful. Decrypted image saved to {filepath}')
+            startfile(filepath)
+
+        self.job_runner.submit(partial(self.operations.decrypt, workers=self.job_runner.process_workers,
+                                       executor=self.job_runner.get_pool(processes=True)),
+                               image, filepath, password, on_done=on_done, report_progress=True,
+                               on_error=lambda e: self.on_job_error(
+                                   e, [((InvalidTag, ValueError), 'Decryption failed.')], filepath))
+
+    def hide_image(self, carrier_image_path, secret_image_data, strategy=LsbEngine.STRATEGY_PRIMES,
+                   bits_per_channel=1, save_to_db=None):
+        """Hides an image within another image in a worker.
 
         Args:
-            carrier_image_path (str): The path to the carrier image.
-            secret_image_data (bytes): The image data to be hidden.
+            carrier_image_path (str, bytes or file-like): The path to the carrier image, its data or a file object with its data.
+            secret_image_data (str or bytes): The path to the image to be hidden or its data.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+            save_to_db (callable): Called as save_to_db(name, data) to save the stego image in the
+                database instead of a file, if the user chooses so. Returns whether it was saved.
 
         """
-        try:
-            hex_string = secret_image_data.hex()
-            carrier_image = lsb.hide(carrier_image_path, hex_string, generators.eratosthenes())
-        except UnidentifiedImageError as e:
-            self.show_error('The carrier image could not be identified.')
+        secret_size = getsize(secret_image_data) if isinstance(secret_image_data, str) else len(secret_image_data)
+        if self.offer_shards(carrier_image_path, secret_image_data, LsbEngine.PAYLOAD_IMAGE, secret_size,
+                             strategy, bits_per_channel):
             return
-        except Exception as e:
-            self.show_error('The message you want to hide is too long for the carrier OR the secret image could not be identified.')
+        if not self.check_capacity(carrier_image_path, secret_size, strategy, bits_per_channel):
             return
-        filepath = self.get_save_image_filepath()
-        if not filepath:
-            self.show_error('Operation canceled.')
+        password = self.get_strategy_password(strategy)
+        if password is None:
             return
-        carrier_image.save(filepath)
-        self.show_success(f'Image hidden successfully. Stego image saved to {filepath}')
-        carrier_image.show()
+        destination = self.get_destination(save_to_db, 'stego_image.png')
+        if destination is None:
+            return
+        name, filepath = destination
+        output = filepath or BytesIO()
+
+        def on_done(carrier_image):
+            self.on_saved(output, name, save_to_db, 'Image hidden successfully. Stego image saved')
 
-    def reveal_image(self, filepath):
-        """Reveals a hidden image from a steganographic image.
+        self.job_runner.submit(self.operations.hide_image, carrier_image_path, secret_image_data, output,
+                               strategy, password, bits_per_channel,
+                               on_done=on_done,
+                               on_error=lambda e: self.on_job_error(e, [
+                                   (UnidentifiedImageError, 'The carrier image could not be identified.'),
+                                   (Exception, 'The message you want to hide is too long for the carrier OR the secret image could not be identified.')],
+                                   filepath))
+
+    def reveal_image(self, filepath, strategy=LsbEngine.STRATEGY_PRIMES, save_to_db=None):
+        """Reveals a hidden image from a steganographic image in a worker.
 
         Args:
-            filepath (str): The path to the stego image.
+            filepath (str, bytes or file-like): The path to the stego image, its data or a file object with its data.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            save_to_db (callable): Called as save_to_db(name, data) to save the revealed image in
+                the database instead of a file, if the user chooses so. Returns whether it was saved.
 
         """
-        try:
-            hex_string = lsb.reveal(filepath, generators.eratosthenes())
-        except UnidentifiedImageError as e:
-            self.show_error('The image could not be identified.')
+        password = self.get_strategy_password(strategy)
+        if password is None:
             return
-        except IndexError as e:
-            self.show_error('No hidden image found.')
+
+        def on_done(result):
+            payload_type, payload = result
+            if not payload:
+                self.show_error('No hidden image found.')
+                return
+            if payload_type == LsbEngine.PAYLOAD_TEXT:
+                self.show_error('No hidden image found. The secret message could be text instead.')
+                return
+            if payload_type == LsbEngine.PAYLOAD_SHARD:
+                self.reveal_shards(filepath, payload, strategy, password, LsbEngine.PAYLOAD_IMAGE, save)
+                return
+            if payload_type == LsbEngine.PAYLOAD_LEGACY:
+                payload_type, payload = self.operations.decode_legacy(payload)
+                if payload_type == LsbEngine.PAYLOAD_TEXT:
+                    self.show_error('The message is not an image and could not be saved. The secret message could be text instead.')
+                    return
+            save(payload)
+
+        def save(payload):
+            destination = self.get_destination(save_to_db, 'revealed_image.png')
+            if destination is None:
+                return
+            name, save_filepath = destination
+            if save_filepath:
+                with open(save_filepath, 'wb') as f:
+                    f.write(payload)
+            self.on_saved(save_filepath or BytesIO(payload), name, save_to_db,
+                          'Image revealed successfully. Revealed image saved')
+
+        self.job_runner.submit(self.lsb_engine.reveal_payload, filepath, strategy, password,
+                               on_done=on_done,
+                               on_error=lambda e: self.on_job_error(e, [
+                                   (UnidentifiedImageError, 'The image could not be identified.'),
+                                   (IndexError, 'No hidden image found.')]))
+
+    def hide_text(self, carrier_image_path, secret_text, strategy=LsbEngine.STRATEGY_PRIMES,
+                  bits_per_channel=1, save_to_db=None):
+        """Hides text within an image in a worker.
+
+        Args:
+            carrier_image_path (str, bytes or file-like): The path to the carrier image, its data or a file object with its data.
+            secret_text (str): The text to be hidden.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+            save_to_db (callable): Called as save_to_db(name, data) to save the stego image in the
+                database instead of a file, if the user chooses so. Returns whether it was saved.
+
+        """
+        secret_data = secret_text.encode('utf-8')
+        if self.offer_shards(carrier_image_path, secret_text, LsbEngine.PAYLOAD_TEXT, len(secret_data),
+                             strategy, bits_per_channel):
             return
-        if not hex_string:
-            self.show_error('No hidden image found.')
+        if not self.check_capacity(carrier_image_path, len(secret_data), strategy, bits_per_channel):
             return
-        filepath = self.get_save_image_filepath()
-        if not filepath:
-            self.show_error('Operation canceled.')
+        password = self.get_strategy_password(strategy)
+        if password is None:
+            return
+        destination = self.get_destination(save_to_db, 'stego_image.png')
+        if destination is None:
+            return
+        name, filepath = destination
+        output = filepath or BytesIO()
+
+        def on_done(carrier_image):
+            self.on_saved(output, name, save_to_db, 'Text hidden successfully. Stego image saved')
+
+        self.job_runner.submit(self.operations.hide_text, carrier_image_path, secret_text, output,
+                               strategy, password, bits_per_channel,
+                               on_done=on_done,
+                               on_error=lambda e: self.on_job_error(e, [
+                                   (UnidentifiedImageError, 'The image could not be identified.'),
+                                   (Exception, 'The message you want to hide is too long for the carrier.')],
+                                   filepath))
+
+    def reveal_text(self, filepath, strategy=LsbEngine.STRATEGY_PRIMES):
+        """Reveals text hidden within an image in a worker.
+
+        Args:
+            filepath (str, bytes or file-like): The path to the stego image, its data or a file object with its data.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+
+        """
+        password = self.get_strategy_password(strategy)
+        if password is None:
             return
-        with open(filepath, 'wb') as f:
-            try:
-                f.write(bytes.fromhex(hex_string))
-            except ValueError as e:
-                f.close()
-                remove(filepath)
-                self.show_error('The message contained invalid characters and could not be saved. The secret message could be text instead.')
+
+        def on_done(result):
+            payload_type, revealed_text = result
+            if payload_type == LsbEngine.PAYLOAD_IMAGE:
+                self.show_error('No hidden text found. The secret could be an image instead.')
+                return
+            if payload_type == LsbEngine.PAYLOAD_SHARD:
+                self.reveal_shards(filepath, revealed_text, strategy, password, LsbEngine.PAYLOAD_TEXT, save)
                 return
-        self.show_success(f'Image revealed successfully. Revealed image saved to {filepath}')
-        startfile(filepath)
+            if payload_type == LsbEngine.PAYLOAD_TEXT:
+                try:
+                    revealed_text = revealed_text.decode('utf-8')
+                except UnicodeDecodeError as e:
+                    self.show_error('No hidden text found.')
+                    return
+            if not revealed_text:
+                self.show_error('No hidden text found.')
+                return
+            save(revealed_text)
+
+        def save(revealed_text):
+            save_filepath = filedialog.asksaveasfilename(defaultextension='.txt', filetypes=[('TXT files','*.txt')])
+            if not save_filepath:
+                self.show_error('Operation canceled.')
+                return
+            with open(save_filepath, 'w') as f:
+                f.write(revealed_text)
+            self.show_success(f'Text revealed successfully. Revealed text saved to {save_filepath}')
+            startfile(save_filepath)
+
+        self.job_runner.submit(self.lsb_engine.reveal_payload, filepath, strategy, password,
+                               on_done=on_done,
+                               on_error=lambda e: self.on_job_error(e, [
+                                   (UnidentifiedImageError, 'The image could not be identified.'),
+                                   (IndexError, 'No hidden text found.')]))
 
-    def hide_text(self, carrier_image_path, secret_text):
-        """Hides text within an image.
+    def offer_shards(self, carrier_image_path, secret, payload_type, payload_size, strategy, bits_per_channel):
+        """Offers to spread a payload that does not fit in the carrier over several carriers, and does so in a worker.
 
         Args:
-            carrier_image_path (str): The path to the carrier image.
-            secret_text (str): The text to be hidden.
+            carrier_image_path (str, bytes or file-like): The path to the carrier image, its data or a file object with its data.
+            secret (str or bytes): The path to the secret image or its data, or the secret text.
+            payload_type (int): LsbEngine.PAYLOAD_IMAGE or LsbEngine.PAYLOAD_TEXT.
+            payload_size (int): The size of the payload in bytes.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+
+        Returns:
+            bool: True if the payload was handled here, False if it fits or the user declined.
 
         """
         try:
-            carrier_image = lsb.hide(carrier_image_path, secret_text, generators.eratosthenes())
+            capacity = self.capacity(carrier_image_path, strategy, bits_per_channel)
+        except UnidentifiedImageError as e:
+            return False
+        if payload_size <= capacity or not messagebox.askyesno(
+                'Spread Payload', f'The message you want to hide is too long for the carrier '
+                                  f'({payload_size} bytes, capacity {capacity} bytes). '
+                                  f'Do you want to spread it over several carrier images?'):
+            return False
+        carriers = [carrier_image_path]
+        carriers += filedialog.askopenfilenames(title='Select the other carrier images',
+                                                filetypes=[('Image', '*.jpg;*.jpeg;*.png;')])
+        if len(carriers) < 2:
+            self.show_error('Operation canceled.')
+            return True
+        try:
+            capacities = [self.operations.shard_capacity(carrier, strategy, bits_per_channel) for carrier in carriers]
         except UnidentifiedImageError as e:
-            self.show_error('The image could not be identified.')
+            self.show_error('A carrier image could not be identified.')
+            return True
+        if payload_size > sum(capacities):
+            self.show_error(f'The message you want to hide is too long for the carriers '
+                            f'({payload_size} bytes, capacity {sum(capacities)} bytes).')
+            return True
+        password = self.get_shard_password(strategy)
+        if password is None:
+            return True
+        directory = filedialog.askdirectory(title='Select the folder for the stego images')
+        if not directory:
+            self.show_error('Operation canceled.')
+            return True
+        destinations = [join(directory, f'stego_image_{i + 1}.png') for i in range(len(carriers))]
+        if any(exists(destination) for destination in destinations) and not messagebox.askyesno(
+                'Overwrite', f'Stego images already exist in {directory}. Do you want to overwrite them?'):
+            self.show_error('Operation canceled.')
+            return True
+        if payload_type == LsbEngine.PAYLOAD_IMAGE:
+            hide = self.operations.hide_image_shards
+        else:
+            hide = self.operations.hide_text_shards
+
+        def on_done(result):
+            self.show_success(f'Payload spread successfully over {len(carriers)} stego images saved to {directory}')
+            startfile(directory)
+
+        self.job_runner.submit(partial(hide, workers=min(len(carriers), cpu_count())), carriers, secret,
+                               destinations, strategy, password, bits_per_channel,
+                               on_done=on_done,
+                               on_error=lambda e: self.on_job_error(e, [
+                                   (UnidentifiedImageError, 'A carrier image could not be identified.'),
+                                   (Exception, 'The message you want to hide is too long for the carriers.')]))
+        return True
+
+    def reveal_shards(self, filepath, shard, strategy, password, payload_type, save):
+        """Asks for the other carriers of a payload spread over several images and reveals it in a worker.
+
+        Args:
+            filepath (str, bytes or file-like): The stego image holding the first shard found.
+            shard (bytes): The shard revealed from it.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            password (str): The password for the permuted strategy, which also authenticates the
+                shards, or an empty string to ask for the shard password.
+            payload_type (int): The expected payload, LsbEngine.PAYLOAD_IMAGE or LsbEngine.PAYLOAD_TEXT.
+            save (callable): Called with the revealed image bytes or text.
+
+        """
+        try:
+            set_id, index, count = self.operations.parse_shard(shard)[:3]
+        except ValueError as e:
+            self.show_error('The image holds a damaged part of a payload.')
             return
-        except Exception as e:
-            self.show_error('The message you want to hide is too long for the carrier.')
+        if not messagebox.askokcancel('Reveal Payload', f'The image holds part {index + 1} of {count} of a payload '
+                                                        f'spread over several images. Select the images holding the other parts.'):
+            self.show_error('Operation canceled.')
             return
-        filepath = self.get_save_image_filepath()
-        if not filepath:
+        filepaths = filedialog.askopenfilenames(title='Select the other stego images',
+                                                filetypes=[('Image', '*.png;')])
+        if not filepaths:
+            self.show_error('Operation canceled.')
+            return
+        password = password or self.get_shard_password(strategy)
+        if password is None:
+            return
+        if isinstance(filepath, str):
+            images = [filepath] + [path for path in filepaths if normpath(path) != normpath(filepath)]
+        elif isinstance(filepath, bytes):
+            images = [filepath, *filepaths]
+        else:
+            filepath.seek(0) # The file object is closed once the first reveal job is done
+            images = [filepath.read(), *filepaths]
+
+        def on_done(result):
+            revealed_type, payload = result
+            if revealed_type != payload_type:
+                self.show_error('No hidden image found. The secret message could be text instead.'
+                                if payload_type == LsbEngine.PAYLOAD_IMAGE else
+                                'No hidden text found. The secret could be an image instead.')
+                return
+            save(payload)
+
+        self.job_runner.submit(partial(self.operations.reveal_shards, workers=min(len(images), cpu_count())),
+                               images, strategy, password,
+                               on_done=on_done,
+                               on_error=lambda e: self.on_job_error(e, [
+                                   (UnidentifiedImageError, 'An image could not be identified.'),
+                                   (ValueError, str(e)),
+                                   (IndexError, 'No hidden part found in an image.')]))
+
+    def on_job_error(self, error, messages, filepath=None):
+        """Shows the error message matching the exception of a failed job.
+
+        Args:
+            error (Exception): The exception raised by the job.
+            messages (list): (exception type, message) pairs, checked in order.
+            filepath (str): A partially written output file to remove.
+
+        """
+        if filepath and exists(filepath):
+            remove(filepath)
+        if isinstance(error, JobCancelled):
             self.show_error('Operation canceled.')
             return
-        carrier_image.save(filepath)
-        self.show_success(f'Text hidden successfully. Stego image saved to {filepath}')
-        carrier_image.show()
+        for error_type, msg in messages:
+            if isinstance(error, error_type):
+                self.show_error(msg)
+                return
+        raise error
+
+    def capacity(self, carrier_image_path, strategy=LsbEngine.STRATEGY_PRIMES, bits_per_channel=1):
+        """Computes how many bytes can be hidden in a carrier image without decoding it.
+
+        Args:
+            carrier_image_path (str, bytes or file-like): The path to the carrier image, its data or a file object with its data.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+
+        Returns:
+            int: The capacity in bytes.
+
+        Raises:
+            PIL.UnidentifiedImageError: If the carrier image could not be identified.
+
+        """
+        return self.operations.capacity(carrier_image_path, strategy, bits_per_channel)
 
-    def reveal_text(self, filepath):
-        """Reveals text hidden within an image.
+    def check_capacity(self, carrier_image_path, payload_size, strategy, bits_per_channel):
+        """Checks that a payload fits in a carrier image and shows an error if it does not.
 
         Args:
-            filepath (str): The path to the stego image.
+            carrier_image_path (str, bytes or file-like): The path to the carrier image, its data or a file object with its data.
+            payload_size (int): The size of the payload in bytes.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+
+        Returns:
+            bool: True if the payload fits, False otherwise.
 
         """
         try:
-            revealed_text = lsb.reveal(filepath, generators.eratosthenes())
+            capacity = self.capacity(carrier_image_path, strategy, bits_per_channel)
         except UnidentifiedImageError as e:
-            self.show_error('The image could not be identified.')
-            return
-        except IndexError as e:
-            self.show_error('No hidden text found.')
-            return
-        if not revealed_text:
-            self.show_error('No hidden text found.')
-            return
-        filepath = filedialog.asksaveasfilename(defaultextension='.txt', filetypes=[('TXT files','*.txt')])
-        if not filepath:
+            self.show_error('The carrier image could not be identified.')
+            return False
+        if payload_size > capacity:
+            self.show_error(f'The message you want to hide is too long for the carrier '
+                            f'({payload_size} bytes, capacity {capacity} bytes).')
+            return False
+        return True
+
+    def get_strategy_password(self, strategy):
+        """Asks for the password that seeds the pixel order of the permuted strategy.
+
+        Args:
+            strategy (str): The pixel position strategy.
+
+        Returns:
+            str: The password, an empty string if the strategy needs none, or None if canceled.
+
+        """
+        if strategy != LsbEngine.STRATEGY_PERMUTED:
+            return ''
+        password = simpledialog.askstring('Password', 'Enter password for pixel order:', show='*')
+        if not password:
             self.show_error('Operation canceled.')
-            return
-        with open(filepath, 'w') as f:
-            f.write(revealed_text)
-        self.show_success(f'Text revealed successfully. Revealed text saved to {filepath}')
-        startfile(filepath)
+            return None
+        return password
 
     def show_success(self, msg):
         """Displays a success message.
@@ -223,6 +499,70 @@ class ImageHandler:
         """
         messagebox.showerror('Error', msg)
 
+    def get_destination(self, save_to_db, default_name):
+        """Asks where an image created by an operation is saved: in the database or in a file.
+
+        Args:
+            save_to_db (callable): Saves to the database, or None if the database is unavailable.
+            default_name (str): The suggested database name.
+
+        Returns:
+            tuple: The database name and None, or None and the file path. None if canceled.
+
+        """
+        if save_to_db:
+            selection = messagebox.askyesnocancel('Save Image', 'Do you want to save the result to the database?')
+            if selection is None:
+                self.show_error('Operation canceled.')
+                return None
+            if selection:
+                name = simpledialog.askstring('Image name', 'Enter name for the image:', initialvalue=default_name)
+                if not name:
+                    self.show_error('Operation canceled.')
+                    return None
+                return name, None
+        filepath = self.get_save_image_filepath()
+        if not filepath:
+            self.show_error('Operation canceled.')
+            return None
+        return None, filepath
+
+    def on_saved(self, output, name, save_to_db, msg):
+        """Stores an in-memory result in the database, or opens a saved file, and reports success.
+
+        Args:
+            output (str or io.BytesIO): The saved file path, or the buffer holding the result.
+            name (str): The database name, if saving to the database.
+            save_to_db (callable): Saves to the database.
+            msg (str): The success message, completed with where the result went.
+
+        """
+        if isinstance(output, str):
+            self.show_success(f'{msg} to {output}')
+            startfile(output)
+        elif save_to_db(name, output.getvalue()):
+            self.show_success(f'{msg} to the database as {name}')
+
+    def get_shard_password(self, strategy):
+        """Asks for the password that authenticates the parts of a payload spread over several images.
+
+        The permuted strategy uses its pixel order password for both.
+
+        Args:
+            strategy (str): The pixel position strategy.
+
+        Returns:
+            str: The password, or None if canceled.
+
+        """
+        if strategy == LsbEngine.STRATEGY_PERMUTED:
+            return self.get_strategy_password(strategy)
+        password = simpledialog.askstring('Password', 'Enter password for the parts:', show='*')
+        if not password:
+            self.show_error('Operation canceled.')
+            return None
+        return password
+
     def get_save_image_filepath(self):
         """Opens a dialog to get the filepath to save an image.
 
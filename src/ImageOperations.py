@@ -0,0 +1,542 @@
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from io import BytesIO
+from os import remove
+from os.path import exists
+from secrets import token_bytes
+from struct import Struct
+from PIL import Image
+from LsbEngine import LsbEngine
+from CryptoContainer import CryptoContainer
+from KeyDeriver import KeyDeriver
+from Metrics import Metrics
+from MappedBuffer import MappedBuffer
+
+class ImageOperations:
+    """Encrypts, decrypts, hides and reveals images without any user interaction.
+
+    Every operation takes paths, file objects or bytes plus its parameters and reports failures
+    by raising, so it can be used from the GUI, from scripts and from worker processes.
+
+    Payloads too large for one carrier can be split into shards hidden in several carriers.
+    Every shard starts with a shard header holding the random ID of the set, the index of the
+    shard, the shard count, the payload type and length, and a BLAKE2b digest of the header
+    and the shard data. The digest is keyed with an Argon2 key derived from a password and the
+    set ID, so shards are authenticated and a password is required. The shards are hidden
+    and revealed in parallel worker processes.
+    """
+
+    SHARD_HEADER = Struct('>16sHHBI16s') # Set ID, shard index, shard count, payload type, payload length, digest
+    SHARD_DIGEST_SIZE = 16
+    MAX_SHARDS = 0xFFFF
+    worker_operations = None # ImageOperations of a worker process, created on first use
+
+    def __init__(self):
+        """Initialize the ImageOperations."""
+        self.key_deriver = KeyDeriver(time_cost=1, memory_cost=47104, parallelism=1, hash_len=32)
+        self.lsb_engine = LsbEngine()
+        self.crypto_container = CryptoContainer(self.derive_key, self.key_deriver.params)
+
+    def derive_key(self, password, salt, time_cost=None, memory_cost=None, parallelism=None):
+        """Derives a cryptographic key from the given password and salt.
+
+        Args:
+            password (bytes): The password to derive the key from.
+            salt (bytes): The salt used in key derivation.
+            time_cost (int): The Argon2 time cost, defaults to the one of the key deriver.
+            memory_cost (int): The Argon2 memory cost in KiB, defaults to the one of the key deriver.
+            parallelism (int): The Argon2 parallelism, defaults to the one of the key deriver.
+
+        Returns:
+            bytes: The derived cryptographic key.
+
+        """
+        return self.key_deriver.derive_key(password, salt, time_cost, memory_cost, parallelism)
+
+    def encrypt(self, source, destination, password, progress=None,
+                compression=CryptoContainer.COMPRESSION_NONE, level=None, workers=1, executor=None):
+        """Encrypts a file with AES-256-GCM, optionally compressing it first.
+
+        Args:
+            source (str or file-like): The file to encrypt.
+            destination (str or file-like): The file the encrypted data is written to.
+            password (bytes): The password the key is derived from.
+            progress (callable): Called as progress(done, total) in bytes while encrypting.
+            compression (str): The compression method, one of CryptoContainer.COMPRESSIONS.
+                Skipped for data that is already compressed.
+            level (int): The compression level, 0 to 9, the library default if None.
+            workers (int): The number of worker processes encrypting chunks of large
+                uncompressed files on disk in parallel.
+            executor (concurrent.futures.ProcessPoolExecutor): A long-lived pool with that many
+                workers, used instead of starting one per file.
+
+        """
+        self.crypto_container.encrypt(source, destination, password, progress, compression, level, workers,
+                                      executor)
+
+    def decrypt(self, source, destination, password, progress=None, workers=1, executor=None):
+        """Decrypts a file encrypted by encrypt or by earlier versions of the program.
+
+        Args:
+            source (str or file-like): The encrypted file.
+            destination (str or file-like): The file the decrypted data is written to.
+            password (bytes): The password the key is derived from.
+            progress (callable): Called as progress(done, total) in bytes while decrypting.
+            workers (int): The number of worker processes decrypting chunks of large
+                uncompressed files on disk in parallel.
+            executor (concurrent.futures.ProcessPoolExecutor): A long-lived pool with that many
+                workers, used instead of starting one per file.
+
+        Raises:
+            cryptography.exceptions.InvalidTag: If the password is wrong or the file was modified.
+
+        """
+        self.crypto_container.decrypt(source, destination, password, progress, workers, executor)
+
+    def capacity(self, carrier, strategy=LsbEngine.STRATEGY_PRIMES, bits_per_channel=1):
+        """Computes how many bytes can be hidden in a carrier image without decoding it.
+
+        Args:
+            carrier (str, bytes or file-like): The carrier image.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+
+        Returns:
+            int: The capacity in bytes.
+
+        Raises:
+            PIL.UnidentifiedImageError: If the carrier image could not be identified.
+
+        """
+        return self.lsb_engine.capacity(carrier, strategy, bits_per_channel)
+
+    @Metrics.timed('stego.hide')
+    def hide(self, carrier, data, payload_type, destination=None, strategy=LsbEngine.STRATEGY_PRIMES,
+             password=None, bits_per_channel=1):
+        """Hides a payload in a carrier image and optionally saves the result as PNG.
+
+        Args:
+            carrier (str, bytes or file-like): The carrier image.
+            data (bytes): The payload to hide.
+            payload_type (int): LsbEngine.PAYLOAD_IMAGE, LsbEngine.PAYLOAD_TEXT or LsbEngine.PAYLOAD_SHARD.
+            destination (str or file-like): Where the stego image is saved, if given.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            password (str): The password for the permuted strategy.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+
+        Returns:
+            PIL.Image.Image: The stego image.
+
+        Raises:
+            PIL.UnidentifiedImageError: If the carrier image could not be identified.
+            ValueError: If the payload is too long for the carrier.
+
+        """
+        stego_image = self.lsb_engine.hide_payload(carrier, data, payload_type, strategy, password,
+                                                   bits_per_channel)
+        if destination is not None:
+            with Metrics.measure('stego.encode_png'):
+                stego_image.save(destination, format='PNG')
+        return stego_image
+
+    def hide_image(self, carrier, secret_image, destination=None, strategy=LsbEngine.STRATEGY_PRIMES,
+                   password=None, bits_per_channel=1):
+        """Hides an image file in a carrier image.
+
+        Args:
+            carrier (str, bytes or file-like): The carrier image.
+            secret_image (str or bytes): The path to the secret image, which is memory-mapped
+                instead of read, or its data.
+            destination (str or file-like): Where the stego image is saved, if given.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            password (str): The password for the permuted strategy.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+
+        Returns:
+            PIL.Image.Image: The stego image.
+
+        """
+        if isinstance(secret_image, str):
+            with open(secret_image, 'rb') as f, MappedBuffer(f) as view:
+                return self.hide(carrier, f.read() if view is None else view, LsbEngine.PAYLOAD_IMAGE,
+                                 destination, strategy, password, bits_per_channel)
+        return self.hide(carrier, secret_image, LsbEngine.PAYLOAD_IMAGE, destination, strategy, password,
+                         bits_per_channel)
+
+    def hide_text(self, carrier, text, destination=None, strategy=LsbEngine.STRATEGY_PRIMES,
+                  password=None, bits_per_channel=1):
+        """Hides text in a carrier image.
+
+        Args:
+            carrier (str, bytes or file-like): The carrier image.
+            text (str): The text to hide.
+            destination (str or file-like): Where the stego image is saved, if given.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            password (str): The password for the permuted strategy.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+
+        Returns:
+            PIL.Image.Image: The stego image.
+
+        """
+        return self.hide(carrier, text.encode('utf-8'), LsbEngine.PAYLOAD_TEXT, destination, strategy,
+                         password, bits_per_channel)
+
+    @Metrics.timed('stego.reveal')
+    def reveal(self, image, strategy=LsbEngine.STRATEGY_PRIMES, password=None):
+        """Reveals the payload hidden in a stego image.
+
+        Payloads hidden in the legacy format are returned the way the GUI stored them: image
+        payloads were hex strings and are returned as image bytes, anything else as text.
+
+        Args:
+            image (str, bytes or file-like): The stego image.
+            strategy (str): The pixel position strategy the payload was hidden with.
+            password (str): The password for the permuted strategy.
+
+        Returns:
+            tuple: LsbEngine.PAYLOAD_IMAGE and the image bytes, or LsbEngine.PAYLOAD_TEXT and
+                the text.
+
+        Raises:
+            PIL.UnidentifiedImageError: If the image could not be identified.
+            IndexError: If no payload could be detected.
+            ValueError: If the image holds a shard of a payload spread over several carriers.
+
+        """
+        payload_type, payload = self.lsb_engine.reveal_payload(image, strategy, password)
+        if payload_type == LsbEngine.PAYLOAD_LEGACY:
+            return self.decode_legacy(payload)
+        if payload_type == LsbEngine.PAYLOAD_SHARD:
+            set_id, index, count = self.parse_shard(payload)[:3]
+            raise ValueError(f'The image holds part {index + 1} of {count} of a payload. '
+                             f'Reveal it together with the other carriers.')
+        return self.decode_payload(payload_type, payload)
+
+    def decode_legacy(self, payload):
+        """Tells legacy image payloads, which were hidden hex-encoded, from legacy text.
+
+        Text that happens to be valid hex, like 'cafe', is only taken for an image if the
+        decoded bytes are one.
+
+        Args:
+            payload (str): The revealed legacy payload.
+
+        Returns:
+            tuple: LsbEngine.PAYLOAD_IMAGE and the image bytes, or LsbEngine.PAYLOAD_TEXT and
+                the text.
+
+        """
+        try:
+            data = bytes.fromhex(payload)
+            with Image.open(BytesIO(data)) as image:
+                image.verify()
+        except Exception: # Not hex, or not an image; Pillow raises assorted errors for broken data
+            return LsbEngine.PAYLOAD_TEXT, payload
+        return LsbEngine.PAYLOAD_IMAGE, data
+
+    def decode_payload(self, payload_type, payload):
+        """Decodes revealed text payloads.
+
+        Args:
+            payload_type (int): LsbEngine.PAYLOAD_IMAGE or LsbEngine.PAYLOAD_TEXT.
+            payload (bytes): The revealed payload.
+
+        Returns:
+            tuple: The payload type and the image bytes or the text.
+
+        Raises:
+            IndexError: If a text payload is not valid UTF-8.
+
+        """
+        if payload_type == LsbEngine.PAYLOAD_TEXT:
+            try:
+                return payload_type, payload.decode('utf-8')
+            except UnicodeDecodeError as e:
+                raise IndexError('Impossible to detect message.') from e
+        return payload_type, payload
+
+    def shard_capacity(self, carrier, strategy=LsbEngine.STRATEGY_PRIMES, bits_per_channel=1):
+        """Computes how many payload bytes a carrier can take as one shard.
+
+        Args:
+            carrier (str, bytes or file-like): The carrier image.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+
+        Returns:
+            int: The capacity in bytes, without the shard header.
+
+        """
+        return max(0, self.capacity(carrier, strategy, bits_per_channel) - self.SHARD_HEADER.size)
+
+    def get_shard_key(self, password, set_id):
+        """Derives the key of the shard digests of a set.
+
+        Args:
+            password (str): The password the shards are authenticated with.
+            set_id (bytes): The random ID of the set, used as the salt.
+
+        Returns:
+            bytes: The key.
+
+        Raises:
+            ValueError: If no password is given.
+
+        """
+        if not password:
+            raise ValueError('A password is required to authenticate the parts of a payload.')
+        return self.derive_key(password.encode('utf-8'), set_id)
+
+    def get_shard_digest(self, fields, shard_data, key):
+        """Computes the digest that authenticates a shard.
+
+        Args:
+            fields (bytes): The packed shard header with an all-zero digest.
+            shard_data (bytes): The part of the payload in the shard.
+            key (bytes): The key of the set, from get_shard_key.
+
+        Returns:
+            bytes: The digest.
+
+        """
+        digest = blake2b(fields, digest_size=self.SHARD_DIGEST_SIZE, key=key)
+        digest.update(shard_data)
+        return digest.digest()
+
+    def split_shards(self, data, payload_type, capacities, password):
+        """Splits a payload into shards sized in proportion to the capacities of the carriers.
+
+        Args:
+            data (bytes): The payload.
+            payload_type (int): LsbEngine.PAYLOAD_IMAGE or LsbEngine.PAYLOAD_TEXT.
+            capacities (list): The shard capacity of every carrier, from shard_capacity.
+            password (str): The password the shard digests are keyed with.
+
+        Returns:
+            list: The shards, one per carrier, each with its shard header.
+
+        Raises:
+            ValueError: If the payload is too long for the carriers, there are too many carriers
+                or no password is given.
+
+        """
+        total_capacity = sum(capacities)
+        if len(data) > total_capacity or total_capacity == 0: # Also keeps the split below from dividing by zero
+            raise ValueError(f'The message you want to hide is too long for the carriers '
+                             f'({len(data)} bytes, capacity {total_capacity} bytes).')
+        if not 0 < len(capacities) <= self.MAX_SHARDS:
+            raise ValueError(f'Shards can be hidden in 1 to {self.MAX_SHARDS} carriers.')
+        sizes = [len(data) * capacity // total_capacity for capacity in capacities]
+        for i in range(len(sizes)): # Hand out the rounding remainder where there is room
+            extra = min(len(data) - sum(sizes), capacities[i] - sizes[i])
+            sizes[i] += extra
+        set_id = token_bytes(16)
+        key = self.get_shard_key(password, set_id)
+        shards = []
+        start = 0
+        for index, size in enumerate(sizes):
+            shard_data = data[start:start + size]
+            start += size
+            fields = self.SHARD_HEADER.pack(set_id, index, len(sizes), payload_type, len(data),
+                                            bytes(self.SHARD_DIGEST_SIZE))
+            digest = self.get_shard_digest(fields, shard_data, key)
+            shards.append(self.SHARD_HEADER.pack(set_id, index, len(sizes), payload_type, len(data), digest)
+                          + shard_data)
+        return shards
+
+    def parse_shard(self, shard):
+        """Parses the shard header of a revealed shard.
+
+        Args:
+            shard (bytes): The revealed shard.
+
+        Returns:
+            tuple: The set ID, shard index, shard count, payload type, payload length, digest
+                and the shard data.
+
+        Raises:
+            ValueError: If the shard is too short to hold a shard header.
+
+        """
+        if len(shard) < self.SHARD_HEADER.size:
+            raise ValueError('The shard is damaged.')
+        return (*self.SHARD_HEADER.unpack(shard[:self.SHARD_HEADER.size]), shard[self.SHARD_HEADER.size:])
+
+    def join_shards(self, shards, password):
+        """Reassembles a payload from its shards, given in any order.
+
+        Args:
+            shards (list): The revealed shards.
+            password (str): The password the shards were authenticated with.
+
+        Returns:
+            tuple: The payload type and the payload bytes.
+
+        Raises:
+            ValueError: If a shard fails authentication, shards are missing, they belong to
+                different sets or no password is given. Shards given more than once are used once.
+
+        """
+        parts = {}
+        keys = {}
+        for shard in shards:
+            set_id, index, count, payload_type, length, digest, shard_data = self.parse_shard(shard)
+            fields = self.SHARD_HEADER.pack(set_id, index, count, payload_type, length,
+                                            bytes(self.SHARD_DIGEST_SIZE))
+            if set_id not in keys:
+                keys[set_id] = self.get_shard_key(password, set_id)
+            if digest != self.get_shard_digest(fields, shard_data, keys[set_id]):
+                raise ValueError(f'Part {index + 1} is damaged or the password is wrong.')
+            if parts and (set_id, count, payload_type, length) != next(iter(parts.values()))[:4]:
+                raise ValueError('The images hold parts of different payloads.')
+            if index in parts and parts[index][4] != shard_data:
+                raise ValueError(f'Part {index + 1} was given twice with different contents.')
+            parts[index] = (set_id, count, payload_type, length, shard_data)
+        if not parts:
+            raise ValueError('No shards were given.')
+        set_id, count, payload_type, length = next(iter(parts.values()))[:4]
+        if len(parts) < count:
+            missing = ', '.join(str(index + 1) for index in range(count) if index not in parts)
+            raise ValueError(f'{len(parts)} of {count} parts were found, missing: {missing}.')
+        data = b''.join(parts[index][4] for index in range(count))
+        if len(data) != length:
+            raise ValueError('The shards do not add up to the payload.')
+        return payload_type, data
+
+    def hide_shards(self, carriers, data, payload_type, destinations, strategy=LsbEngine.STRATEGY_PRIMES,
+                    password=None, bits_per_channel=1, workers=None):
+        """Hides a payload split into shards across several carriers, in parallel worker processes.
+
+        Each carrier gets a shard sized in proportion to its capacity. The stego images are
+        saved as PNG; those already written are removed if any carrier fails.
+
+        Args:
+            carriers (list): The carrier images, as paths, bytes or file-like objects.
+            data (bytes): The payload to hide.
+            payload_type (int): LsbEngine.PAYLOAD_IMAGE or LsbEngine.PAYLOAD_TEXT.
+            destinations (list): The paths the stego images are saved to, one per carrier.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            password (str): The password authenticating the shards, also used by the permuted strategy.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+            workers (int): The number of worker processes, the number of CPUs if None.
+
+        Raises:
+            PIL.UnidentifiedImageError: If a carrier image could not be identified.
+            ValueError: If the payload is too long for the carriers, the number of destinations
+                differs from the number of carriers or no password is given.
+
+        """
+        if len(destinations) != len(carriers):
+            raise ValueError(f'{len(carriers)} carriers need as many destinations, got {len(destinations)}.')
+        carriers = [carrier if isinstance(carrier, (str, bytes)) else carrier.read() for carrier in carriers]
+        capacities = [self.shard_capacity(carrier, strategy, bits_per_channel) for carrier in carriers]
+        shards = self.split_shards(data, payload_type, capacities, password)
+        try:
+            with ProcessPoolExecutor(workers) as executor:
+                futures = [executor.submit(Metrics.collect, ImageOperations.hide_shard, carrier, shard, destination,
+                                           strategy, password, bits_per_channel)
+                           for carrier, shard, destination in zip(carriers, shards, destinations)]
+                for future in futures:
+                    Metrics.merge(future)
+        except BaseException:
+            for destination in destinations:
+                if exists(destination):
+                    remove(destination) # Drop partial output
+            raise
+
+    def hide_image_shards(self, carriers, secret_image, destinations, strategy=LsbEngine.STRATEGY_PRIMES,
+                          password=None, bits_per_channel=1, workers=None):
+        """Hides an image file across several carriers. See hide_shards.
+
+        Args:
+            carriers (list): The carrier images, as paths, bytes or file-like objects.
+            secret_image (str or bytes): The path to the secret image or its data.
+            destinations (list): The paths the stego images are saved to, one per carrier.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            password (str): The password authenticating the shards, also used by the permuted strategy.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+            workers (int): The number of worker processes, the number of CPUs if None.
+
+        """
+        if isinstance(secret_image, str):
+            with open(secret_image, 'rb') as f:
+                secret_image = f.read()
+        self.hide_shards(carriers, secret_image, LsbEngine.PAYLOAD_IMAGE, destinations, strategy, password,
+                         bits_per_channel, workers)
+
+    def hide_text_shards(self, carriers, text, destinations, strategy=LsbEngine.STRATEGY_PRIMES,
+                         password=None, bits_per_channel=1, workers=None):
+        """Hides text across several carriers. See hide_shards.
+
+        Args:
+            carriers (list): The carrier images, as paths, bytes or file-like objects.
+            text (str): The text to hide.
+            destinations (list): The paths the stego images are saved to, one per carrier.
+            strategy (str): The pixel position strategy, one of LsbEngine.STRATEGIES.
+            password (str): The password authenticating the shards, also used by the permuted strategy.
+            bits_per_channel (int): The number of LSBs used per color channel, 1 to 4.
+            workers (int): The number of worker processes, the number of CPUs if None.
+
+        """
+        self.hide_shards(carriers, text.encode('utf-8'), LsbEngine.PAYLOAD_TEXT, destinations, strategy, password,
+                         bits_per_channel, workers)
+
+    def reveal_shards(self, images, strategy=LsbEngine.STRATEGY_PRIMES, password=None, workers=None):
+        """Reveals a payload hidden across several carriers, given in any order, in parallel worker processes.
+
+        Args:
+            images (list): The stego images, as paths, bytes or file-like objects.
+            strategy (str): The pixel position strategy the shards were hidden with.
+            password (str): The password the shards were authenticated with, also used by the permuted strategy.
+            workers (int): The number of worker processes, the number of CPUs if None.
+
+        Returns:
+            tuple: LsbEngine.PAYLOAD_IMAGE and the image bytes, or LsbEngine.PAYLOAD_TEXT and
+                the text.
+
+        Raises:
+            PIL.UnidentifiedImageError: If an image could not be identified.
+            IndexError: If no payload could be detected in an image.
+            ValueError: If an image holds no shard, the shards do not form a whole payload or no
+                password is given.
+
+        """
+        if not password:
+            raise ValueError('A password is required to authenticate the parts of a payload.')
+        images = [image if isinstance(image, (str, bytes)) else image.read() for image in images]
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(Metrics.collect, ImageOperations.reveal_shard, image, strategy, password)
+                       for image in images]
+            revealed = [Metrics.merge(future) for future in futures]
+        return self.decode_payload(*self.join_shards(revealed, password))
+
+    @staticmethod
+    def get_worker_operations():
+        """Returns the ImageOperations of the current worker process."""
+        if ImageOperations.worker_operations is None:
+            ImageOperations.worker_operations = ImageOperations()
+        return ImageOperations.worker_operations
+
+    @staticmethod
+    def hide_shard(carrier, shard, destination, strategy, password, bits_per_channel):
+        """Hides one shard and saves the stego image. Runs in a worker process."""
+        ImageOperations.get_worker_operations().hide(carrier, shard, LsbEngine.PAYLOAD_SHARD, destination,
+                                                     strategy, password, bits_per_channel)
+
+    @staticmethod
+    def reveal_shard(image, strategy, password):
+        """Reveals one shard. Runs in a worker process.
+
+        Returns:
+            bytes: The shard.
+
+        Raises:
+            ValueError: If the image holds a whole payload instead of a shard.
+
+        """
+        payload_type, payload = ImageOperations.get_worker_operations().lsb_engine.reveal_payload(
+            image, strategy, password)
+        if payload_type != LsbEngine.PAYLOAD_SHARD:
+            raise ValueError('An image holds a whole payload instead of a part of one.')
+        return payload
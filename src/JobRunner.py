@@ -0,0 +1,233 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+from contextlib import contextmanager
+from multiprocessing import get_context
+from os import cpu_count
+from threading import Event
+from time import perf_counter
+from tkinter import DISABLED, NORMAL
+from Metrics import Metrics
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been canceled."""
+
+
+class Job:
+    """A unit of CPU-heavy work running in a worker pool."""
+
+    def __init__(self, name, widgets, on_done, on_error):
+        """Initialize the Job.
+
+        Args:
+            name (str): The name the duration of the job is recorded under.
+            widgets (tuple): The widgets disabled while the job runs.
+            on_done (callable): Called with the result in the Tk thread.
+            on_error (callable): Called with the exception in the Tk thread.
+        """
+        self.name = name
+        self.started = perf_counter()
+        self.widgets = widgets
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cleanups = []
+        self.future = None
+        self.progress = None
+        self.cancel_event = Event()
+
+    def update(self, done, total):
+        """Records the progress of the job. Called from the worker.
+
+        Args:
+            done (int): The amount of work done.
+            total (int): The total amount of work.
+
+        Raises:
+            JobCancelled: If the job has been canceled.
+        """
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.progress = done / total if total else None
+
+    def cancel(self):
+        """Cancels the job. A job that already started stops at its next progress update."""
+        self.cancel_event.set()
+        if self.future:
+            self.future.cancel()
+
+    @property
+    def cancelled(self):
+        """bool: Whether the job has been canceled."""
+        return self.cancel_event.is_set()
+
+
+class JobRunner:
+    """Runs CPU-heavy work in worker pools and delivers results back to the Tk main loop.
+
+    Jobs are submitted to a thread pool, or to a process pool for picklable functions that
+    hold the GIL. Completion is detected by polling with after(), so callbacks always run in
+    the Tk thread. Widgets passed to using() are disabled while the jobs submitted inside the
+    with block run. Without a Tk root, jobs run synchronously in the caller.
+    """
+
+    POLL_INTERVAL = 50 # Milliseconds
+
+    def __init__(self, root=None, max_workers=None, on_progress=None):
+        """Initialize the JobRunner.
+
+        Args:
+            root (tkinter.Tk): The Tk root used for polling, or None to run jobs synchronously.
+            max_workers (int): The maximum number of workers per pool.
+            on_progress (callable): Called in the Tk thread with the running jobs whenever
+                one is submitted, makes progress or finishes.
+        """
+        self.root = root
+        self.max_workers = max_workers
+        self.on_progress = on_progress
+        self.thread_pool = None
+        self.process_pool = None
+        self.jobs = []
+        self.widgets = ()
+        self.pending_jobs = None
+
+    @contextmanager
+    def using(self, *widgets, cleanup=None):
+        """Disables widgets for the jobs submitted inside the with block.
+
+        Args:
+            *widgets: The widgets to disable while the jobs run.
+            cleanup (callable): Called once the jobs have finished, or when the block exits if
+                no job was submitted.
+        """
+        previous_widgets, previous_jobs = self.widgets, self.pending_jobs
+        self.widgets, self.pending_jobs = widgets, []
+        try:
+            yield self
+        finally:
+            jobs = self.pending_jobs
+            self.widgets, self.pending_jobs = previous_widgets, previous_jobs
+            if cleanup:
+                running = [job for job in jobs if job in self.jobs]
+                if running:
+                    running[-1].cleanups.append(cleanup)
+                else:
+                    cleanup()
+
+    def submit(self, func, *args, on_done=None, on_error=None, processes=False, report_progress=False):
+        """Runs a function in a worker pool.
+
+        Args:
+            func (callable): The function to run.
+            *args: The arguments of the function.
+            on_done (callable): Called with the result in the Tk thread.
+            on_error (callable): Called with the exception in the Tk thread. Exceptions are
+                raised in the Tk thread if not given.
+            processes (bool): Whether to run the function in the process pool.
+            report_progress (bool): Whether to pass Job.update to the function as the
+                progress keyword argument. Not supported in the process pool.
+
+        Returns:
+            Job: The submitted job.
+        """
+        name = getattr(getattr(func, 'func', func), '__qualname__', type(func).__name__) # Unwraps partials
+        job = Job(f'job.{name}', self.widgets, on_done, on_error)
+        kwargs = {'progress': job.update} if report_progress and not processes else {}
+        if self.pending_jobs is not None:
+            self.pending_jobs.append(job)
+        if self.root is None:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self.finish(job, None, e)
+            else:
+                self.finish(job, result, None)
+            return job
+        for widget in job.widgets:
+            widget.config(state=DISABLED)
+        job.future = self.get_pool(processes).submit(func, *args, **kwargs)
+        self.jobs.append(job)
+        if len(self.jobs) == 1:
+            self.root.after(self.POLL_INTERVAL, self.poll)
+        self.report_progress()
+        return job
+
+    @property
+    def process_workers(self):
+        """int: The number of workers in the process pool."""
+        return self.max_workers or cpu_count()
+
+    def get_pool(self, processes):
+        """Returns the thread or process pool, creating it on first use.
+
+        The process pool is long-lived and can also be handed to jobs that spread their own
+        work over processes. Its workers are spawned rather than forked from the Tk process,
+        whose threads and Tk state must not be copied.
+
+        Args:
+            processes (bool): Whether to return the process pool.
+
+        Returns:
+            concurrent.futures.Executor: The pool.
+        """
+        if processes:
+            if self.process_pool is None:
+                self.process_pool = ProcessPoolExecutor(self.process_workers, mp_context=get_context('spawn'))
+            return self.process_pool
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPoolExecutor(self.max_workers)
+        return self.thread_pool
+
+    def poll(self):
+        """Delivers the results of finished jobs and schedules the next poll."""
+        for job in [job for job in self.jobs if job.future.done()]:
+            self.jobs.remove(job)
+            try:
+                result, error = job.future.result(), None
+            except CancelledError as e:
+                result, error = None, JobCancelled()
+            except Exception as e:
+                result, error = None, e
+            self.finish(job, result, error)
+        self.report_progress()
+        if self.jobs:
+            self.root.after(self.POLL_INTERVAL, self.poll)
+
+    def finish(self, job, result, error):
+        """Records the duration of a finished job, re-enables its widgets and runs its callbacks.
+
+        Args:
+            job (Job): The finished job.
+            result: The return value of the job.
+            error (Exception): The exception raised by the job, or None.
+        """
+        Metrics.record(job.name, perf_counter() - job.started, ok=error is None)
+        busy_widgets = {widget for running_job in self.jobs for widget in running_job.widgets}
+        for widget in job.widgets:
+            if widget not in busy_widgets:
+                widget.config(state=NORMAL)
+        try:
+            if error is None:
+                if job.on_done:
+                    job.on_done(result)
+            elif job.on_error:
+                job.on_error(error)
+            elif not isinstance(error, JobCancelled):
+                raise error
+        finally:
+            for cleanup in job.cleanups:
+                cleanup()
+
+    def report_progress(self):
+        """Passes the running jobs to the progress callback."""
+        if self.on_progress:
+            self.on_progress(self.jobs)
+
+    def cancel_all(self):
+        """Cancels every running job."""
+        for job in self.jobs:
+            job.cancel()
+
+    def shutdown(self):
+        """Cancels the running jobs and shuts the pools down."""
+        self.cancel_all()
+        for pool in (self.thread_pool, self.process_pool):
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from hashlib import sha256
+from hmac import new as hmac_new
+from secrets import token_bytes
+from threading import Lock
+from time import monotonic
+from argon2.low_level import hash_secret_raw, Type
+from Metrics import Metrics
+
+class KeyDeriver:
+    """Derives encryption keys from passwords with raw Argon2id and caches them.
+
+    Derived keys are kept in a cache shared by every KeyDeriver of the process, keyed by the
+    salt, the Argon2 parameters and a fingerprint of the password. The fingerprint is an HMAC
+    under a random per-process secret, so the cache never holds the password or a plain hash
+    of it. The cache holds at most MAX_ENTRIES keys, each for at most TTL seconds, and is
+    wiped with clear_cache() when the user signs out.
+    """
+
+    MAX_ENTRIES = 32
+    TTL = 300 # Seconds
+    fingerprint_secret = token_bytes(32)
+    cache = OrderedDict()
+    cache_lock = Lock()
+
+    def __init__(self, time_cost=1, memory_cost=47104, parallelism=1, hash_len=32):
+        """Initialize the KeyDeriver.
+
+        Args:
+            time_cost (int): The default Argon2 time cost.
+            memory_cost (int): The default Argon2 memory cost in KiB.
+            parallelism (int): The default Argon2 parallelism.
+            hash_len (int): The length of the derived keys in bytes.
+
+        """
+        self.time_cost = time_cost
+        self.memory_cost = memory_cost
+        self.parallelism = parallelism
+        self.hash_len = hash_len
+
+    @property
+    def params(self):
+        """tuple: The default time cost, memory cost and parallelism."""
+        return self.time_cost, self.memory_cost, self.parallelism
+
+    def derive_key(self, password, salt, time_cost=None, memory_cost=None, parallelism=None):
+        """Derives a key from a password and salt, reusing a cached key when possible.
+
+        Args:
+            password (bytes): The password to derive the key from.
+            salt (bytes): The salt used in key derivation.
+            time_cost (int): The Argon2 time cost, defaults to the one of the deriver.
+            memory_cost (int): The Argon2 memory cost in KiB, defaults to the one of the deriver.
+            parallelism (int): The Argon2 parallelism, defaults to the one of the deriver.
+
+        Returns:
+            bytes: The derived key.
+
+        """
+        params = (time_cost or self.time_cost, memory_cost or self.memory_cost,
+                  parallelism or self.parallelism)
+        cache_key = (bytes(salt), params, self.hash_len, self.fingerprint(password))
+        now = monotonic()
+        with self.cache_lock:
+            self.evict_expired(now)
+            entry = self.cache.get(cache_key)
+            if entry:
+                self.cache.move_to_end(cache_key)
+                return bytes(entry[0])
+        with Metrics.measure('kdf.argon2'):
+            key = hash_secret_raw(password, salt, time_cost=params[0], memory_cost=params[1],
+                                  parallelism=params[2], hash_len=self.hash_len, type=Type.ID)
+        with self.cache_lock:
+            self.cache[cache_key] = (bytearray(key), now + self.TTL)
+            self.cache.move_to_end(cache_key)
+            while len(self.cache) > self.MAX_ENTRIES:
+                self.wipe(self.cache.popitem(last=False)[1])
+        return key
+
+    def fingerprint(self, password):
+        """Computes the cache fingerprint of a password.
+
+        Args:
+            password (bytes): The password.
+
+        Returns:
+            bytes: The fingerprint.
+
+        """
+        return hmac_new(self.fingerprint_secret, password, sha256).digest()
+
+    @classmethod
+    def evict_expired(cls, now):
+        """Removes the cached keys whose TTL has passed. The cache lock must be held.
+
+        Args:
+            now (float): The current monotonic time.
+
+        """
+        expired = [cache_key for cache_key, (key, expires) in cls.cache.items() if expires <= now]
+        for cache_key in expired:
+            cls.wipe(cls.cache.pop(cache_key))
+
+    @classmethod
+    def clear_cache(cls):
+        """Wipes every cached key."""
+        with cls.cache_lock:
+            for entry in cls.cache.values():
+                cls.wipe(entry)
+            cls.cache.clear()
+
+    @staticmethod
+    def wipe(entry):
+        """Overwrites the key of a cache entry with zeros.
+
+        Args:
+            entry (tuple): The key and its expiry time.
+
+        """
+        key = entry[0]
+        key[:] = bytes(len(key))
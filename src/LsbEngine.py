@@ -0,0 +1,507 @@
+from io import BytesIO
+from math import log
+from hashlib import sha256
+from struct import Struct, error as StructError
+import numpy as np
+from PIL import Image
+from Metrics import Metrics
+
+class LsbEngine:
+    """Hides and reveals payloads in the least significant bits of an image.
+
+    The whole pixel array is processed at once with NumPy bit operations. Bits are stored
+    MSB first in the red, green and blue LSBs of the pixels chosen by a position strategy:
+    prime indices (as stegano's eratosthenes generator), every pixel in order, or every pixel
+    in an order shuffled by a password.
+
+    Payloads start with a binary header (magic, version, payload type, bits per channel and
+    length) stored in one bit per channel, followed by the raw bytes stored in 1 to 4 bits
+    per channel. The legacy format written by stegano's lsb module, where the message
+    is prefixed with its length in ASCII and a colon, can still be hidden and revealed.
+    """
+
+    MAGIC = b'CCSG'
+    VERSION = 2
+    HEADER = Struct('>4sBBBI') # Magic, version, payload type, bits per channel, payload length
+    HEADER_V1 = Struct('>4sBBI') # Magic, version, payload type, payload length
+    MAX_BITS_PER_CHANNEL = 4
+    PAYLOAD_LEGACY = 0
+    PAYLOAD_IMAGE = 1
+    PAYLOAD_TEXT = 2
+    PAYLOAD_SHARD = 3 # A part of a payload spread over several carriers, see ImageOperations.hide_shards
+    MAX_PREFIX_LENGTH = 21 # Up to 20 length digits and the ':' separator
+    STRATEGY_PRIMES = 'primes'
+    STRATEGY_SEQUENTIAL = 'sequential'
+    STRATEGY_PERMUTED = 'permuted'
+    STRATEGIES = (STRATEGY_PRIMES, STRATEGY_SEQUENTIAL, STRATEGY_PERMUTED)
+
+    def __init__(self):
+        """Initialize the LsbEngine."""
+        self.primes = np.empty(0, dtype=np.int64)
+        self.permutation = (None, None) # Key and permutation, replaced together for worker threads
+
+    def get_primes(self, count):
+        """Returns the first primes, in the order yielded by generators.eratosthenes().
+
+        Args:
+            count (int): The number of primes to return.
+
+        Returns:
+            numpy.ndarray: The first count prime numbers.
+
+        """
+        if count > self.primes.size:
+            # Upper bound for the n-th prime (Rosser's theorem)
+            self.sieve(15 if count < 6 else int(count * (log(count) + log(log(count)))) + 1)
+        return self.primes[:count]
+
+    def count_primes_below(self, limit):
+        """Counts the primes smaller than limit.
+
+        Args:
+            limit (int): The exclusive upper bound.
+
+        Returns:
+            int: The number of primes below limit.
+
+        """
+        if self.primes.size == 0 or self.primes[-1] < limit:
+            self.sieve(limit)
+        return int(np.searchsorted(self.primes, limit))
+
+    def sieve(self, limit):
+        """Replaces the cached primes with every prime up to limit using the sieve of Eratosthenes.
+
+        Args:
+            limit (int): The inclusive upper bound.
+
+        """
+        sieve = np.ones(limit + 1, dtype=bool)
+        sieve[:2] = False
+        for i in range(2, int(limit ** 0.5) + 1):
+            if sieve[i]:
+                sieve[i * i::i] = False
+        self.primes = np.flatnonzero(sieve)
+
+    def get_permutation(self, pixel_count, password):
+        """Returns every pixel index in an order seeded by a password.
+
+        The last permutation is kept, so hiding and revealing in the same image size with the
+        same password only shuffle once.
+
+        Args:
+            pixel_count (int): The number of pixels in the image.
+            password (str): The password that seeds the order.
+
+        Returns:
+            numpy.ndarray: A permutation of the pixel indices.
+
+        Raises:
+            ValueError: If no password is given.
+
+        """
+        if not password:
+            raise ValueError('The permuted strategy requires a password.')
+        digest = sha256(password.encode('utf-8')).digest()
+        key = (digest, pixel_count)
+        cached_key, permutation = self.permutation
+        if key != cached_key:
+            permutation = np.random.default_rng(int.from_bytes(digest, 'big')).permutation(pixel_count)
+            self.permutation = (key, permutation)
+        return permutation
+
+    def get_positions(self, count, pixel_count, strategy=STRATEGY_PRIMES, password=None):
+        """Returns up to count pixel indices that lie inside the image.
+
+        Args:
+            count (int): The number of positions wanted.
+            pixel_count (int): The number of pixels in the image.
+            strategy (str): One of STRATEGIES.
+            password (str): The password for the permuted strategy.
+
+        Returns:
+            numpy.ndarray: The pixel indices, fewer than count if the image is too small.
+
+        Raises:
+            ValueError: If the strategy is unknown.
+
+        """
+        if strategy == self.STRATEGY_SEQUENTIAL:
+            return np.arange(min(count, pixel_count))
+        if strategy == self.STRATEGY_PERMUTED:
+            return self.get_permutation(pixel_count, password)[:count]
+        if strategy == self.STRATEGY_PRIMES:
+            positions = self.get_primes(count)
+            return positions[positions < pixel_count]
+        raise ValueError(f'Unknown position strategy: {strategy}')
+
+    def open_image(self, image):
+        """Opens an image and converts it to a mode that can carry LSB data.
+
+        Args:
+            image (str, bytes or file-like): The path to the image, its data or a file object.
+
+        Returns:
+            PIL.Image.Image: The image in RGB or RGBA mode.
+
+        """
+        if isinstance(image, (bytes, bytearray)):
+            image = BytesIO(image)
+        opened_image = Image.open(image)
+        if opened_image.mode not in ('RGB', 'RGBA'):
+            return opened_image.convert('RGB')
+        return opened_image
+
+    def capacity(self, image, strategy=STRATEGY_PRIMES, bits_per_channel=1):
+        """Computes how many payload bytes an image can carry with hide_payload.
+
+        Only the image header is read; the pixel data is not decoded.
+
+        Args:
+            image (str, bytes or file-like): The carrier image.
+            strategy (str): One of STRATEGIES.
+            bits_per_channel (int): The number of LSBs used per channel for the payload.
+
+        Returns:
+            int: The maximum payload length in bytes.
+
+        Raises:
+            ValueError: If the strategy is unknown.
+
+        """
+        if isinstance(image, (bytes, bytearray)):
+            image = BytesIO(image)
+        with Image.open(image) as opened_image:
+            width, height = opened_image.size
+        if hasattr(image, 'seek'):
+            image.seek(0)
+        pixel_count = width * height
+        if strategy == self.STRATEGY_PRIMES:
+            pixel_count = self.count_primes_below(pixel_count)
+        elif strategy not in self.STRATEGIES:
+            raise ValueError(f'Unknown position strategy: {strategy}')
+        payload_slots = pixel_count * 3 - self.HEADER.size * 8 # Every mode is converted to RGB(A)
+        return max(0, payload_slots * bits_per_channel // 8)
+
+    def hide_payload(self, image, data, payload_type, strategy=STRATEGY_PRIMES, password=None,
+                     bits_per_channel=1):
+        """Hides a payload in an image using the binary header format.
+
+        Args:
+            image (str, bytes or file-like): The carrier image.
+            data (bytes): The payload to hide.
+            payload_type (int): PAYLOAD_IMAGE, PAYLOAD_TEXT or PAYLOAD_SHARD.
+            strategy (str): One of STRATEGIES.
+            password (str): The password for the permuted strategy.
+            bits_per_channel (int): The number of LSBs used per channel for the payload, 1 to 4.
+
+        Returns:
+            PIL.Image.Image: A copy of the carrier with the payload embedded.
+
+        Raises:
+            ValueError: If the payload is too long for the carrier or the bit depth is invalid.
+
+        """
+        if not 1 <= bits_per_channel <= self.MAX_BITS_PER_CHANNEL:
+            raise ValueError(f'Bits per channel must be between 1 and {self.MAX_BITS_PER_CHANNEL}.')
+        if len(data) > self.capacity(image, strategy, bits_per_channel):
+            raise ValueError('The message you want to hide is too long for the carrier.')
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, payload_type, bits_per_channel, len(data))
+        return self.embed(image, header, data, strategy, password, bits_per_channel)
+
+    @Metrics.timed('stego.reveal_payload', size=lambda result: len(result[1]))
+    def reveal_payload(self, image, strategy=STRATEGY_PRIMES, password=None):
+        """Reveals a payload hidden in an image.
+
+        Reading stops at the payload length recorded in the header. Images without the
+        header are decoded as legacy stegano messages, which always use prime positions.
+
+        Args:
+            image (str, bytes or file-like): The stego image.
+            strategy (str): The strategy the payload was hidden with.
+            password (str): The password for the permuted strategy.
+
+        Returns:
+            tuple: The payload type and the payload. Legacy payloads are returned as str,
+                others as bytes.
+
+        Raises:
+            IndexError: If no payload could be detected.
+
+        """
+        flat_pixels = self.get_flat_pixels(image)
+        pixel_count = flat_pixels.shape[0]
+        header_pixels = -(-self.HEADER.size * 8 // 3)
+        header = self.read_bytes(flat_pixels, self.get_positions(header_pixels, pixel_count, strategy, password))
+        parsed_header = self.parse_header(header)
+        if parsed_header is None:
+            return self.PAYLOAD_LEGACY, self.reveal_legacy(flat_pixels)
+        payload_type, bits_per_channel, length, header_size = parsed_header
+        header_slots = header_size * 8
+        needed_pixels = self.get_needed_pixels(header_size, length, bits_per_channel)
+        positions = self.get_positions(needed_pixels, pixel_count, strategy, password)
+        if positions.size < needed_pixels:
+            raise IndexError('Impossible to detect message.')
+        return payload_type, self.read_bytes(flat_pixels, positions, header_slots, bits_per_channel)[:length]
+
+    def parse_header(self, header):
+        """Parses the binary header read from the first embedded bytes.
+
+        Args:
+            header (bytes): At least HEADER.size embedded bytes.
+
+        Returns:
+            tuple: The payload type, bits per channel, payload length and header size, or
+                None if the bytes do not start with the magic.
+
+        Raises:
+            IndexError: If the header is of an unsupported version or payload type.
+
+        """
+        try:
+            magic, version = header[:4], header[4]
+            if version == 1:
+                magic, version, payload_type, length = self.HEADER_V1.unpack(header[:self.HEADER_V1.size])
+                header_size, bits_per_channel = self.HEADER_V1.size, 1
+            else:
+                magic, version, payload_type, bits_per_channel, length = self.HEADER.unpack(header[:self.HEADER.size])
+                header_size = self.HEADER.size
+        except (StructError, IndexError):
+            return None
+        if magic != self.MAGIC:
+            return None
+        if version > self.VERSION or payload_type not in (self.PAYLOAD_IMAGE, self.PAYLOAD_TEXT, self.PAYLOAD_SHARD) \
+                or not 1 <= bits_per_channel <= self.MAX_BITS_PER_CHANNEL:
+            raise IndexError('Unsupported payload.')
+        return payload_type, bits_per_channel, length, header_size
+
+    def get_needed_pixels(self, header_size, length, bits_per_channel=1):
+        """Computes the number of pixels a header and its payload occupy.
+
+        Args:
+            header_size (int): The header size in bytes, stored one bit per channel.
+            length (int): The payload length in bytes.
+            bits_per_channel (int): The number of LSBs used per channel for the payload.
+
+        Returns:
+            int: The number of pixels.
+
+        """
+        return -(-(header_size * 8 + -(-length * 8 // bits_per_channel)) // 3)
+
+    def parse_legacy_prefix(self, prefix):
+        """Parses the ASCII length prefix of a legacy stegano message.
+
+        Args:
+            prefix (bytes): The first MAX_PREFIX_LENGTH embedded bytes.
+
+        Returns:
+            tuple: The index of the ':' separator and the message length, or None if there is
+                no valid prefix.
+
+        """
+        separator = prefix.find(b':')
+        if separator < 1 or not prefix[:separator].isdigit():
+            return None
+        return separator, int(prefix[:separator])
+
+    @Metrics.timed('stego.probe')
+    def probe(self, image, strategy=STRATEGY_PRIMES, password=None):
+        """Detects a payload from its header alone, decoding as few pixel rows as possible.
+
+        Only the rows holding the header positions are decoded from non-interlaced PNG images,
+        which is a few rows for the primes and sequential strategies. Other images and the
+        permuted strategy need the full decode. The legacy length prefix is checked too.
+
+        Args:
+            image (str, bytes or file-like): The image.
+            strategy (str): The strategy the payload would have been hidden with.
+            password (str): The password for the permuted strategy.
+
+        Returns:
+            tuple: The payload type, payload length and bits per channel, or None if no
+                payload was detected.
+
+        Raises:
+            PIL.UnidentifiedImageError: If the image could not be identified.
+
+        """
+        if isinstance(image, (bytes, bytearray)):
+            image = BytesIO(image)
+        header_pixels = -(-self.HEADER.size * 8 // 3)
+        prefix_pixels = -(-self.MAX_PREFIX_LENGTH * 8 // 3)
+        with Image.open(image) as opened_image:
+            width, height = opened_image.size
+            pixel_count = width * height
+            header_positions = self.get_positions(header_pixels, pixel_count, strategy, password)
+            prefix_positions = self.get_positions(prefix_pixels, pixel_count)
+            last_position = max(header_positions.max(initial=0), prefix_positions.max(initial=0))
+            flat_pixels = self.decode_rows(opened_image, int(last_position) // width + 1)
+        try:
+            parsed_header = self.parse_header(self.read_bytes(flat_pixels, header_positions))
+        except IndexError:
+            return None
+        if parsed_header is not None:
+            payload_type, bits_per_channel, length, header_size = parsed_header
+            needed_pixels = self.get_needed_pixels(header_size, length, bits_per_channel)
+            if needed_pixels > self.get_positions(needed_pixels, pixel_count, strategy, password).size:
+                return None
+            return payload_type, length, bits_per_channel
+        parsed_prefix = self.parse_legacy_prefix(self.read_bytes(flat_pixels, prefix_positions))
+        if parsed_prefix is None:
+            return None
+        separator, length = parsed_prefix
+        needed_pixels = -(-(separator + 1 + length) * 8 // 3)
+        if needed_pixels > self.get_positions(needed_pixels, pixel_count).size:
+            return None
+        return self.PAYLOAD_LEGACY, length, 1
+
+    def decode_rows(self, opened_image, rows):
+        """Decodes the first rows of an opened image.
+
+        Non-interlaced PNG images are decoded row by row, so their decoding is stopped after
+        the requested rows. Other images are decoded whole.
+
+        Args:
+            opened_image (PIL.Image.Image): The image, opened but not loaded.
+            rows (int): The number of rows needed.
+
+        Returns:
+            numpy.ndarray: The pixels of the first rows as a (pixel count, channels) array, in
+                RGB or RGBA.
+
+        """
+        width, height = opened_image.size
+        rows = min(rows, height)
+        tiles = opened_image.tile
+        if opened_image.format == 'PNG' and not opened_image.info.get('interlace') and len(tiles) == 1 \
+                and tuple(tiles[0][1]) == (0, 0, width, height):
+            opened_image.tile = [(tiles[0][0], (0, 0, width, rows), *tiles[0][2:])]
+        rows_image = opened_image.crop((0, 0, width, rows))
+        if rows_image.mode not in ('RGB', 'RGBA'):
+            rows_image = rows_image.convert('RGB')
+        pixels = np.asarray(rows_image)
+        return pixels.reshape(-1, pixels.shape[-1])
+
+    @Metrics.timed('stego.embed')
+    def embed(self, image, prefix, body=b'', strategy=STRATEGY_PRIMES, password=None, bits_per_channel=1):
+        """Writes the payload bits into the RGB LSBs of the pixels chosen by the strategy.
+
+        The chosen pixels are split into channel slots (red, green and blue of each pixel in
+        turn). The prefix takes one bit per slot and the body bits_per_channel bits per slot
+        right after it. Every slot is written with a single masked assignment.
+
+        Args:
+            image (str, bytes or file-like): The carrier image.
+            prefix (bytes): The bytes to embed one bit per channel.
+            body (bytes): The bytes to embed bits_per_channel bits per channel.
+            strategy (str): One of STRATEGIES.
+            password (str): The password for the permuted strategy.
+            bits_per_channel (int): The number of LSBs used per channel for the body.
+
+        Returns:
+            PIL.Image.Image: A copy of the carrier with the payload embedded.
+
+        Raises:
+            ValueError: If the payload is too long for the carrier.
+
+        """
+        prefix_bits = np.unpackbits(np.frombuffer(prefix, dtype=np.uint8))
+        body_bits = np.unpackbits(np.frombuffer(body, dtype=np.uint8))
+        body_bits = np.pad(body_bits, (0, -body_bits.size % bits_per_channel))
+        shifts = np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+        body_values = (body_bits.reshape(-1, bits_per_channel) << shifts).sum(axis=1, dtype=np.uint8)
+        values = np.concatenate((prefix_bits, body_values))
+        masks = np.concatenate((np.ones(prefix_bits.size, dtype=np.uint8),
+                                np.full(body_values.size, (1 << bits_per_channel) - 1, dtype=np.uint8)))
+        pixel_count = -(-values.size // 3)
+        values = np.pad(values, (0, pixel_count * 3 - values.size)).reshape(-1, 3)
+        masks = np.pad(masks, (0, pixel_count * 3 - masks.size)).reshape(-1, 3) # Padding slots are left as is
+        with Metrics.measure('stego.decode_pixels') as measurement:
+            pixels = np.array(self.open_image(image))
+            measurement['size'] = pixels.nbytes
+        flat_pixels = pixels.reshape(-1, pixels.shape[-1])
+        positions = self.get_positions(pixel_count, flat_pixels.shape[0], strategy, password)
+        if positions.size < pixel_count:
+            raise ValueError('The message you want to hide is too long for the carrier.')
+        flat_pixels[positions, :3] = (flat_pixels[positions, :3] & ~masks) | values
+        return Image.fromarray(pixels)
+
+    def hide(self, image, message):
+        """Hides a message in an image using the legacy stegano format.
+
+        Args:
+            image (str, bytes or file-like): The carrier image.
+            message (str): The message to hide.
+
+        Returns:
+            PIL.Image.Image: A copy of the carrier with the message embedded.
+
+        Raises:
+            ValueError: If the message is too long for the carrier.
+
+        """
+        message_bytes = message.encode('utf-8')
+        return self.embed(image, f'{len(message_bytes)}:'.encode('ascii') + message_bytes)
+
+    def reveal_legacy(self, flat_pixels):
+        """Reveals a message hidden in the legacy stegano format.
+
+        Args:
+            flat_pixels (numpy.ndarray): The pixels as a (pixel count, channels) array.
+
+        Returns:
+            str: The hidden message.
+
+        Raises:
+            IndexError: If no message could be detected.
+
+        """
+        prefix_pixels = -(-self.MAX_PREFIX_LENGTH * 8 // 3)
+        prefix = self.read_bytes(flat_pixels, self.get_positions(prefix_pixels, flat_pixels.shape[0]))
+        parsed_prefix = self.parse_legacy_prefix(prefix)
+        if parsed_prefix is None:
+            raise IndexError('Impossible to detect message.')
+        separator, length = parsed_prefix
+        total_bytes = separator + 1 + length
+        needed_pixels = -(-total_bytes * 8 // 3)
+        positions = self.get_positions(needed_pixels, flat_pixels.shape[0])
+        if positions.size < needed_pixels:
+            raise IndexError('Impossible to detect message.')
+        message_bytes = self.read_bytes(flat_pixels, positions)[separator + 1:total_bytes]
+        try:
+            return message_bytes.decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise IndexError('Impossible to detect message.') from e
+
+    @Metrics.timed('stego.decode_pixels', size=lambda flat_pixels: flat_pixels.nbytes)
+    def get_flat_pixels(self, image):
+        """Loads the pixels of an image as a (pixel count, channels) array.
+
+        Args:
+            image (str, bytes or file-like): The image.
+
+        Returns:
+            numpy.ndarray: The flattened pixels.
+
+        """
+        pixels = np.asarray(self.open_image(image))
+        return pixels.reshape(-1, pixels.shape[-1])
+
+    def read_bytes(self, flat_pixels, positions, skip_slots=0, bits_per_channel=1):
+        """Gathers the RGB LSBs at the given pixel positions into bytes.
+
+        Args:
+            flat_pixels (numpy.ndarray): The pixels as a (pixel count, channels) array.
+            positions (numpy.ndarray): The pixel indices to read.
+            skip_slots (int): The number of leading channel slots to ignore.
+            bits_per_channel (int): The number of LSBs to read from each remaining slot.
+
+        Returns:
+            bytes: The gathered bits packed MSB first.
+
+        """
+        slots = flat_pixels[positions, :3].ravel()[skip_slots:]
+        shifts = np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+        bits = ((slots[:, None] >> shifts) & 1).ravel()
+        return np.packbits(bits[:bits.size - bits.size % 8]).tobytes()
@@ -0,0 +1,76 @@
+from io import BytesIO, UnsupportedOperation
+from mmap import mmap, ACCESS_READ, PAGESIZE
+try:
+    from mmap import MADV_DONTNEED
+except ImportError: # Windows has no madvise()
+    MADV_DONTNEED = None
+
+class MappedBuffer:
+    """Exposes the contents of a binary file object as a memoryview without copying them.
+
+    Files on disk are memory-mapped and in-memory files expose their buffer, so slices of the
+    view can be hashed, encrypted or written without intermediate bytes objects. Other file
+    objects, like database BLOB streams, cannot be viewed and the with block gets None; callers
+    then fall back to reading in chunks. The view starts at the current position of the file.
+
+    Mapped pages count towards the resident memory of the process until the OS reclaims them,
+    so sequential readers call discard() behind themselves to keep it bounded.
+    """
+
+    def __init__(self, stream):
+        """Initialize the MappedBuffer.
+
+        Args:
+            stream (file-like): The binary file object.
+        """
+        self.stream = stream
+        self.mapping = None
+        self.view = None
+        self.offset = 0
+        self.discarded = 0
+
+    def __enter__(self):
+        """Maps the file.
+
+        Returns:
+            memoryview: The contents from the current position, or None if the file cannot be viewed.
+        """
+        position = self.stream.tell()
+        if isinstance(self.stream, BytesIO):
+            self.view = self.stream.getbuffer()[position:]
+            return self.view
+        try:
+            self.mapping = mmap(self.stream.fileno(), 0, access=ACCESS_READ)
+        except (UnsupportedOperation, OSError, ValueError): # No file descriptor, empty or not a regular file
+            return None
+        self.view = memoryview(self.mapping)[position:]
+        self.offset = position
+        self.discarded = position // PAGESIZE * PAGESIZE
+        return self.view
+
+    def discard(self, end):
+        """Drops the mapped pages before a position of the view from memory.
+
+        The pages are read from the file again if they are accessed later. Does nothing for
+        in-memory files and where madvise() is not available.
+
+        Args:
+            end (int): The position in the view before which the contents are no longer needed.
+        """
+        if self.mapping is None or MADV_DONTNEED is None:
+            return
+        end = (self.offset + end) // PAGESIZE * PAGESIZE
+        if end > self.discarded:
+            self.mapping.madvise(MADV_DONTNEED, self.discarded, end - self.discarded)
+            self.discarded = end
+
+    def __exit__(self, *exc_info):
+        """Releases the view and unmaps the file."""
+        try:
+            if self.view is not None:
+                self.view.release()
+            if self.mapping is not None:
+                self.mapping.close()
+        except BufferError:
+            pass # Slices still referenced keep the mapping alive until they are freed
+        self.mapping = self.view = None
@@ -0,0 +1,188 @@
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count
+from time import perf_counter, time
+
+class Metrics:
+    """Records operation timings in an in-process ring buffer.
+
+    Every record is a (sequence, timestamp, operation, duration in ms, bytes, ok) tuple.
+    Recording is a perf_counter() pair and a deque append, so it is left on all the time;
+    the buffer keeps the last CAPACITY records, and records can be flushed to the metrics
+    table of the database with flush(). The buffer is shared by the whole process and safe
+    to record into from worker threads. Worker processes have buffers of their own, so work
+    that records in a process pool runs through collect(), which returns the worker's records
+    with the result, and the parent adds them to its buffer with merge(). Pools of the CLI
+    skip this, as the CLI never flushes.
+    """
+
+    CAPACITY = 10000
+    enabled = True
+    records = deque(maxlen=CAPACITY)
+    sequence = count(1)
+    flushed_sequence = 0
+
+    @classmethod
+    def record(cls, operation, duration, size=None, ok=True):
+        """Adds a record to the ring buffer.
+
+        Args:
+            operation (str): The dotted operation or stage name, like 'stego.embed'.
+            duration (float): The duration in seconds.
+            size (int): The number of bytes processed, if meaningful.
+            ok (bool): Whether the operation succeeded.
+        """
+        if cls.enabled:
+            cls.records.append((next(cls.sequence), time(), operation, duration * 1000, size, ok))
+
+    @classmethod
+    @contextmanager
+    def measure(cls, operation, size=None):
+        """Records the duration of the with block.
+
+        Args:
+            operation (str): The dotted operation or stage name.
+            size (int): The number of bytes processed, if known up front.
+
+        Yields:
+            dict: Set its 'size' key to record a byte count known only inside the block.
+        """
+        measurement = {'size': size}
+        start = perf_counter()
+        try:
+            yield measurement
+        except BaseException:
+            cls.record(operation, perf_counter() - start, measurement['size'], False)
+            raise
+        cls.record(operation, perf_counter() - start, measurement['size'])
+
+    @classmethod
+    def timed(cls, operation, size=None):
+        """Decorates a function to record the duration of every call.
+
+        Args:
+            operation (str): The dotted operation name.
+            size (callable): Called with the return value to get the number of bytes processed.
+
+        Returns:
+            callable: The decorator.
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException:
+                    cls.record(operation, perf_counter() - start, None, False)
+                    raise
+                cls.record(operation, perf_counter() - start, size(result) if size else None)
+                return result
+            return wrapper
+        return decorator
+
+    @classmethod
+    def collect(cls, func, *args):
+        """Runs a function and returns its result with the records it made. Runs in a worker process.
+
+        If the function raises, the records are attached to the exception as metrics_records.
+
+        Args:
+            func (callable): The function to run.
+            *args: The arguments of the function.
+
+        Returns:
+            tuple: The result and the records made during the call.
+        """
+        first = next(cls.sequence)
+        try:
+            result = func(*args)
+        except BaseException as e:
+            e.metrics_records = [record for record in list(cls.records) if record[0] > first]
+            raise
+        return result, [record for record in list(cls.records) if record[0] > first]
+
+    @classmethod
+    def merge(cls, future):
+        """Returns the result of a future running collect() and adds its records to the buffer.
+
+        The records are renumbered in the sequence of this process.
+
+        Args:
+            future (concurrent.futures.Future): The future of the collect() call.
+
+        Returns:
+            object: The result of the function run by collect().
+        """
+        try:
+            result, records = future.result()
+        except BaseException as e:
+            cls.append_records(getattr(e, 'metrics_records', []))
+            raise
+        cls.append_records(records)
+        return result
+
+    @classmethod
+    def append_records(cls, records):
+        """Adds records from another process to the buffer, renumbered in this process's sequence."""
+        if cls.enabled:
+            for sequence, *record in records:
+                cls.records.append((next(cls.sequence), *record))
+
+    @classmethod
+    def get_unflushed(cls):
+        """Returns the buffered records that have not been flushed yet."""
+        return [record for record in list(cls.records) if record[0] > cls.flushed_sequence]
+
+    @classmethod
+    def flush(cls, db_handler):
+        """Saves the records that have not been flushed yet to the metrics table.
+
+        Args:
+            db_handler (DbHandler): The database to save to.
+
+        Returns:
+            int: The number of saved records.
+        """
+        records = cls.get_unflushed()
+        if records:
+            db_handler.save_metrics(records)
+            cls.flushed_sequence = records[-1][0]
+        return len(records)
+
+    @staticmethod
+    def summarize(records):
+        """Computes latency percentiles per operation.
+
+        Args:
+            records (iterable): Records in the format of the ring buffer.
+
+        Returns:
+            dict: The count, p50 and p95 in ms, total bytes and error count, by operation name.
+        """
+        durations, sizes, errors = {}, {}, {}
+        for sequence, timestamp, operation, duration, size, ok in records:
+            durations.setdefault(operation, []).append(duration)
+            sizes[operation] = sizes.get(operation, 0) + (size or 0)
+            errors[operation] = errors.get(operation, 0) + (not ok)
+        summary = {}
+        for operation, values in sorted(durations.items()):
+            values.sort()
+            summary[operation] = {
+                'count': len(values),
+                'p50_ms': values[(len(values) - 1) // 2],
+                'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))],
+                'bytes': sizes[operation],
+                'errors': errors[operation],
+            }
+        return summary
+
+    @staticmethod
+    def format_summary(summary):
+        """Formats a summary from summarize() as a text table."""
+        lines = [f"{'operation':36} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'MiB':>9} {'errors':>6}"]
+        for operation, stats in summary.items():
+            lines.append(f"{operation:36} {stats['count']:7} {stats['p50_ms']:10.2f} {stats['p95_ms']:10.2f} "
+                         f"{stats['bytes'] / 2 ** 20:9.1f} {stats['errors']:6}")
+        return '\n'.join(lines)
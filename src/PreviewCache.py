@@ -0,0 +1,71 @@
+from collections import OrderedDict
+
+class PreviewCache:
+    """A least recently used cache of decoded previews, bounded by their size in bytes.
+
+    Entries are keyed by (image id, display width, display height). The cache is only used
+    from the Tk thread, so it needs no locking.
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        """Initialize the PreviewCache.
+
+        Args:
+            max_bytes (int): The maximum total size of the cached previews.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.generation = 0 # Incremented on invalidation so stale prefetches can be dropped
+
+    def get(self, image_id, size):
+        """Returns a cached preview and marks it as recently used.
+
+        Args:
+            image_id (int): The ID of the image.
+            size (tuple): The display width and height.
+
+        Returns:
+            The cached preview, or None.
+        """
+        key = (image_id, *size)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, image_id, size, preview, preview_bytes):
+        """Adds a preview, evicting the least recently used ones beyond the size limit.
+
+        Args:
+            image_id (int): The ID of the image.
+            size (tuple): The display width and height.
+            preview: The decoded preview.
+            preview_bytes (int): The memory used by the preview.
+        """
+        key = (image_id, *size)
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        if preview_bytes > self.max_bytes:
+            return
+        self.entries[key] = (preview, preview_bytes)
+        self.total_bytes += preview_bytes
+        while self.total_bytes > self.max_bytes:
+            self.total_bytes -= self.entries.popitem(last=False)[1][1]
+
+    def invalidate(self, image_id):
+        """Removes every cached preview of an image.
+
+        Args:
+            image_id (int): The ID of the image.
+        """
+        for key in [key for key in self.entries if key[0] == image_id]:
+            self.total_bytes -= self.entries.pop(key)[1]
+        self.generation += 1
+
+    def clear(self):
+        """Removes every cached preview."""
+        self.entries.clear()
+        self.total_bytes = 0
+        self.generation += 1
@@ -0,0 +1,144 @@
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os.path import abspath
+from urllib.request import pathname2url
+from LsbEngine import LsbEngine
+from DbHandler import DbHandler
+
+class StegoScanner:
+    """Finds the images that carry hidden payloads.
+
+    Only the payload header of each image is checked, with LsbEngine.probe, which decodes the
+    first pixel rows of PNG images instead of the whole image. Images are probed in a process
+    pool, handed to the workers in batches to keep the overhead per image low.
+
+    Every image gets a report with the detected payload ('image', 'text', 'legacy text' or
+    'shard', or None), its size in bytes, the bits per channel and the error message if it
+    could not be probed.
+    """
+
+    PAYLOAD_NAMES = {
+        LsbEngine.PAYLOAD_IMAGE: 'image',
+        LsbEngine.PAYLOAD_TEXT: 'text',
+        LsbEngine.PAYLOAD_LEGACY: 'legacy text',
+        LsbEngine.PAYLOAD_SHARD: 'shard',
+    }
+    BATCH_SIZE = 32
+    engine = None # LsbEngine of the worker process, created on first use
+
+    def __init__(self, strategy=LsbEngine.STRATEGY_PRIMES, password=None, max_workers=None):
+        """Initialize the StegoScanner.
+
+        Args:
+            strategy (str): The pixel position strategy payloads are looked for with.
+            password (str): The password for the permuted strategy.
+            max_workers (int): The number of worker processes, the number of CPUs if None.
+        """
+        self.strategy = strategy
+        self.password = password
+        self.max_workers = max_workers
+
+    def scan_files(self, paths, progress=None):
+        """Probes image files.
+
+        Args:
+            paths (list): The paths of the images.
+            progress (callable): Called as progress(done, total) in images.
+
+        Returns:
+            list: The reports, in the order of paths, with the path as 'source'.
+        """
+        reports = self.run(self.probe_file, paths, progress)
+        return [dict(report, source=path) for path, report in zip(paths, reports)]
+
+    def scan_database(self, db_handler, user_id=None, progress=None):
+        """Probes the images stored in the database. Contents shared by several images are probed once.
+
+        Args:
+            db_handler (DbHandler): The database.
+            user_id (int): Only scan the images of this user, if given.
+            progress (callable): Called as progress(done, total) in distinct contents.
+
+        Returns:
+            list: The reports, with the image name as 'source' and its 'user_id'.
+        """
+        rows = db_handler.get_image_blobs(user_id)
+        blob_ids = list(dict.fromkeys(row[0] for row in rows))
+        reports = dict(zip(blob_ids, self.run(partial(self.probe_blob, db_handler.db_path), blob_ids, progress)))
+        return [dict(reports[blob_id], source=name, user_id=image_user_id) for blob_id, image_user_id, name in rows]
+
+    def run(self, probe, targets, progress):
+        """Runs a probe function over targets in the process pool.
+
+        Args:
+            probe (callable): probe_file, or probe_blob bound to a database path.
+            targets (list): The arguments passed to probe one at a time.
+            progress (callable): Called as progress(done, total).
+
+        Returns:
+            list: The reports, in the order of targets.
+        """
+        reports = []
+        if not targets:
+            return reports
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            for report in executor.map(partial(probe, strategy=self.strategy, password=self.password),
+                                       targets, chunksize=self.BATCH_SIZE):
+                reports.append(report)
+                if progress:
+                    progress(len(reports), len(targets))
+        return reports
+
+    @classmethod
+    def probe(cls, image, strategy, password):
+        """Probes one image. Runs in a worker process.
+
+        Args:
+            image (str or file-like): The image.
+            strategy (str): The pixel position strategy.
+            password (str): The password for the permuted strategy.
+
+        Returns:
+            dict: The report, without the source.
+        """
+        if cls.engine is None:
+            cls.engine = LsbEngine()
+        try:
+            detected = cls.engine.probe(image, strategy, password)
+        except Exception as e: # Broken or unsupported images are reported without stopping the scan
+            return {'payload': None, 'size': None, 'bits_per_channel': None, 'error': f'{type(e).__name__}: {e}'}
+        if detected is None:
+            return {'payload': None, 'size': None, 'bits_per_channel': None, 'error': None}
+        payload_type, length, bits_per_channel = detected
+        return {'payload': cls.PAYLOAD_NAMES[payload_type], 'size': length,
+                'bits_per_channel': bits_per_channel, 'error': None}
+
+    @classmethod
+    def probe_file(cls, path, strategy, password):
+        """Probes an image file. Runs in a worker process."""
+        return cls.probe(path, strategy, password)
+
+    @classmethod
+    def probe_blob(cls, db_path, blob_id, strategy, password):
+        """Probes image contents stored in the database, streaming only the bytes the probe reads.
+
+        Runs in a worker process, over a read-only connection of its own, so workers neither
+        touch the schema nor write to the database.
+
+        Args:
+            db_path (str): The path of the database file.
+            blob_id (int): The ID of the blob.
+            strategy (str): The pixel position strategy.
+            password (str): The password for the permuted strategy.
+
+        Returns:
+            dict: The report, without the source.
+        """
+        try:
+            connection = sqlite3.connect(f'file:{pathname2url(abspath(db_path))}?mode=ro', uri=True)
+            image = DbHandler.open_blob_on(connection, blob_id)
+        except sqlite3.Error as e:
+            return {'payload': None, 'size': None, 'bits_per_channel': None, 'error': f'{type(e).__name__}: {e}'}
+        with image:
+            return cls.probe(image, strategy, password)
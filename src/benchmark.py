@@ -0,0 +1,395 @@
+"""Benchmarks for key derivation, encryption, steganography and database queries.
+
+Every benchmark runs in a fresh worker process on synthetic images and payloads generated
+from fixed seeds, so results only depend on the code and the machine. Results are written as
+JSON and can be compared against a saved baseline to flag regressions.
+
+Examples:
+    python benchmark.py -o baseline.json
+    python benchmark.py --compare baseline.json --threshold 0.15
+    python benchmark.py --filter stego --quick
+    python benchmark.py --compare baseline.json --current results.json
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from gc import collect
+from io import BytesIO
+from json import dump, load
+from multiprocessing import get_context
+from os import cpu_count, makedirs
+from os.path import join
+from platform import platform, python_version
+from statistics import median
+from sys import exit, stdout, stderr, platform as sys_platform
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sqlite3
+import numpy as np
+import PIL
+from PIL import Image
+from LsbEngine import LsbEngine
+
+RESOLUTIONS = {'small': (640, 480), 'medium': (1920, 1080), 'large': (4000, 3000)}
+MODES = ('RGB', 'RGBA', 'L')
+SEED = 1234
+ENCRYPT_SIZE = 32 * 2 ** 20
+DB_IMAGE_COUNT = 500
+DB_BLOB_SIZE = 4 * 2 ** 20
+RSS_NOISE_MB = 1.0 # Smaller changes of the RSS growth are never flagged as regressions
+
+def make_image(size, mode, seed=SEED):
+    """Creates a PNG image of random pixels.
+
+    Args:
+        size (tuple): The width and height.
+        mode (str): The PIL image mode.
+        seed (int): The seed of the pixel values.
+
+    Returns:
+        bytes: The PNG data.
+    """
+    channels = len(Image.new(mode, (1, 1)).getbands())
+    shape = (size[1], size[0], channels) if channels > 1 else (size[1], size[0])
+    pixels = np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+    image_stream = BytesIO()
+    Image.fromarray(pixels, mode).save(image_stream, format='PNG', compress_level=1)
+    return image_stream.getvalue()
+
+def make_payload(size, seed=SEED):
+    """Creates random payload bytes."""
+    return np.random.default_rng(seed).bytes(size)
+
+def setup_kdf(workdir):
+    """Times one Argon2id key derivation with the parameters used for new containers."""
+    from ImageOperations import ImageOperations
+    ops = ImageOperations()
+    salts = iter(range(1 << 30)) # A new salt per call, so the key cache never hits
+    return lambda: ops.derive_key(b'benchmark password', next(salts).to_bytes(16, 'big')), None
+
+def setup_crypto(workdir, operation, compression=None, workers=1):
+    """Times encrypting or decrypting a file, without the key derivation.
+
+    With a compression method, the file has 4 bits of entropy per byte, like raw pixel data.
+    With several workers, the chunks are processed in parallel worker processes.
+    """
+    from CryptoContainer import CryptoContainer
+    from KeyDeriver import KeyDeriver
+    key = make_payload(32)
+    container = CryptoContainer(lambda *args: key, KeyDeriver().params)
+    compression = compression or CryptoContainer.COMPRESSION_NONE
+    plaintext_path, container_path, output_path = (join(workdir, name) for name in ('plain', 'enc', 'out'))
+    with open(plaintext_path, 'wb') as f:
+        if compression == CryptoContainer.COMPRESSION_NONE:
+            f.write(make_payload(ENCRYPT_SIZE))
+        else:
+            f.write(np.random.default_rng(0).integers(0, 16, ENCRYPT_SIZE, dtype=np.uint8).tobytes())
+    container.encrypt(plaintext_path, container_path, b'', compression=compression)
+    if operation == 'encrypt':
+        return lambda: container.encrypt(plaintext_path, output_path, b'', compression=compression,
+                                         workers=workers), ENCRYPT_SIZE
+    return lambda: container.decrypt(container_path, output_path, b'', workers=workers), ENCRYPT_SIZE
+
+def setup_stego(workdir, operation, resolution, mode, strategy=LsbEngine.STRATEGY_PRIMES, bits_per_channel=1):
+    """Times hiding or revealing a payload of a quarter of the capacity of a carrier."""
+    from ImageOperations import ImageOperations
+    ops = ImageOperations()
+    carrier = make_image(RESOLUTIONS[resolution], mode)
+    password = 'benchmark' if strategy == LsbEngine.STRATEGY_PERMUTED else None
+    capacity = ops.capacity(carrier, strategy, bits_per_channel)
+    if operation.endswith('text'):
+        payload = make_payload(min(capacity // 4, 4096)).hex()[:min(capacity // 4, 4096)]
+        hide = lambda: ops.hide_text(carrier, payload, BytesIO(), strategy, password, bits_per_channel)
+    else:
+        payload = make_payload(capacity // 4)
+        hide = lambda: ops.hide_image(carrier, payload, BytesIO(), strategy, password, bits_per_channel)
+    width, height = RESOLUTIONS[resolution]
+    pixel_bytes = width * height * len(Image.new(mode, (1, 1)).getbands())
+    if operation.startswith('hide'):
+        return hide, pixel_bytes
+    stego_image = BytesIO()
+    hide().save(stego_image, format='PNG')
+    stego_data = stego_image.getvalue()
+    return lambda: ops.reveal(stego_data, strategy, password), pixel_bytes
+
+def setup_db(workdir, operation):
+    """Times a DbHandler query on a database of DB_IMAGE_COUNT small images."""
+    from DbHandler import DbHandler
+    image_dir = join(workdir, 'images')
+    makedirs(image_dir)
+    for i in range(DB_IMAGE_COUNT):
+        with open(join(image_dir, f'image_{i:05}.png'), 'wb') as f:
+            f.write(make_image((64, 48), 'RGB', SEED + i))
+    db_handler = DbHandler(join(workdir, 'benchmark.db'))
+    db_handler.show_error = lambda msg: None # Errors are raised by the timed calls instead
+    db_handler.import_images(1, image_dir)
+    large_image = make_payload(DB_BLOB_SIZE)
+    db_handler.add_image(1, 'large', large_image)
+    images, has_more = db_handler.get_images_by_user_id(1, 10)
+    image_ids = [image_id for image_id, name in images]
+    last_name = f'image_{DB_IMAGE_COUNT - 20:05}.png'
+    counter = iter(range(1 << 30))
+
+    def read_stream():
+        with db_handler.open_image_data(1, 'large') as image_file:
+            while image_file.read(1 << 20):
+                pass
+
+    def add_and_delete():
+        name = f'new_{next(counter)}'
+        db_handler.add_image(1, name, large_image[:2 ** 20] + name.encode())
+        db_handler.delete_image(1, name)
+
+    operations = {
+        'list_first_page': (lambda: db_handler.get_images_by_user_id(1, 50), None),
+        'list_deep_page': (lambda: db_handler.get_images_by_user_id(1, 50, after=last_name), None),
+        'get_image_by_name': (lambda: db_handler.get_image_by_name(1, last_name), None),
+        'get_thumbnails': (lambda: db_handler.get_thumbnails(image_ids), None),
+        'get_image_data': (lambda: db_handler.get_image_data(1, 'large'), DB_BLOB_SIZE),
+        'open_image_data': (read_stream, DB_BLOB_SIZE),
+        'add_delete_image': (add_and_delete, 2 ** 20),
+    }
+    return operations[operation]
+
+def get_benchmarks(quick=False):
+    """Lists the benchmarks.
+
+    Args:
+        quick (bool): Whether to use only the small resolution for the stego benchmarks.
+
+    Returns:
+        dict: The setup function and its arguments, by benchmark name.
+    """
+    benchmarks = {'kdf.derive_key': (setup_kdf, ())}
+    for operation in ('encrypt', 'decrypt'):
+        benchmarks[f'crypto.{operation}.{ENCRYPT_SIZE >> 20}MiB'] = (setup_crypto, (operation,))
+        benchmarks[f'crypto.{operation}.{ENCRYPT_SIZE >> 20}MiB.zlib'] = (setup_crypto, (operation, 'zlib'))
+        benchmarks[f'crypto.{operation}.{ENCRYPT_SIZE >> 20}MiB.parallel'] = \
+            (setup_crypto, (operation, None, cpu_count()))
+    resolutions = ['small'] if quick else list(RESOLUTIONS)
+    for resolution in resolutions:
+        width, height = RESOLUTIONS[resolution]
+        for mode in MODES:
+            for operation in ('hide_image', 'reveal_image'):
+                benchmarks[f'stego.{operation}.{width}x{height}.{mode}'] = \
+                    (setup_stego, (operation, resolution, mode))
+    for operation in ('hide_text', 'reveal_text'):
+        benchmarks[f'stego.{operation}.640x480.RGB'] = (setup_stego, (operation, 'small', 'RGB'))
+    for strategy in (LsbEngine.STRATEGY_SEQUENTIAL, LsbEngine.STRATEGY_PERMUTED):
+        for operation in ('hide_image', 'reveal_image'):
+            benchmarks[f'stego.{operation}.640x480.RGB.{strategy}'] = \
+                (setup_stego, (operation, 'small', 'RGB', strategy))
+    benchmarks['stego.hide_image.640x480.RGB.4bit'] = (setup_stego, ('hide_image', 'small', 'RGB',
+                                                                     LsbEngine.STRATEGY_PRIMES, 4))
+    for operation in ('list_first_page', 'list_deep_page', 'get_image_by_name', 'get_thumbnails',
+                      'get_image_data', 'open_image_data', 'add_delete_image'):
+        benchmarks[f'db.{operation}'] = (setup_db, (operation,))
+    return benchmarks
+
+def get_rss():
+    """Returns the current and the peak resident set size of the process in MiB.
+
+    Either is None where it is unavailable. Only Linux reports the current size, from
+    /proc/self/status; elsewhere the peak comes from getrusage().
+    """
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(status['VmRSS'].split()[0]) / 1024, int(status['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        from resource import getrusage, RUSAGE_SELF
+    except ImportError:
+        return None, None
+    max_rss = getrusage(RUSAGE_SELF).ru_maxrss
+    return None, max_rss / 2 ** 20 if sys_platform == 'darwin' else max_rss / 1024 # Bytes on macOS, KiB elsewhere
+
+def reset_peak_rss():
+    """Resets the peak resident set size of the process to the current one, on Linux only.
+
+    Returns:
+        bool: Whether the peak was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def measure_rss_growth(run):
+    """Calls run and returns how far the resident set size peaked above its size before the call.
+
+    Fixtures built during setup are excluded. Where the peak cannot be reset, this is the
+    growth of the lifetime peak, so it only shows memory beyond the peak of the setup.
+
+    Returns:
+        float: The growth in MiB, or None if the RSS is unavailable.
+    """
+    collect()
+    if reset_peak_rss():
+        before = get_rss()[0]
+    else:
+        before = get_rss()[1]
+    run()
+    after = get_rss()[1]
+    if before is None or after is None:
+        return None
+    return max(0.0, after - before)
+
+def run_benchmark(name, repeat, quick):
+    """Runs one benchmark. Runs in a fresh worker process.
+
+    The operation runs once to warm up, then repeat times; the median time is reported. The
+    memory reported is how far the RSS peaked during the warm-up and timed runs above the RSS
+    after setup, so fixtures like generated payloads and databases do not count. The warm-up
+    run is included because memory it freed stays resident and would hide the later runs.
+
+    Args:
+        name (str): The benchmark name.
+        repeat (int): The number of timed runs.
+        quick (bool): Passed to get_benchmarks.
+
+    Returns:
+        dict: The milliseconds per operation, the throughput in MB/s (None for operations
+            without a byte size), the number of timed runs and the peak RSS growth in MiB.
+    """
+    setup, args = get_benchmarks(quick)[name]
+    with TemporaryDirectory() as workdir:
+        operation, size = setup(workdir, *args)
+        times = []
+
+        def run():
+            operation()
+            for _ in range(repeat):
+                collect()
+                start = perf_counter()
+                operation()
+                times.append(perf_counter() - start)
+
+        rss_growth = measure_rss_growth(run)
+    seconds = median(times)
+    return {
+        'ms_per_op': seconds * 1000,
+        'mb_per_s': size / 1e6 / seconds if size else None,
+        'ops': repeat,
+        'peak_rss_growth_mb': rss_growth,
+    }
+
+def run_benchmarks(names, repeat, quick):
+    """Runs benchmarks one after another, each in a new process.
+
+    Returns:
+        dict: The results and the environment they were measured in.
+    """
+    results = {}
+    context = get_context('spawn')
+    for name in names:
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            try:
+                results[name] = executor.submit(run_benchmark, name, repeat, quick).result()
+            except Exception as e:
+                print(f'FAIL {name}: {type(e).__name__}: {e}', file=stderr)
+                continue
+        result = results[name]
+        throughput = f"{result['mb_per_s']:9.1f} MB/s" if result['mb_per_s'] else ' ' * 14
+        print(f"{name:48} {result['ms_per_op']:10.2f} ms/op {throughput}", file=stderr, flush=True)
+    return {
+        'environment': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': python_version(),
+            'platform': platform(),
+            'cpu_count': cpu_count(),
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+def compare(baseline, current, threshold):
+    """Prints the change of every benchmark against a baseline and flags regressions.
+
+    A benchmark regresses when its time per operation or the growth of its peak RSS during
+    the timed runs grew by more than the threshold, and the latter by at least RSS_NOISE_MB.
+    Baselines from before the RSS growth was recorded are only compared by time.
+
+    Args:
+        baseline (dict): The baseline report.
+        current (dict): The current report.
+        threshold (float): The allowed relative growth, 0.1 for 10 %.
+
+    Returns:
+        list: The names of the regressed benchmarks.
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f'{name:48} new')
+            continue
+        time_change = result['ms_per_op'] / base['ms_per_op'] - 1
+        rss, base_rss = result.get('peak_rss_growth_mb'), base.get('peak_rss_growth_mb')
+        rss_change = rss / base_rss - 1 if rss is not None and base_rss else 0
+        regressed = time_change > threshold or \
+            (rss_change > threshold and rss - base_rss >= RSS_NOISE_MB)
+        if regressed:
+            regressions.append(name)
+        print(f"{name:48} {base['ms_per_op']:10.2f} -> {result['ms_per_op']:10.2f} ms/op ({time_change:+7.1%}) "
+              f"RSS {rss_change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    for name in baseline['results'].keys() - current['results'].keys():
+        print(f'{name:48} missing')
+    return regressions
+
+def parse_args(argv=None):
+    """Parses the command-line arguments."""
+    parser = ArgumentParser(description='Benchmark CryptoCanvas operations.')
+    parser.add_argument('-o', '--output', help='Write the JSON report to this file (default: stdout).')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Timed runs per benchmark (default: 5).')
+    parser.add_argument('-k', '--filter', default='', help='Only run benchmarks whose name contains this text.')
+    parser.add_argument('--quick', action='store_true', help='Only benchmark stego on small images.')
+    parser.add_argument('--list', action='store_true', help='List the benchmarks and exit.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against a saved JSON report.')
+    parser.add_argument('--current', metavar='REPORT',
+                        help='With --compare, compare this saved report instead of running the benchmarks.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown or memory growth flagged as a regression (default: 0.1).')
+    args = parser.parse_args(argv)
+    if args.current and not args.compare:
+        parser.error('--current requires --compare')
+    return args
+
+def main(argv=None):
+    """Runs the benchmarks.
+
+    Returns:
+        int: The exit status, 1 if a benchmark regressed against the baseline.
+    """
+    args = parse_args(argv)
+    names = [name for name in get_benchmarks(args.quick) if args.filter in name]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+    if args.current:
+        with open(args.current, 'r', encoding='utf-8') as f:
+            report = load(f)
+    else:
+        report = run_benchmarks(names, args.repeat, args.quick)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                dump(report, f, indent=2)
+        elif not args.compare:
+            dump(report, stdout, indent=2)
+            print()
+    if not args.compare:
+        return 0
+    with open(args.compare, 'r', encoding='utf-8') as f:
+        baseline = load(f)
+    regressions = compare(baseline, report, args.threshold)
+    print(f'{len(regressions)} regression(s) above {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    exit(main())
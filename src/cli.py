@@ -0,0 +1,434 @@
+"""Command-line interface for running CryptoCanvas operations on many files without the GUI.
+
+Examples:
+    python cli.py encrypt photos/ -o encrypted/
+    python cli.py encrypt scans/ -o encrypted/ --compress lzma --level 9
+    python cli.py decrypt "encrypted/*.enc" -o decrypted/ --workers 4
+    python cli.py encrypt video.raw -o encrypted/ --workers 1 --chunk-workers 8
+    python cli.py hide-text carriers/ -o stego/ --text "secret" --strategy sequential
+    python cli.py reveal stego/ -o revealed/
+    python cli.py hide-image carriers/ -o stego/ --secret large.png --shards
+    python cli.py reveal stego/ -o revealed/ --shards
+    python cli.py compact --db CryptoCanvas.db
+    python cli.py metrics --db CryptoCanvas.db --since-hours 24 --operation stego.
+    python cli.py scan photos/ -r --json report.json
+    python cli.py scan --db CryptoCanvas.db --strategy sequential
+"""
+from argparse import ArgumentParser
+import sqlite3
+from json import dump
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from getpass import getpass
+from glob import glob
+from os import makedirs, remove
+from os.path import isdir, isfile, join, basename, splitext, getsize, exists
+from time import perf_counter, time
+from sys import exit, stderr
+from LsbEngine import LsbEngine
+from CryptoContainer import CryptoContainer
+
+operations = None # ImageOperations of the worker process, created on first use
+
+def get_operations():
+    """Returns the ImageOperations of the current process."""
+    global operations
+    if operations is None:
+        from ImageOperations import ImageOperations
+        operations = ImageOperations()
+    return operations
+
+def get_output_path(command, source, output_dir, payload_type=None):
+    """Builds the output path of a file.
+
+    Args:
+        command (str): The CLI command.
+        source (str): The input file.
+        output_dir (str): The output directory.
+        payload_type (int): The revealed payload type, for the reveal command.
+
+    Returns:
+        str: The output path.
+    """
+    name = basename(source)
+    stem = splitext(name)[0]
+    if command == 'encrypt':
+        return join(output_dir, name + '.enc')
+    if command == 'decrypt':
+        return join(output_dir, stem if name.endswith('.enc') else name + '.dec')
+    if command == 'reveal':
+        return join(output_dir, stem + ('_revealed.txt' if payload_type == LsbEngine.PAYLOAD_TEXT else '_revealed.png'))
+    return join(output_dir, stem + '_stego.png')
+
+def process_file(command, source, output_dir, options):
+    """Runs one command on one file. Runs in a worker process.
+
+    Args:
+        command (str): The CLI command.
+        source (str): The input file.
+        output_dir (str): The output directory.
+        options (dict): The command options.
+
+    Returns:
+        tuple: The output path and the number of input bytes processed.
+    """
+    ops = get_operations()
+    destination = None if command == 'reveal' else get_output_path(command, source, output_dir)
+    try:
+        if command == 'encrypt':
+            ops.encrypt(source, destination, options['password'], compression=options['compression'],
+                        level=options['level'], workers=options['chunk_workers'])
+        elif command == 'decrypt':
+            ops.decrypt(source, destination, options['password'], workers=options['chunk_workers'])
+        elif command == 'hide-text':
+            ops.hide_text(source, options['text'], destination, options['strategy'],
+                          options['stego_password'], options['bits_per_channel'])
+        elif command == 'hide-image':
+            ops.hide_image(source, options['secret'], destination, options['strategy'],
+                           options['stego_password'], options['bits_per_channel'])
+        else:
+            payload_type, payload = ops.reveal(source, options['strategy'], options['stego_password'])
+            destination = get_output_path(command, source, output_dir, payload_type)
+            if payload_type == LsbEngine.PAYLOAD_TEXT:
+                with open(destination, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+            else:
+                with open(destination, 'wb') as f:
+                    f.write(payload)
+    except Exception:
+        if destination and exists(destination):
+            remove(destination) # Drop partial output
+        raise
+    return destination, getsize(source)
+
+def process_shards(command, files, output_dir, options, workers):
+    """Spreads one payload over all the files, or reveals one payload spread over them.
+
+    Args:
+        command (str): The CLI command, hide-text, hide-image or reveal.
+        files (list): The carrier or stego images, in any order.
+        output_dir (str): The output directory.
+        options (dict): The command options.
+        workers (int): The number of worker processes, the number of CPUs if None.
+
+    Returns:
+        list: The output paths.
+    """
+    ops = get_operations()
+    if command == 'reveal':
+        payload_type, payload = ops.reveal_shards(files, options['strategy'], options['stego_password'], workers)
+        destination = get_output_path(command, 'payload', output_dir, payload_type)
+        if payload_type == LsbEngine.PAYLOAD_TEXT:
+            with open(destination, 'w', encoding='utf-8') as f:
+                f.write(payload)
+        else:
+            with open(destination, 'wb') as f:
+                f.write(payload)
+        return [destination]
+    destinations = [get_output_path(command, source, output_dir) for source in files]
+    if command == 'hide-text':
+        ops.hide_text_shards(files, options['text'], destinations, options['strategy'],
+                             options['stego_password'], options['bits_per_channel'], workers)
+    else:
+        ops.hide_image_shards(files, options['secret'], destinations, options['strategy'],
+                              options['stego_password'], options['bits_per_channel'], workers)
+    return destinations
+
+def collect_files(patterns, recursive):
+    """Expands files, directories and glob patterns into a sorted list of files.
+
+    Args:
+        patterns (list): The paths and patterns given on the command line.
+        recursive (bool): Whether to include files in subdirectories of directories.
+
+    Returns:
+        list: The file paths.
+    """
+    files = set()
+    for pattern in patterns:
+        if isdir(pattern):
+            pattern = join(pattern, '**', '*') if recursive else join(pattern, '*')
+        files.update(path for path in glob(pattern, recursive=recursive) if isfile(path))
+    return sorted(files)
+
+def parse_args(argv=None):
+    """Parses the command-line arguments."""
+    parser = ArgumentParser(description='Encrypt, decrypt, hide and reveal images in bulk.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    commands = {
+        'encrypt': 'Encrypt files with AES-256-GCM.',
+        'decrypt': 'Decrypt files encrypted by CryptoCanvas.',
+        'hide-text': 'Hide text in carrier images.',
+        'hide-image': 'Hide an image in carrier images.',
+        'reveal': 'Reveal hidden images or text.',
+    }
+    for command, help_text in commands.items():
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument('inputs', nargs='+', help='Files, directories or glob patterns.')
+        subparser.add_argument('-o', '--output', required=True, help='Output directory.')
+        subparser.add_argument('-r', '--recursive', action='store_true',
+                               help='Include files in subdirectories.')
+        subparser.add_argument('-w', '--workers', type=int, default=None,
+                               help='Number of worker processes (default: number of CPUs).')
+        if command in ('encrypt', 'decrypt'):
+            subparser.add_argument('-p', '--password', help='Encryption password (prompted if omitted).')
+            subparser.add_argument('--chunk-workers', type=int, default=1,
+                                   help='Worker processes per file for the chunks of large uncompressed '
+                                        'files (default: 1).')
+        else:
+            subparser.add_argument('--strategy', choices=LsbEngine.STRATEGIES, default=LsbEngine.STRATEGY_PRIMES,
+                                   help='Pixel position strategy.')
+            subparser.add_argument('--stego-password',
+                                   help='Password for the permuted strategy and for authenticating shards.')
+        if command == 'encrypt':
+            subparser.add_argument('--compress', choices=CryptoContainer.COMPRESSIONS,
+                                   default=CryptoContainer.COMPRESSION_NONE,
+                                   help='Compress files before encrypting them, unless already compressed.')
+            subparser.add_argument('--level', type=int, choices=range(10), default=None,
+                                   help='Compression level (default: the library default).')
+        if command in ('hide-text', 'hide-image'):
+            subparser.add_argument('-b', '--bits-per-channel', type=int, default=1,
+                                   choices=range(1, LsbEngine.MAX_BITS_PER_CHANNEL + 1),
+                                   help='Number of LSBs used per color channel.')
+            subparser.add_argument('--shards', action='store_true',
+                                   help='Spread one payload over all the input images instead of hiding it in each, '
+                                        'authenticated with the stego password (prompted if omitted).')
+        if command == 'reveal':
+            subparser.add_argument('--shards', action='store_true',
+                                   help='Reassemble one payload spread over all the input images, checking it '
+                                        'with the stego password (prompted if omitted).')
+        if command == 'hide-text':
+            text = subparser.add_mutually_exclusive_group(required=True)
+            text.add_argument('--text', help='Text to hide.')
+            text.add_argument('--text-file', help='File with the text to hide.')
+        if command == 'hide-image':
+            subparser.add_argument('--secret', required=True, help='Image to hide.')
+    compact = subparsers.add_parser('compact', help='Delete unreferenced images from the database and shrink it.')
+    compact.add_argument('--db', default='CryptoCanvas.db', help='Database file (default: CryptoCanvas.db).')
+    metrics = subparsers.add_parser('metrics', help='Show latency percentiles of the operations timed by the GUI.')
+    metrics.add_argument('--db', default='CryptoCanvas.db', help='Database file (default: CryptoCanvas.db).')
+    metrics.add_argument('--since-hours', type=float, default=None,
+                         help='Only include timings from the last N hours.')
+    metrics.add_argument('--operation', default='', help='Only include operations starting with this prefix.')
+    scan = subparsers.add_parser('scan', help='Find images carrying hidden payloads from their headers.')
+    scan.add_argument('inputs', nargs='*', help='Files, directories or glob patterns.')
+    scan.add_argument('--db', help='Scan the images stored in this database instead of files.')
+    scan.add_argument('-r', '--recursive', action='store_true', help='Include files in subdirectories.')
+    scan.add_argument('-w', '--workers', type=int, default=None,
+                      help='Number of worker processes (default: number of CPUs).')
+    scan.add_argument('--strategy', choices=LsbEngine.STRATEGIES, default=LsbEngine.STRATEGY_PRIMES,
+                      help='Pixel position strategy.')
+    scan.add_argument('--stego-password', help='Password for the permuted strategy.')
+    scan.add_argument('--json', help='Write the report of every image to this JSON file.')
+    scan.add_argument('-a', '--all', action='store_true', help='Also list the images without a payload.')
+    return parser.parse_args(argv)
+
+def open_database(db_path):
+    """Opens a database whose errors are printed to stderr instead of shown in dialogs.
+
+    Args:
+        db_path (str): The database file.
+
+    Returns:
+        tuple: The DbHandler and the list its error messages are collected in.
+    """
+    from DbHandler import DbHandler
+    errors = []
+
+    def on_error(msg):
+        print(msg, file=stderr)
+        errors.append(msg)
+
+    return DbHandler(db_path, on_error=on_error), errors
+
+def compact(db_path):
+    """Deletes the image contents no database image refers to and shrinks the database file.
+
+    Args:
+        db_path (str): The database file.
+
+    Returns:
+        int: The exit status.
+    """
+    if not isfile(db_path):
+        print(f'No database found at {db_path}.')
+        return 1
+    db_handler, errors = open_database(db_path)
+    start = perf_counter()
+    try:
+        if errors:
+            return 1
+        removed, removed_bytes = db_handler.compact()
+    except sqlite3.Error as e:
+        print(f'Database error: {e}', file=stderr)
+        return 1
+    finally:
+        db_handler.disconnect_db()
+    print(f'Deleted {removed} unreferenced images ({removed_bytes / 2 ** 20:.1f} MiB) '
+          f'in {perf_counter() - start:.2f} s')
+    return 0
+
+def show_metrics(db_path, since_hours=None, operation=''):
+    """Prints the latency percentiles of the operation timings saved in the database.
+
+    Args:
+        db_path (str): The database file.
+        since_hours (float): Only include timings from the last since_hours hours.
+        operation (str): Only include operations whose name starts with this prefix.
+
+    Returns:
+        int: The exit status.
+    """
+    if not isfile(db_path):
+        print(f'No database found at {db_path}.')
+        return 1
+    from Metrics import Metrics
+    db_handler, errors = open_database(db_path)
+    try:
+        if errors:
+            return 1
+        records = db_handler.get_metrics(time() - since_hours * 3600 if since_hours else None, operation)
+    except sqlite3.Error as e:
+        print(f'Database error: {e}', file=stderr)
+        return 1
+    finally:
+        db_handler.disconnect_db()
+    if not records:
+        print('No timings recorded.')
+        return 0
+    print(Metrics.format_summary(Metrics.summarize(records)))
+    return 0
+
+def scan(args):
+    """Probes files or the images stored in a database for hidden payloads and prints a report.
+
+    Args:
+        args (argparse.Namespace): The parsed scan arguments.
+
+    Returns:
+        int: The exit status, 1 if no images were found or any image failed.
+    """
+    from StegoScanner import StegoScanner
+    password = args.stego_password
+    if args.strategy == LsbEngine.STRATEGY_PERMUTED and not password:
+        password = getpass('Pixel order password: ')
+    scanner = StegoScanner(args.strategy, password, args.workers)
+    start = perf_counter()
+    if args.db:
+        if not isfile(args.db):
+            print(f'No database found at {args.db}.')
+            return 1
+        db_handler, errors = open_database(args.db)
+        try:
+            if errors:
+                return 1
+            reports = scanner.scan_database(db_handler)
+        except sqlite3.Error as e:
+            print(f'Database error: {e}', file=stderr)
+            return 1
+        finally:
+            db_handler.disconnect_db()
+    else:
+        files = collect_files(args.inputs, args.recursive)
+        if not files:
+            print('No input files found.')
+            return 1
+        reports = scanner.scan_files(files)
+    elapsed = perf_counter() - start
+    found = failed = 0
+    for report in reports:
+        source = report['source'] if 'user_id' not in report else f"user {report['user_id']}: {report['source']}"
+        if report['error']:
+            failed += 1
+            print(f"FAIL  {source}: {report['error']}")
+        elif report['payload']:
+            found += 1
+            print(f"FOUND {source}: {report['payload']}, {report['size']} bytes "
+                  f"(bits per channel: {report['bits_per_channel']})")
+        elif args.all:
+            print(f'NONE  {source}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            dump(reports, f, indent=2)
+    print(f'{len(reports)} scanned, {found} with payloads, {failed} failed in {elapsed:.2f} s '
+          f'({len(reports) / elapsed:.1f} images/s)')
+    return 1 if failed or not reports else 0
+
+def get_options(args):
+    """Builds the options passed to the workers from the parsed arguments."""
+    options = {}
+    if args.command in ('encrypt', 'decrypt'):
+        password = args.password if args.password is not None else getpass('Password: ')
+        options['password'] = password.encode('utf-8')
+        options['chunk_workers'] = args.chunk_workers
+        options['compression'] = getattr(args, 'compress', CryptoContainer.COMPRESSION_NONE)
+        options['level'] = getattr(args, 'level', None)
+        return options
+    options['strategy'] = args.strategy
+    options['stego_password'] = args.stego_password
+    if args.strategy == LsbEngine.STRATEGY_PERMUTED and not args.stego_password:
+        options['stego_password'] = getpass('Pixel order password: ')
+    elif getattr(args, 'shards', False) and not args.stego_password:
+        options['stego_password'] = getpass('Shard password: ')
+    options['bits_per_channel'] = getattr(args, 'bits_per_channel', 1)
+    if args.command == 'hide-text':
+        if args.text_file:
+            with open(args.text_file, 'r', encoding='utf-8') as f:
+                options['text'] = f.read()
+        else:
+            options['text'] = args.text
+    if args.command == 'hide-image':
+        options['secret'] = args.secret
+    return options
+
+def main(argv=None):
+    """Runs the CLI.
+
+    Returns:
+        int: The exit status, 1 if any file failed.
+    """
+    args = parse_args(argv)
+    if args.command == 'compact':
+        return compact(args.db)
+    if args.command == 'metrics':
+        return show_metrics(args.db, args.since_hours, args.operation)
+    if args.command == 'scan':
+        return scan(args)
+    files = collect_files(args.inputs, args.recursive)
+    if not files:
+        print('No input files found.')
+        return 1
+    options = get_options(args)
+    makedirs(args.output, exist_ok=True)
+    start = perf_counter()
+    if getattr(args, 'shards', False):
+        try:
+            destinations = process_shards(args.command, files, args.output, options, args.workers)
+        except Exception as e:
+            print(f'FAIL {type(e).__name__}: {e}')
+            return 1
+        for destination in destinations:
+            print(f'OK   {destination}')
+        print(f'{len(files)} images in {perf_counter() - start:.2f} s')
+        return 0
+    succeeded = failed = total_bytes = 0
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = {executor.submit(process_file, args.command, source, args.output, options): source
+                   for source in files}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                destination, size = future.result()
+            except Exception as e:
+                failed += 1
+                print(f'FAIL {source}: {type(e).__name__}: {e}')
+                continue
+            succeeded += 1
+            total_bytes += size
+            print(f'OK   {source} -> {destination}')
+    elapsed = perf_counter() - start
+    print(f'{succeeded} succeeded, {failed} failed, {total_bytes / 2 ** 20:.1f} MiB in {elapsed:.2f} s '
+          f'({total_bytes / 2 ** 20 / elapsed:.1f} MiB/s, {len(files) / elapsed:.1f} files/s)')
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    exit(main())
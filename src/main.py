@@ -1,9 +1,13 @@
-from os import remove
-from os.path import basename
+from os.path import basename, getsize
 from tkinter import Tk, Button, Label, Listbox, END, DISABLED, NORMAL, \
-    messagebox, filedialog, simpledialog, Frame
+    messagebox, filedialog, simpledialog, Frame, StringVar, IntVar, OptionMenu, Scrollbar, Toplevel, Text
 from Authenticator import Authenticator
 from ImageHandler import ImageHandler
+from LsbEngine import LsbEngine
+from JobRunner import JobRunner, JobCancelled
+from PreviewCache import PreviewCache
+from CryptoContainer import CryptoContainer
+from Metrics import Metrics
 from tempfile import NamedTemporaryFile
 from sqlite3 import IntegrityError
 from PIL import Image, ImageTk, UnidentifiedImageError
@@ -14,11 +18,18 @@ class CryptoCanvas:
 
     def __init__(self):
         """Initializes the CryptoCanvas application."""
-        self.Auth = Authenticator()
-        self.IH = ImageHandler()
-        self.current_image_page = 1
+        self.jobs = JobRunner(on_progress=self.show_progress)
+        self.Auth = Authenticator(self.jobs)
+        self.IH = ImageHandler(self.jobs)
         self.images_per_page = 10
+        self.images_per_fetch = 50
+        self.max_loaded_images = 200
+        self.has_more_before = False
+        self.has_more_after = False
+        self.loading_images = False
         self.photo_image = None
+        self.image_ids = {}
+        self.preview_cache = PreviewCache()
         self.create_gui()
 
     def create_gui(self):
@@ -26,6 +37,8 @@ class CryptoCanvas:
         self.main_window = Tk()
         self.main_window.title("CryptoCanvas")
         self.main_window.resizable(width=False, height=False)
+        self.main_window.protocol("WM_DELETE_WINDOW", self.quit) # Closing the window also flushes metrics
+        self.jobs.root = self.main_window
 
         self.status = Label(self.main_window, font=("Times", 12),
                             text="Signed out")
@@ -33,11 +46,22 @@ class CryptoCanvas:
 
         self.create_auth_buttons()
         self.create_image_buttons()
+        self.create_stego_options()
+        self.create_crypto_options()
         self.create_image_listbox()
         self.quit_button = Button(self.main_window, text="Quit",
                                   command=self.quit)
         self.quit_button.grid(row=5, column=4, sticky="we")
-
+        self.capacity_label = Label(self.main_window, text="")
+        self.capacity_label.grid(row=6, column=0, columnspan=3)
+        self.progress_label = Label(self.main_window, text="")
+        self.progress_label.grid(row=6, column=3)
+        self.cancel_button = Button(self.main_window, text="Cancel",
+                                    command=self.jobs.cancel_all, state=DISABLED)
+        self.cancel_button.grid(row=6, column=4, sticky="we")
+
+        self.jobs.submit(self.Auth.db_handler.backfill_thumbnails,
+                         on_error=lambda e: None) # Previews fall back to the full images
         self.main_window.mainloop()
 
     def create_auth_buttons(self):
@@ -75,13 +99,42 @@ class CryptoCanvas:
         self.hide_text_button.grid(row=5, column=0, sticky="we")
         self.reveal_text_button.grid(row=5, column=1, sticky="we")
 
+    def create_stego_options(self):
+        """Creates the selectors for the pixel position strategy and bit depth used by the stego operations."""
+        self.strategy = StringVar(self.main_window, value=LsbEngine.STRATEGY_PRIMES)
+        self.strategy_label = Label(self.main_window, text="Pixel order:")
+        self.strategy_menu = OptionMenu(self.main_window, self.strategy, *LsbEngine.STRATEGIES)
+        self.bits_per_channel = IntVar(self.main_window, value=1)
+        self.bits_per_channel_label = Label(self.main_window, text="Bits per channel:")
+        self.bits_per_channel_menu = OptionMenu(self.main_window, self.bits_per_channel,
+                                                *range(1, LsbEngine.MAX_BITS_PER_CHANNEL + 1))
+
+        self.strategy_label.grid(row=4, column=2, sticky="e")
+        self.strategy_menu.grid(row=4, column=3, columnspan=2, sticky="we")
+        self.bits_per_channel_label.grid(row=5, column=2, sticky="e")
+        self.bits_per_channel_menu.grid(row=5, column=3, sticky="we")
+
+    def create_crypto_options(self):
+        """Creates the selector for the compression applied before encryption."""
+        self.compression = StringVar(self.main_window, value=CryptoContainer.COMPRESSION_NONE)
+        self.compression_label = Label(self.main_window, text="Compression:")
+        self.compression_menu = OptionMenu(self.main_window, self.compression, *CryptoContainer.COMPRESSIONS)
+
+        self.compression_label.grid(row=7, column=0, sticky="e")
+        self.compression_menu.grid(row=7, column=1, sticky="we")
+
     def create_image_listbox(self):
         """Creates a listbox to display images and related controls."""
         self.image_display_frame = Frame(self.main_window, bg="white")
         self.image_display_frame.pack_propagate(False)
         self.image_display = Label(self.image_display_frame, bg="white", fg="black", text="No image selected.")
         self.image_display.pack(expand=True, fill="both")
-        self.images_listbox = Listbox(self.main_window)
+        self.images_list_frame = Frame(self.main_window)
+        self.images_listbox = Listbox(self.images_list_frame, height=self.images_per_page)
+        self.images_scrollbar = Scrollbar(self.images_list_frame, command=self.images_listbox.yview)
+        self.images_listbox.config(yscrollcommand=self.on_images_list_scrolled)
+        self.images_listbox.pack(side="left", expand=True, fill="both")
+        self.images_scrollbar.pack(side="right", fill="y")
         self.next_page_button = Button(self.main_window, text="Next Page",
                                        command=self.show_next_page,
                                        state=DISABLED)
@@ -92,21 +145,29 @@ class CryptoCanvas:
                                  command=self.add_image, state=DISABLED)
         self.delete_button = Button(self.main_window, text="Delete image",
                                  command=self.delete_image, state=DISABLED)
+        self.import_button = Button(self.main_window, text="Import folder",
+                                    command=self.import_folder, state=DISABLED)
 
         self.image_display_frame.grid(row=1, column=0, columnspan=3, sticky="wens")
-        self.images_listbox.grid(row=1, column=3, columnspan=2, sticky="wens")
+        self.images_list_frame.grid(row=1, column=3, columnspan=2, sticky="wens")
         self.prev_page_button.grid(row=2, column=3, sticky="we")
         self.next_page_button.grid(row=2, column=4, sticky="we")
         self.add_button.grid(row=3, column=3, sticky="we")
         self.delete_button.grid(row=3, column=4, sticky="we")
+        self.import_button.grid(row=3, column=2, sticky="we")
 
         self.images_listbox.bind("<<ListboxSelect>>", self.on_listbox_select)
         self.main_window.bind("<Left>", lambda event: self.show_prev_page() if self.prev_page_button['state'] == 'normal' else None)
         self.main_window.bind("<Right>", lambda event: self.show_next_page() if self.next_page_button['state'] == 'normal' else None)
+        self.main_window.bind("<F12>", lambda event: self.show_diagnostics())
 
     def on_sign_up(self):
         """Handles the Sign Up button click event."""
-        self.Auth.sign_up()
+        with self.jobs.using(self.sign_in_button, self.sign_up_button):
+            self.Auth.sign_up(on_done=self.on_signed_up)
+
+    def on_signed_up(self):
+        """Updates the GUI once the user has signed up."""
         if self.Auth.logged_in:
             self.update_button_states()
             self.status.config(
@@ -114,7 +175,11 @@ class CryptoCanvas:
 
     def on_sign_in(self):
         """Handles the Sign In button click event."""
-        self.Auth.sign_in()
+        with self.jobs.using(self.sign_in_button, self.sign_up_button):
+            self.Auth.sign_in(on_done=self.on_signed_in)
+
+    def on_signed_in(self):
+        """Updates the GUI once the user has signed in."""
         if self.Auth.logged_in:
             self.update_images_list()
             self.status.config(
@@ -125,71 +190,139 @@ class CryptoCanvas:
         self.Auth.sign_out()
         if not self.Auth.logged_in:
             self.images_listbox.delete(0, END)
-            self.current_image_page = 1
+            self.image_ids = {}
+            self.has_more_before = self.has_more_after = False
+            self.preview_cache.clear()
             self.clear_image_display()
             self.update_button_states()
             self.status.config(text="Signed out")
 
     def on_encrypt_image(self):
         """Handles the Encrypt Image button click event."""
-        image_data = self.get_image_data()
-        if image_data:
-            self.IH.encrypt_image(image_data)
+        image = self.get_image_source()
+        if image:
+            with self.jobs.using(self.encrypt_button, cleanup=self.get_image_source_cleanup(image)):
+                self.IH.encrypt_image(image, self.compression.get())
 
     def on_decrypt_image(self):
         """Handles the Decrypt Image button click event."""
-        image_data = self.get_image_data()
-        if image_data:
-            self.IH.decrypt_image(image_data)
+        image = self.get_image_source()
+        if image:
+            with self.jobs.using(self.decrypt_button, cleanup=self.get_image_source_cleanup(image)):
+                self.IH.decrypt_image(image)
 
     def on_hide_image(self):
         """Handles the Hide Image button click event."""
-        carrier_image_path, is_from_db = self.get_image_filepath()
-        if not carrier_image_path:
+        carrier_image = self.get_image_source()
+        if not carrier_image:
             return
+        cleanup = self.get_image_source_cleanup(carrier_image)
         secret_image_data = self.get_image_data()
         if not secret_image_data:
-            if is_from_db:
-                remove(carrier_image_path)
+            if cleanup:
+                cleanup()
             return
-        self.IH.hide_image(carrier_image_path, secret_image_data)
-        if is_from_db:
-            remove(carrier_image_path)
+        self.show_capacity(carrier_image, getsize(secret_image_data) if isinstance(secret_image_data, str)
+                           else len(secret_image_data))
+        with self.jobs.using(self.hide_image_button, cleanup=cleanup):
+            self.IH.hide_image(carrier_image, secret_image_data, self.strategy.get(),
+                              self.bits_per_channel.get(), self.get_save_to_db())
 
     def on_reveal_image(self):
         """Handles the Reveal Image button click event."""
-        image_path, is_from_db = self.get_image_filepath()
-        if not image_path:
+        image = self.get_image_source()
+        if not image:
             return
-        self.IH.reveal_image(image_path)
-        if is_from_db:
-            remove(image_path)
+        with self.jobs.using(self.reveal_image_button, cleanup=self.get_image_source_cleanup(image)):
+            self.IH.reveal_image(image, self.strategy.get(), self.get_save_to_db())
 
     def on_hide_text(self):
         """Handles the Hide Text button click event."""
-        image_path, is_from_db = self.get_image_filepath()
-        if not image_path:
+        image = self.get_image_source()
+        if not image:
             return
+        cleanup = self.get_image_source_cleanup(image)
         text = self.get_text_to_hide()
         if not text:
-            if is_from_db:
-                remove(image_path)
+            if cleanup:
+                cleanup()
             return
-        self.IH.hide_text(image_path, text)
-        if is_from_db:
-            remove(image_path)
+        self.show_capacity(image, len(text.encode('utf-8')))
+        with self.jobs.using(self.hide_text_button, cleanup=cleanup):
+            self.IH.hide_text(image, text, self.strategy.get(), self.bits_per_channel.get(),
+                              self.get_save_to_db())
 
     def on_reveal_text(self):
         """Handles the Reveal Text button click event."""
-        image_path, is_from_db = self.get_image_filepath()
-        if not image_path:
+        image = self.get_image_source()
+        if not image:
+            return
+        with self.jobs.using(self.reveal_text_button, cleanup=self.get_image_source_cleanup(image)):
+            self.IH.reveal_text(image, self.strategy.get())
+
+    def get_save_to_db(self):
+        """Returns the callable saving operation results to the database, or None when signed out."""
+        return self.save_image_to_db if self.Auth.logged_in else None
+
+    def save_image_to_db(self, name, image_data):
+        """Adds an image created by an operation to the database and shows it in the list.
+
+        Returns:
+            bool: True if the image was added, False if the name is already in use.
+        """
+        if not self.Auth.logged_in:
+            messagebox.showerror('Error', 'Signed out before the image could be saved.')
+            return False
+        try:
+            self.Auth.db_handler.add_image(self.Auth.current_user.id, name, image_data)
+        except IntegrityError as e:
+            return False
+        self.update_images_list()
+        return True
+
+    def get_image_source_cleanup(self, image):
+        """Returns a callable closing the stream of a database image, or None for device images."""
+        if isinstance(image, str):
+            return None
+        return image.close
+
+    def show_progress(self, jobs):
+        """Shows the progress of the running jobs and enables canceling them."""
+        if not jobs:
+            self.progress_label.config(text="")
+            self.cancel_button.config(state=DISABLED)
+            return
+        progress = [job.progress for job in jobs if job.progress is not None]
+        text = f"Working... {progress[0]:.0%}" if progress else "Working..."
+        self.progress_label.config(text=text)
+        self.cancel_button.config(state=NORMAL)
+
+    def show_capacity(self, carrier_image, payload_size):
+        """Shows whether a payload fits in the carrier with the selected stego options."""
+        try:
+            capacity = self.IH.capacity(carrier_image, self.strategy.get(),
+                                        self.bits_per_channel.get())
+        except UnidentifiedImageError as e:
+            self.capacity_label.config(text="")
             return
-        self.IH.reveal_text(image_path)
-        if is_from_db:
-            remove(image_path)
+        fits = "Fits" if payload_size <= capacity else "Doesn't fit"
+        self.capacity_label.config(text=f"{fits}: {payload_size} of {capacity} bytes")
+        self.main_window.update_idletasks()
+
+    def show_diagnostics(self):
+        """Shows the latency percentiles of the operations timed in this session."""
+        window = Toplevel(self.main_window)
+        window.title("Diagnostics")
+        text = Text(window, font=("Courier", 10), width=80, height=30)
+        text.insert(END, Metrics.format_summary(Metrics.summarize(Metrics.records)))
+        text.config(state=DISABLED)
+        text.pack(fill="both", expand=True)
 
     def quit(self):
-        """Handles the Quit button click event."""
+        """Handles the Quit button click event and the closing of the window."""
+        self.jobs.shutdown()
+        Metrics.flush(self.Auth.db_handler)
+        self.Auth.db_handler.disconnect_db()
         self.main_window.destroy()
 
     def update_button_states(self):
@@ -199,67 +332,207 @@ class CryptoCanvas:
             self.sign_up_button.config(state=DISABLED)
             self.sign_out_button.config(state=NORMAL)
             self.add_button.config(state=NORMAL)
+            self.import_button.config(state=NORMAL)
         else:
             self.sign_in_button.config(state=NORMAL)
             self.sign_up_button.config(state=NORMAL)
             self.sign_out_button.config(state=DISABLED)
             self.add_button.config(state=DISABLED)
+            self.import_button.config(state=DISABLED)
         if self.listbox_has_selection():
             self.delete_button.config(state=NORMAL)
         else:
             self.delete_button.config(state=DISABLED)
-        if self.images_listbox.size() < 10:
-            self.next_page_button.config(state=DISABLED)
-        else:
+        first, last = self.images_listbox.yview()
+        if self.has_more_after or last < 1.0:
             self.next_page_button.config(state=NORMAL)
-        if self.current_image_page > 1:
+        else:
+            self.next_page_button.config(state=DISABLED)
+        if self.has_more_before or first > 0.0:
             self.prev_page_button.config(state=NORMAL)
         else:
             self.prev_page_button.config(state=DISABLED)
 
     def show_next_page(self):
         """Handles the Next Page button click event."""
-        self.current_image_page += 1
-        self.update_images_list()
-        if self.images_listbox.size() == 0:
-            self.current_image_page -= 1
-            self.update_images_list()
-            messagebox.showwarning('Warning', 'No more images in the database.')
+        self.images_listbox.yview_scroll(1, "pages")
+        self.update_button_states()
 
     def show_prev_page(self):
         """Handles the Previous Page button click event."""
-        if self.current_image_page > 1:
-            self.current_image_page -= 1
-            self.update_images_list()
+        self.images_listbox.yview_scroll(-1, "pages")
+        self.update_button_states()
 
     def update_images_list(self):
-        """Updates the list of images displayed in the listbox."""
-        offset = (self.current_image_page - 1) * self.images_per_page
-        images = self.Auth.db_handler.get_images_by_user_id(
-            self.Auth.current_user.id,
-            limit=self.images_per_page,
-            offset=offset)
+        """Reloads the images in the listbox, starting from the first loaded image."""
+        start = self.images_listbox.get(0) if self.has_more_before and self.images_listbox.size() else None
         self.images_listbox.delete(0, END)
-        for image in images:
-            self.images_listbox.insert(END, image)
+        self.image_ids = {}
+        self.has_more_before = start is not None
+        self.load_images(after=start, inclusive=True)
+        if self.images_listbox.size() == 0 and start is not None:
+            self.has_more_before = False
+            self.load_images()
         self.update_button_states()
 
+    def load_images(self, after=None, before=None, inclusive=False):
+        """Fetches the next window of image names around the loaded ones and adds it to the listbox.
+
+        At most max_loaded_images names are kept; names scrolled far out of view are dropped and
+        fetched again when scrolled back to, so the list stays small for any number of images.
+        """
+        images, has_more = self.Auth.db_handler.get_images_by_user_id(
+            self.Auth.current_user.id,
+            limit=self.images_per_fetch,
+            after=after, before=before, inclusive=inclusive)
+        if before is not None:
+            self.has_more_before = has_more
+            for image_id, image_name in reversed(images):
+                self.image_ids[image_name] = image_id
+                self.images_listbox.insert(0, image_name)
+            self.images_listbox.yview_scroll(len(images), "units") # Keep the visible rows in place
+            while self.images_listbox.size() > self.max_loaded_images:
+                self.image_ids.pop(self.images_listbox.get(END), None)
+                self.images_listbox.delete(END)
+                self.has_more_after = True
+        else:
+            self.has_more_after = has_more
+            for image_id, image_name in images:
+                self.image_ids[image_name] = image_id
+                self.images_listbox.insert(END, image_name)
+            trimmed = 0
+            while self.images_listbox.size() > self.max_loaded_images:
+                self.image_ids.pop(self.images_listbox.get(0), None)
+                self.images_listbox.delete(0)
+                self.has_more_before = True
+                trimmed += 1
+            self.images_listbox.yview_scroll(-trimmed, "units")
+        self.prefetch_previews([image_id for image_id, image_name in images])
+
+    def on_images_list_scrolled(self, first, last):
+        """Updates the scrollbar and loads more images when the list is scrolled to either end."""
+        self.images_scrollbar.set(first, last)
+        if self.loading_images or not self.Auth.logged_in:
+            return
+        if float(last) >= 1.0 and self.has_more_after:
+            self.loading_images = True
+            self.main_window.after_idle(self.load_more_images, False)
+        elif float(first) <= 0.0 and self.has_more_before:
+            self.loading_images = True
+            self.main_window.after_idle(self.load_more_images, True)
+        elif hasattr(self, 'next_page_button'):
+            self.update_button_states()
+
+    def load_more_images(self, backwards):
+        """Loads the window of images before or after the loaded ones."""
+        try:
+            if backwards:
+                self.load_images(before=self.images_listbox.get(0))
+            else:
+                self.load_images(after=self.images_listbox.get(END))
+        finally:
+            self.loading_images = False
+        self.update_button_states()
+
+    def get_display_size(self):
+        """Returns the size of the image display."""
+        return self.image_display_frame.winfo_width(), self.image_display_frame.winfo_height()
+
+    def prefetch_previews(self, image_ids):
+        """Decodes the previews of the newly loaded images in a worker and caches them."""
+        size = self.get_display_size()
+        image_ids = [image_id for image_id in image_ids
+                     if self.preview_cache.get(image_id, size) is None]
+        if not image_ids:
+            return
+        generation = self.preview_cache.generation
+
+        def on_done(previews):
+            if generation != self.preview_cache.generation:
+                return # The cache was invalidated while decoding
+            for image_id, image in previews.items():
+                self.cache_preview(image_id, size, image)
+
+        self.jobs.submit(self.decode_previews, image_ids, size, on_done=on_done,
+                         on_error=lambda e: None) # Previews are decoded on selection instead
+
+    def decode_previews(self, image_ids, size):
+        """Loads and decodes the thumbnails of images. Runs in a worker.
+
+        Returns:
+            dict: The decoded images scaled to the display size, by image ID.
+        """
+        previews = {}
+        for image_id, thumbnail in self.Auth.db_handler.get_thumbnails(image_ids).items():
+            try:
+                image = Image.open(BytesIO(thumbnail))
+                image.thumbnail(size)
+                image.load()
+            except (UnidentifiedImageError, OSError):
+                continue
+            previews[image_id] = image
+        return previews
+
+    def cache_preview(self, image_id, size, image):
+        """Converts a decoded image to a PhotoImage and caches it.
+
+        Returns:
+            ImageTk.PhotoImage: The cached preview.
+        """
+        photo_image = ImageTk.PhotoImage(image)
+        self.preview_cache.put(image_id, size, photo_image, image.width * image.height * 4)
+        return photo_image
+
     def add_image(self):
         """Handles the Add Image button click event."""
         image_path = filedialog.askopenfilename(filetypes=[('Image', '*.jpg;*.jpeg;*.png;')])
         if not image_path:
             return
         image_name = basename(image_path)
-        with open(image_path, "rb") as f:
-            image_data = f.read()
         try:
             self.Auth.db_handler.add_image(self.Auth.current_user.id,
-                                           image_name, image_data)
+                                           image_name, image_path)
         except IntegrityError as e:
             return
+        self.preview_cache.clear()
         self.update_images_list()
         messagebox.showinfo('Success', f'Image {image_name} added successfully.')
 
+    def import_folder(self):
+        """Handles the Import Folder button click event. The images are imported in a worker."""
+        directory = filedialog.askdirectory()
+        if not directory:
+            return
+        policies = ', '.join(self.Auth.db_handler.COLLISION_POLICIES)
+        policy = None
+        while policy not in self.Auth.db_handler.COLLISION_POLICIES:
+            policy = simpledialog.askstring('Name collisions',
+                                            f'Images with names already in use ({policies}):',
+                                            initialvalue=self.Auth.db_handler.COLLISION_SKIP)
+            if policy is None:
+                messagebox.showerror('Error', 'Operation canceled.')
+                return
+            policy = policy.strip().lower()
+
+        def on_done(report):
+            self.preview_cache.clear()
+            self.update_images_list()
+            rate = report['imported'] / report['seconds'] if report['seconds'] else 0
+            messagebox.showinfo('Success',
+                                f"Imported {report['imported']} images ({report['bytes'] / 2 ** 20:.1f} MiB) "
+                                f"in {report['seconds']:.1f} s, {rate:.1f} files/s.\n"
+                                f"{report['deduplicated']} were already stored. "
+                                f"Skipped {report['skipped']}, failed {report['failed']}.")
+
+        def on_error(e):
+            self.update_images_list() # Batches written before the error stay imported
+            if not isinstance(e, JobCancelled):
+                messagebox.showerror('Error', f'Import failed: {e}')
+
+        with self.jobs.using(self.add_button, self.import_button):
+            self.jobs.submit(self.Auth.db_handler.import_images, self.Auth.current_user.id, directory, policy,
+                             on_done=on_done, on_error=on_error, report_progress=True)
+
     def delete_image(self):
         """Handles the Delete Image button click event."""
         selected_image = self.images_listbox.curselection()
@@ -270,17 +543,15 @@ class CryptoCanvas:
         selection = messagebox.askquestion('Confirm Delete', f'Are you sure you want to delete {image_name}?')
         if selection == 'yes':
             self.Auth.db_handler.delete_image(self.Auth.current_user.id, image_name)
+            self.preview_cache.invalidate(self.image_ids.get(image_name))
             self.clear_image_display()
             self.update_images_list()
-            if self.images_listbox.size() == 0:
-                self.current_image_page -= 1
-                self.update_images_list()
             messagebox.showinfo('Success', f'Image {image_name} deleted successfully.')
 
     def get_image_data(self):
-        """Retrieves image data from the selected source."""
+        """Retrieves image data from the database selection, or the filepath of an image on the device."""
         if not self.listbox_has_selection():
-            image_data = self.select_image_from_device()
+            image_data = self.select_image_filepath_from_device()
         else:
             selection = messagebox.askyesnocancel('Select Image',
                                                'Do you want to use the database selection?')
@@ -290,30 +561,21 @@ class CryptoCanvas:
             if selection == True:
                 image_data = self.select_image_from_db()
             else:
-                image_data = self.select_image_from_device()
+                image_data = self.select_image_filepath_from_device()
         return image_data
 
-    def get_image_filepath(self):
-        """Retrieves the filepath of the selected image. Images from database use the filename 'temp_image_from_db.png'."""
-        is_from_db = False
+    def get_image_source(self):
+        """Retrieves the selected image as a device filepath or a file object streaming the database image."""
         if not self.listbox_has_selection():
-            filepath = self.select_image_filepath_from_device()
-        else:
-            selected_image = self.images_listbox.curselection()
-            selection = messagebox.askyesnocancel('Select Image',
-                                               'Do you want to use the database selection?')
-            if selection == None:
-                messagebox.showerror('Error', 'Operation canceled.')
-                return None, is_from_db
-            if selection == True:
-                image_data = self.select_image_from_db()
-                with NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-                    temp_file.write(image_data)
-                    filepath = temp_file.name
-                is_from_db = True
-            else:
-                filepath = self.select_image_filepath_from_device()
-        return filepath, is_from_db
+            return self.select_image_filepath_from_device()
+        selection = messagebox.askyesnocancel('Select Image',
+                                              'Do you want to use the database selection?')
+        if selection == None:
+            messagebox.showerror('Error', 'Operation canceled.')
+            return None
+        if selection == True:
+            return self.open_image_from_db()
+        return self.select_image_filepath_from_device()
 
     def select_image_from_db(self):
         """Selects an image from the database.
@@ -325,10 +587,10 @@ class CryptoCanvas:
         selected_image = self.images_listbox.curselection()
         if selected_image:
             image_name = self.images_listbox.get(selected_image[0])
-            image = self.Auth.db_handler.get_image_by_name(
+            image_data = self.Auth.db_handler.get_image_data(
                 self.Auth.current_user.id, image_name)
-            if image:
-                return image[3]
+            if image_data:
+                return image_data
             else:
                 messagebox.showerror('Error', 'Image not found in the database.')
                 return None
@@ -336,21 +598,22 @@ class CryptoCanvas:
             messagebox.showerror('Error', 'No image selected.')
             return None
 
-    def select_image_from_device(self):
-        """Selects an image from the local device.
+    def open_image_from_db(self):
+        """Opens the listbox selection from the database.
 
         Returns:
-            bytes: The data of the selected image.
+            io.BufferedReader: A file object reading the image incrementally, or None.
 
         """
-        filepath = filedialog.askopenfilename(
-            filetypes=[('Image', '*.jpg;*.jpeg;*.png;')])
-        if not filepath:
-            messagebox.showerror('Error', 'Operation canceled.')
+        selected_image = self.images_listbox.curselection()
+        if not selected_image:
+            messagebox.showerror('Error', 'No image selected.')
             return None
-        with open(filepath, 'rb') as file:
-            image_data = file.read()
-        return image_data
+        image_name = self.images_listbox.get(selected_image[0])
+        image = self.Auth.db_handler.open_image_data(self.Auth.current_user.id, image_name)
+        if image is None:
+            messagebox.showerror('Error', 'Image not found in the database.')
+        return image
 
     def select_image_filepath_from_device(self):
         """Retrieves the filepath of an image from the local device."""
@@ -399,35 +662,44 @@ class CryptoCanvas:
         return bool(self.images_listbox.curselection())
 
     def fetch_image_data(self):
-        """Fetches image data based on the listbox selection."""
+        """Fetches the preview thumbnail of the listbox selection, or the image data if it has no thumbnail yet."""
         selected_image = self.images_listbox.curselection()
         if selected_image:
             image_name = self.images_listbox.get(selected_image[0])
-            image = self.Auth.db_handler.get_image_by_name(
+            thumbnail = self.Auth.db_handler.get_thumbnail(
+                self.Auth.current_user.id, image_name)
+            if thumbnail:
+                return thumbnail
+            return self.Auth.db_handler.get_image_data(
                 self.Auth.current_user.id, image_name)
-            if image:
-                return image[3]
         else:
             return None
 
     def display_image(self):
-        """Displays the selected listbox image."""
-        image_data = self.fetch_image_data()
-        if not image_data:
+        """Displays the selected listbox image, from the preview cache when possible."""
+        selected_image = self.images_listbox.curselection()
+        if not selected_image:
             self.clear_image_display()
-        else:
+            return
+        image_id = self.image_ids.get(self.images_listbox.get(selected_image[0]))
+        size = self.get_display_size()
+        tk_image = self.preview_cache.get(image_id, size)
+        if tk_image is None:
+            image_data = self.fetch_image_data()
+            if not image_data:
+                self.clear_image_display()
+                return
             try:
                 image_stream = BytesIO(image_data)
                 image = Image.open(image_stream)
-                width = self.image_display_frame.winfo_width()
-                height = self.image_display_frame.winfo_height()
-                image.thumbnail((width, height))
-                tk_image = ImageTk.PhotoImage(image)
-                self.photo_image = tk_image
-                self.image_display.config(image=self.photo_image)
-                self.image_display.config(text="")
+                image.thumbnail(size)
+                tk_image = self.cache_preview(image_id, size, image)
             except UnidentifiedImageError as e:
                 self.image_display.config(image='', text='Cannot display image.')
+                return
+        self.photo_image = tk_image
+        self.image_display.config(image=self.photo_image)
+        self.image_display.config(text="")
 
     def on_listbox_select(self, event):
         """Handles the listbox selection event."""
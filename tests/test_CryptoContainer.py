@@ -0,0 +1,55 @@
+import sys
+import unittest
+from io import BytesIO
+from os.path import abspath, dirname, join
+from struct import pack_into
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'src'))
+from cryptography.exceptions import InvalidTag
+from CryptoContainer import CryptoContainer
+
+class TestCryptoContainerHeader(unittest.TestCase):
+    """Checks that out-of-range header parameters are rejected before the key is derived."""
+
+    KDF_PARAMS = (1, 47104, 1)
+
+    def setUp(self):
+        self.derived = []
+        self.container = CryptoContainer(self.derive_key, self.KDF_PARAMS, chunk_size=1024)
+        encrypted = BytesIO()
+        self.container.encrypt(BytesIO(b'plaintext' * 500), encrypted, b'password')
+        self.encrypted = encrypted.getvalue()
+        self.derived.clear()
+
+    def derive_key(self, password, salt, time_cost=None, memory_cost=None, parallelism=None):
+        self.derived.append((time_cost, memory_cost, parallelism))
+        return bytes(32)
+
+    def decrypt(self, data):
+        plaintext = BytesIO()
+        self.container.decrypt(BytesIO(data), plaintext, b'password')
+        return plaintext.getvalue()
+
+    def flip(self, fmt, offset, value):
+        data = bytearray(self.encrypted)
+        pack_into(fmt, data, offset, value)
+        return bytes(data)
+
+    def test_valid_container(self):
+        self.assertEqual(self.decrypt(self.encrypted), b'plaintext' * 500)
+
+    def test_out_of_range_fields(self):
+        cases = {
+            'time cost': ('>I', 5, [0, 5, 0xFFFFFFFF]),
+            'memory cost': ('>I', 9, [0, 4 * 47104 + 1, 0xFFFFFFFF]),
+            'parallelism': ('>B', 13, [0, 17, 0xFF]),
+            'chunk size': ('>I', 37, [0, (64 << 20) + 1, 0xFFFFFFFF]),
+        }
+        for field, (fmt, offset, values) in cases.items():
+            for value in values:
+                with self.subTest(field=field, value=value):
+                    with self.assertRaises(InvalidTag):
+                        self.decrypt(self.flip(fmt, offset, value))
+                    self.assertEqual(self.derived, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import sqlite3
+import sys
+import unittest
+from io import BytesIO
+from os.path import abspath, dirname, join
+from tempfile import TemporaryDirectory
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'src'))
+from PIL import Image
+from DbHandler import DbHandler
+
+def make_image(color, size=(8, 8)):
+    """Returns a single-color PNG image as bytes."""
+    output = BytesIO()
+    Image.new('RGB', size, color).save(output, format='PNG')
+    return output.getvalue()
+
+def raise_error(message):
+    """Turns errors the handler would show in a dialog into test failures."""
+    raise AssertionError(message)
+
+class DbHandlerTestCase(unittest.TestCase):
+    """Opens a handler on a database in a temporary directory."""
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.db_path = join(self.directory.name, 'test.db')
+
+    def tearDown(self):
+        if getattr(self, 'db', None) is not None:
+            self.db.disconnect_db()
+        self.directory.cleanup()
+
+    def open_db(self):
+        self.db = DbHandler(self.db_path, on_error=raise_error)
+        return self.db
+
+    def get_blobs(self):
+        """Returns the reference count of every stored blob by content hash."""
+        return dict(self.db.get_connection().execute("SELECT content_hash, ref_count FROM blobs").fetchall())
+
+    def get_hash(self, user_id, name):
+        return self.db.get_image_by_name(user_id, name)[6]
+
+class TestDbHandlerMigration(DbHandlerTestCase):
+    """Checks that databases created by the first version are migrated without losing images."""
+
+    def test_migrates_baseline_schema(self):
+        red, blue = make_image('red'), make_image('blue')
+        connection = sqlite3.connect(self.db_path)
+        connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT UNIQUE, password TEXT)")
+        connection.execute("CREATE TABLE images (id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, data BLOB, "
+                           "UNIQUE(user_id, name))")
+        connection.execute("INSERT INTO users (name, email, password) VALUES ('Ada', 'ada@example.com', 'hash')")
+        connection.executemany("INSERT INTO images (user_id, name, data) VALUES (?, ?, ?)",
+                               [(1, 'red.png', red), (1, 'copy.png', red), (1, 'blue.png', blue),
+                                (2, 'red.png', red)])
+        connection.commit()
+        connection.close()
+
+        db = self.open_db()
+        self.assertEqual(db.get_user('ada@example.com')[1], 'Ada')
+        self.assertEqual(db.get_image_data(1, 'red.png'), red)
+        self.assertEqual(db.get_image_data(1, 'copy.png'), red)
+        self.assertEqual(db.get_image_data(1, 'blue.png'), blue)
+        self.assertEqual(db.get_image_data(2, 'red.png'), red)
+        self.assertEqual(db.get_image_by_name(1, 'blue.png')[2:6], (len(blue), 'image/png', 8, 8))
+        self.assertEqual(self.get_blobs(), {self.get_hash(1, 'red.png'): 3, self.get_hash(1, 'blue.png'): 1})
+        tables = {row[0] for row in db.get_connection().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertNotIn('images_v0', tables)
+
+        db.disconnect_db()
+        db = self.open_db() # Opening a migrated database again must not migrate it twice
+        self.assertEqual(db.get_image_data(1, 'copy.png'), red)
+        self.assertEqual(len(self.get_blobs()), 2)
+
+class TestDbHandlerReferences(DbHandlerTestCase):
+    """Checks blob reference counts and compaction across imports with every collision policy."""
+
+    def setUp(self):
+        super().setUp()
+        self.open_db()
+        self.images = {color: make_image(color) for color in ('red', 'green', 'blue')}
+        self.db.add_image(1, 'photo.png', self.images['red'])
+        self.db.add_image(1, 'copy.png', self.images['red'])
+        self.red_hash = self.get_hash(1, 'photo.png')
+
+    def import_file(self, color, policy):
+        path = join(self.directory.name, 'photo.png')
+        with open(path, 'wb') as f:
+            f.write(self.images[color])
+        return self.db.import_images(1, [path], policy)
+
+    def test_shared_content_is_stored_once(self):
+        self.assertEqual(self.get_blobs(), {self.red_hash: 2})
+        self.db.delete_image(1, 'copy.png')
+        self.assertEqual(self.get_blobs(), {self.red_hash: 1})
+        self.assertEqual(self.db.compact(), (0, 0))
+        self.assertEqual(self.db.get_image_data(1, 'photo.png'), self.images['red'])
+
+    def test_skip(self):
+        report = self.import_file('green', DbHandler.COLLISION_SKIP)
+        self.assertEqual((report['imported'], report['skipped']), (0, 1))
+        self.assertEqual(self.get_blobs(), {self.red_hash: 2})
+        self.assertEqual(self.db.compact(), (0, 0))
+
+    def test_rename(self):
+        report = self.import_file('green', DbHandler.COLLISION_RENAME)
+        self.assertEqual((report['imported'], report['skipped']), (1, 0))
+        self.assertEqual(self.db.get_image_data(1, 'photo (2).png'), self.images['green'])
+        self.assertEqual(self.get_blobs(), {self.red_hash: 2, self.get_hash(1, 'photo (2).png'): 1})
+        self.assertEqual(self.db.compact(), (0, 0))
+
+    def test_rename_duplicate_content(self):
+        report = self.import_file('red', DbHandler.COLLISION_RENAME)
+        self.assertEqual((report['imported'], report['deduplicated']), (1, 1))
+        self.assertEqual(self.get_blobs(), {self.red_hash: 3})
+
+    def test_replace(self):
+        report = self.import_file('green', DbHandler.COLLISION_REPLACE)
+        self.assertEqual((report['imported'], report['skipped']), (1, 0))
+        green_hash = self.get_hash(1, 'photo.png')
+        self.assertEqual(self.db.get_image_data(1, 'photo.png'), self.images['green'])
+        self.assertEqual(self.get_blobs(), {self.red_hash: 1, green_hash: 1})
+        self.db.delete_image(1, 'copy.png')
+        self.assertEqual(self.get_blobs(), {self.red_hash: 0, green_hash: 1})
+        self.assertEqual(self.db.compact(), (1, len(self.images['red'])))
+        self.assertEqual(self.get_blobs(), {green_hash: 1})
+
+    def test_replace_with_same_content(self):
+        self.import_file('red', DbHandler.COLLISION_REPLACE)
+        self.assertEqual(self.get_blobs(), {self.red_hash: 2})
+        self.assertEqual(self.db.compact(), (0, 0))
+
+    def test_compact_recounts_references(self):
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE blobs SET ref_count = 7")
+        self.db.delete_image(1, 'photo.png')
+        self.db.delete_image(1, 'copy.png')
+        self.assertEqual(self.db.compact(), (1, len(self.images['red'])))
+        self.assertEqual(self.get_blobs(), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import sys
+import unittest
+from io import BytesIO
+from os.path import abspath, dirname, join
+from tempfile import TemporaryDirectory
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'src'))
+import numpy as np
+from PIL import Image
+from ImageOperations import ImageOperations
+from LsbEngine import LsbEngine
+from Metrics import Metrics
+
+class TestShards(unittest.TestCase):
+    """Checks that shards are reassembled in any order and that broken sets are rejected."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.operations = ImageOperations()
+        cls.data = np.random.default_rng(0).bytes(1000)
+        cls.shards = cls.operations.split_shards(cls.data, LsbEngine.PAYLOAD_IMAGE, [300, 500, 400], 'secret')
+
+    def join(self, shards, password='secret'):
+        return self.operations.join_shards(shards, password)
+
+    def test_split_follows_capacities(self):
+        header_size = ImageOperations.SHARD_HEADER.size
+        sizes = [len(shard) - header_size for shard in self.shards]
+        self.assertEqual(sum(sizes), len(self.data))
+        for size, capacity in zip(sizes, [300, 500, 400]):
+            self.assertLessEqual(size, capacity)
+        self.assertEqual(self.join(self.shards), (LsbEngine.PAYLOAD_IMAGE, self.data))
+
+    def test_split_fills_exact_capacity(self):
+        shards = self.operations.split_shards(b'x' * 10, LsbEngine.PAYLOAD_TEXT, [3, 3, 4], 'secret')
+        self.assertEqual(self.join(shards), (LsbEngine.PAYLOAD_TEXT, b'x' * 10))
+        with self.assertRaises(ValueError):
+            self.operations.split_shards(b'x' * 11, LsbEngine.PAYLOAD_TEXT, [3, 3, 4], 'secret')
+
+    def test_split_rejects_carriers_without_capacity(self):
+        for capacities in ([], [0, 0]):
+            with self.subTest(capacities=capacities):
+                with self.assertRaises(ValueError):
+                    self.operations.split_shards(b'', LsbEngine.PAYLOAD_TEXT, capacities, 'secret')
+
+    def test_password_is_required(self):
+        with self.assertRaises(ValueError):
+            self.operations.split_shards(self.data, LsbEngine.PAYLOAD_IMAGE, [1000], '')
+        with self.assertRaises(ValueError):
+            self.join(self.shards, None)
+
+    def test_out_of_order(self):
+        for order in ([2, 0, 1], [1, 2, 0], [2, 1, 0]):
+            with self.subTest(order=order):
+                self.assertEqual(self.join([self.shards[i] for i in order]), (LsbEngine.PAYLOAD_IMAGE, self.data))
+
+    def test_missing(self):
+        with self.assertRaisesRegex(ValueError, 'missing: 2'):
+            self.join([self.shards[0], self.shards[2]])
+        with self.assertRaisesRegex(ValueError, 'No shards'):
+            self.join([])
+
+    def test_duplicated(self):
+        self.assertEqual(self.join([self.shards[1], *self.shards, self.shards[1]]),
+                         (LsbEngine.PAYLOAD_IMAGE, self.data))
+        with self.assertRaisesRegex(ValueError, 'missing: 3'):
+            self.join([self.shards[0], self.shards[1], self.shards[1]])
+
+    def test_duplicated_with_different_contents(self):
+        header = ImageOperations.SHARD_HEADER
+        set_id, index, count, payload_type, length, digest, shard_data = self.operations.parse_shard(self.shards[1])
+        forged_data = bytes(len(shard_data))
+        key = self.operations.get_shard_key('secret', set_id)
+        fields = header.pack(set_id, index, count, payload_type, length, bytes(ImageOperations.SHARD_DIGEST_SIZE))
+        forged = header.pack(set_id, index, count, payload_type, length,
+                             self.operations.get_shard_digest(fields, forged_data, key)) + forged_data
+        with self.assertRaisesRegex(ValueError, 'given twice'):
+            self.join([*self.shards, forged])
+
+    def test_mixed_sets(self):
+        other = self.operations.split_shards(self.data, LsbEngine.PAYLOAD_IMAGE, [300, 500, 400], 'secret')
+        with self.assertRaisesRegex(ValueError, 'different payloads'):
+            self.join([self.shards[0], self.shards[1], other[2]])
+
+    def test_tampered(self):
+        header_size = ImageOperations.SHARD_HEADER.size
+        for position in (0, 17, header_size - 1, header_size, len(self.shards[1]) - 1):
+            with self.subTest(position=position):
+                tampered = bytearray(self.shards[1])
+                tampered[position] ^= 1
+                with self.assertRaisesRegex(ValueError, 'Part'):
+                    self.join([self.shards[0], bytes(tampered), self.shards[2]])
+        with self.assertRaisesRegex(ValueError, 'damaged'):
+            self.join([self.shards[0], self.shards[1][:header_size - 1], self.shards[2]])
+        with self.assertRaisesRegex(ValueError, 'damaged'):
+            self.join([self.shards[0], self.shards[1][:-1], self.shards[2]])
+
+    def test_wrong_password(self):
+        with self.assertRaisesRegex(ValueError, 'password is wrong'):
+            self.join(self.shards, 'wrong')
+
+    def test_hide_and_reveal(self):
+        carriers = []
+        for seed in range(3):
+            pixels = np.random.default_rng(seed).integers(0, 256, (80, 80, 3), dtype=np.uint8)
+            carrier = BytesIO()
+            Image.fromarray(pixels).save(carrier, format='PNG')
+            carriers.append(carrier.getvalue())
+        text = 'spread over three carriers ' * 20
+        first = next(Metrics.sequence)
+        with TemporaryDirectory() as directory:
+            destinations = [join(directory, f'part{index}.png') for index in range(3)]
+            self.operations.hide_text_shards(carriers, text, destinations, password='secret', workers=2)
+            revealed = self.operations.reveal_shards(destinations[::-1], password='secret', workers=2)
+        self.assertEqual(revealed, (LsbEngine.PAYLOAD_TEXT, text))
+        operations = [record[2] for record in Metrics.records if record[0] > first]
+        self.assertEqual(operations.count('stego.hide'), 3) # Recorded in the workers
+        self.assertEqual(operations.count('stego.reveal_payload'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
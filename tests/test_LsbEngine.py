@@ -0,0 +1,157 @@
+import sys
+import unittest
+from io import BytesIO
+from os.path import abspath, dirname, join
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'src'))
+import numpy as np
+from PIL import Image
+from LsbEngine import LsbEngine
+
+def make_image(size=(64, 48), mode='RGB', seed=0):
+    """Returns a noisy PNG image as bytes."""
+    width, height = size
+    channels = len(Image.new(mode, (1, 1)).getbands())
+    pixels = np.random.default_rng(seed).integers(0, 256, (height, width, channels), dtype=np.uint8)
+    image = Image.fromarray(pixels.squeeze(axis=2) if channels == 1 else pixels, mode)
+    output = BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+def to_png(image):
+    """Encodes a PIL image as PNG bytes."""
+    output = BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+def primes(count):
+    """Returns the first primes by trial division, independently of LsbEngine's sieve."""
+    found = []
+    candidate = 2
+    while len(found) < count:
+        if all(candidate % prime for prime in found if prime * prime <= candidate):
+            found.append(candidate)
+        candidate += 1
+    return found
+
+def stegano_hide(image_data, message):
+    """Hides a message the way stegano's lsb.hide does with generators.eratosthenes().
+
+    The message is prefixed with its length and a colon, its bits are padded to a multiple
+    of three and written into the red, green and blue LSBs of the prime-indexed pixels.
+    """
+    image = Image.open(BytesIO(image_data)).convert('RGB')
+    width = image.width
+    message = f'{len(message)}:{message}'
+    bits = ''.join(f'{ord(char):08b}' for char in message)
+    bits += '0' * (-len(bits) % 3)
+    pixels = image.load()
+    for index, position in zip(range(0, len(bits), 3), primes(len(bits) // 3)):
+        x, y = position % width, position // width
+        pixels[x, y] = tuple((value & ~1) | int(bit) for value, bit in zip(pixels[x, y], bits[index:index + 3]))
+    return to_png(image)
+
+def stegano_reveal(image_data):
+    """Reveals a message the way stegano's lsb.reveal does with generators.eratosthenes()."""
+    image = Image.open(BytesIO(image_data)).convert('RGB')
+    width = image.width
+    pixels = image.load()
+    bits = ''
+    characters = ''
+    limit = None
+    for position in primes(image.width * image.height):
+        if position >= image.width * image.height:
+            break
+        bits += ''.join(str(value & 1) for value in pixels[position % width, position // width])
+        if len(bits) >= 8:
+            characters += chr(int(bits[:8], 2))
+            bits = bits[8:]
+            if limit is None and characters[-1] == ':':
+                limit = int(characters[:-1])
+                characters = ''
+            elif limit is not None and len(characters) == limit:
+                return characters
+    return None
+
+class TestLsbEngine(unittest.TestCase):
+    """Checks round trips, capacity limits and compatibility with the legacy stegano format."""
+
+    def setUp(self):
+        self.engine = LsbEngine()
+        self.carrier = make_image()
+
+    def test_round_trip_every_strategy_and_depth(self):
+        for strategy in LsbEngine.STRATEGIES:
+            password = 'secret' if strategy == LsbEngine.STRATEGY_PERMUTED else None
+            for bits_per_channel in range(1, LsbEngine.MAX_BITS_PER_CHANNEL + 1):
+                with self.subTest(strategy=strategy, bits_per_channel=bits_per_channel):
+                    capacity = self.engine.capacity(self.carrier, strategy, bits_per_channel)
+                    data = np.random.default_rng(bits_per_channel).bytes(capacity // 2)
+                    stego = to_png(self.engine.hide_payload(self.carrier, data, LsbEngine.PAYLOAD_IMAGE,
+                                                            strategy, password, bits_per_channel))
+                    self.assertEqual(self.engine.reveal_payload(stego, strategy, password),
+                                     (LsbEngine.PAYLOAD_IMAGE, data))
+
+    def test_round_trip_every_mode(self):
+        for mode in ('RGB', 'RGBA', 'L', 'P'):
+            with self.subTest(mode=mode):
+                carrier = to_png(Image.open(BytesIO(self.carrier)).convert(mode))
+                stego = to_png(self.engine.hide_payload(carrier, b'text', LsbEngine.PAYLOAD_TEXT))
+                self.assertEqual(self.engine.reveal_payload(stego), (LsbEngine.PAYLOAD_TEXT, b'text'))
+
+    def test_wrong_password_does_not_reveal(self):
+        stego = to_png(self.engine.hide_payload(self.carrier, b'payload', LsbEngine.PAYLOAD_TEXT,
+                                                LsbEngine.STRATEGY_PERMUTED, 'right'))
+        try:
+            revealed = self.engine.reveal_payload(stego, LsbEngine.STRATEGY_PERMUTED, 'wrong')
+        except IndexError:
+            return
+        self.assertNotEqual(revealed, (LsbEngine.PAYLOAD_TEXT, b'payload'))
+
+    def test_exact_capacity(self):
+        for strategy in LsbEngine.STRATEGIES:
+            for bits_per_channel in (1, 3):
+                with self.subTest(strategy=strategy, bits_per_channel=bits_per_channel):
+                    capacity = self.engine.capacity(self.carrier, strategy, bits_per_channel)
+                    self.assertGreater(capacity, 0)
+                    data = bytes(range(256)) * (capacity // 256) + bytes(capacity % 256)
+                    stego = to_png(self.engine.hide_payload(self.carrier, data, LsbEngine.PAYLOAD_IMAGE,
+                                                            strategy, 'secret', bits_per_channel))
+                    self.assertEqual(self.engine.reveal_payload(stego, strategy, 'secret')[1], data)
+                    with self.assertRaises(ValueError):
+                        self.engine.hide_payload(self.carrier, data + b'x', LsbEngine.PAYLOAD_IMAGE,
+                                                 strategy, 'secret', bits_per_channel)
+
+    def test_capacity_counts_prime_positions(self):
+        prime_count = sum(1 for prime in primes(64 * 48) if prime < 64 * 48)
+        self.assertEqual(self.engine.capacity(self.carrier),
+                         (prime_count * 3 - LsbEngine.HEADER.size * 8) // 8)
+
+    def test_reveals_stegano_messages(self):
+        for message in ('hello', 'cafe', '1234', 'x' * 100):
+            with self.subTest(message=message):
+                stego = stegano_hide(self.carrier, message)
+                self.assertEqual(self.engine.reveal_payload(stego), (LsbEngine.PAYLOAD_LEGACY, message))
+
+    def test_legacy_hide_is_readable_by_stegano(self):
+        for message in ('legacy message', '42', 'x' * 100):
+            with self.subTest(message=message):
+                hidden = to_png(self.engine.hide(self.carrier, message))
+                self.assertEqual(stegano_reveal(hidden), message)
+                self.assertEqual(self.engine.reveal_payload(hidden), (LsbEngine.PAYLOAD_LEGACY, message))
+
+    @unittest.skipUnless(__import__('importlib.util').util.find_spec('stegano'), 'stegano is not installed')
+    def test_stegano_interoperability(self):
+        from stegano import lsb
+        from stegano.lsb import generators
+        stego = BytesIO()
+        lsb.hide(BytesIO(self.carrier), 'from stegano', generators.eratosthenes()).save(stego, format='PNG')
+        self.assertEqual(self.engine.reveal_payload(stego.getvalue()), (LsbEngine.PAYLOAD_LEGACY, 'from stegano'))
+        hidden = to_png(self.engine.hide(self.carrier, 'from CryptoCanvas'))
+        self.assertEqual(lsb.reveal(BytesIO(hidden), generators.eratosthenes()), 'from CryptoCanvas')
+
+    def test_no_payload(self):
+        with self.assertRaises(IndexError):
+            self.engine.reveal_payload(to_png(Image.new('RGB', (64, 48))))
+
+if __name__ == '__main__':
+    unittest.main()